@@ -0,0 +1,107 @@
+"""
+Throughput of utils.clean compared with the old sequential cleaner.
+
+python benchmarks/clean.py [--repeat 5] [--show 10]
+Every line of dataset/golden_test.txt is cleaned as is (with " === ")
+and each of its two sentences separately.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from russian_paraphrasers.utils import clean  # noqa: E402
+
+GOLDEN_TEST = os.path.join(os.path.dirname(__file__), "..", "dataset", "golden_test.txt")
+
+
+def legacy_clean(text):
+    if len(text) > 1:
+        text = text.split("===")[0]
+        text = text.split("\n")[0]
+        text = re.sub('\\n', '\n', text)
+        text = re.sub('<UNK>', '', text)
+        text = re.sub('&amp;', '&', text)
+        text = re.sub('lt;', '', text)
+        text = re.sub('gt;', '', text)
+        text = text.split("< EOS>")[0]
+        text = text.split("<EOS>")[0]
+        text = re.sub('< EOS>', ' ', text)
+        text = re.sub('<s>', '', text)
+        text = re.sub('</s>', '', text)
+        text = re.sub('<EOS>', ' ', text)
+        text = re.sub('< BOS>', ' ', text)
+        text = re.sub('<BOS>', ' ', text)
+        text = re.sub('< SHORT>', ' ', text)
+        text = re.sub('<SHORT>', ' ', text)
+        text = re.sub('<LONG>', ' ', text)
+        text = re.sub('< LONG>', ' ', text)
+        text = re.sub(' ul ', '\n', text)
+        text = re.sub(' pre ', ' ', text)
+        text = re.sub(r' /pre ', ' ', text)
+        text = re.sub(r' / pre ', ' ', text)
+        text = re.sub(r'/code', '\n/code\n', text)
+        text = re.sub(r'/ code', '\n/code\n', text)
+        text = re.sub(' code', '\ncode\n', text)
+        text = re.sub(' hr ', ' ', text)
+        text = re.sub(' e f ', '\n', text)
+        text = re.sub('/h1', '\n', text)
+        text = re.sub('nbsp;', ' ', text)
+        text = re.sub('/blockquote', '\n', text)
+        text = re.sub(' +', ' ', text)
+        text = re.sub('&zwj;', '', text)
+        text = re.sub('.<', '.', text)
+        text = re.sub('/', '.', text)
+        text = re.sub('tml', '', text)
+        text = re.sub("</s", '', text)
+        text = re.sub("..s", '', text)
+        text = re.sub("&#[0-9]+;", "", text)
+        text = text.replace("ћ", "м").replace("ƒ", "д")
+        text = text.replace("(версия 2)", "").replace("(примечание)", "")
+    return text.strip()
+
+
+def load_texts(path):
+    texts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            texts.append(line)
+            texts.extend(part for part in line.split(" === ") if part)
+    return texts
+
+
+def measure(function, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark utils.clean")
+    parser.add_argument("--path", default=GOLDEN_TEST)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--show", type=int, default=10, help="number of different outputs to print")
+    args = parser.parse_args()
+
+    texts = load_texts(args.path)
+    differences = [(text, legacy_clean(text), clean(text)) for text in texts if legacy_clean(text) != clean(text)]
+    print("texts: {}, different outputs: {}".format(len(texts), len(differences)))
+    for text, old, new in differences[:args.show]:
+        print("  {!r}\n    old: {!r}\n    new: {!r}".format(text, old, new))
+
+    legacy_time = measure(legacy_clean, texts, args.repeat)
+    new_time = measure(clean, texts, args.repeat)
+    print("legacy: {:.0f} texts/s".format(len(texts) / legacy_time))
+    print("clean:  {:.0f} texts/s ({:.1f}x)".format(len(texts) / new_time, legacy_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Speed and quality of CPU optimizations (cpu_optimize) on a sample of dataset/golden_test.txt.
+
+python benchmarks/cpu_optimize.py --model_name mt5-small --mode int8 --sample 50
+Speed is measured with generate, quality is the mean negative log-likelihood
+of the golden paraphrases (lower is better), so the delta does not depend on sampling.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser  # noqa: E402
+
+GOLDEN_TEST = os.path.join(os.path.dirname(__file__), "..", "dataset", "golden_test.txt")
+
+
+def load_pairs(path, sample):
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            origin, _, reference = line.strip().partition(" === ")
+            if origin and reference:
+                pairs.append((origin, reference))
+            if len(pairs) >= sample:
+                break
+    return pairs
+
+
+def reference_nll(paraphraser, pairs):
+    import torch
+
+    losses = []
+    with torch.inference_mode():
+        for origin, reference in pairs:
+            if isinstance(paraphraser, GPTParaphraser):
+                prompt = paraphraser.tokenizer.encode("<s>{} === ".format(origin), add_special_tokens=False)
+                target = paraphraser.tokenizer.encode(reference + "</s>", add_special_tokens=False)
+                input_ids = torch.tensor([prompt + target], device=paraphraser.device)
+                labels = torch.tensor([[-100] * len(prompt) + target], device=paraphraser.device)
+            else:
+                input_ids = paraphraser.tokenizer(
+                    "перефразируй: " + origin + "</s>", return_tensors="pt"
+                )["input_ids"].to(paraphraser.device)
+                labels = paraphraser.tokenizer(reference, return_tensors="pt")["input_ids"].to(paraphraser.device)
+            losses.append(float(paraphraser.model(input_ids=input_ids, labels=labels).loss))
+    return sum(losses) / len(losses)
+
+
+def run(args, mode):
+    paraphraser_class = Mt5Paraphraser if args.model_name.startswith("mt5") else GPTParaphraser
+    paraphraser = paraphraser_class(
+        model_name=args.model_name, tokenizer_path=args.tokenizer_path,
+        pretrained_path=args.pretrained_path, cpu_optimize=mode, num_threads=args.threads
+    )
+    pairs = load_pairs(args.path, args.sample)
+    paraphraser.generate(pairs[0][0], n=args.n, seed=0)  # warm up
+    start = time.perf_counter()
+    for origin, _ in pairs:
+        paraphraser.generate(origin, n=args.n, seed=0)
+    elapsed = time.perf_counter() - start
+    report = {
+        "mode": mode or "fp32",
+        "sentences_per_second": len(pairs) / elapsed,
+        "reference_nll": reference_nll(paraphraser, pairs),
+    }
+    paraphraser.unload()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cpu_optimize with plain fp32 inference")
+    parser.add_argument("--model_name", default="mt5-small")
+    parser.add_argument("--tokenizer_path", default="default")
+    parser.add_argument("--pretrained_path", default="default")
+    parser.add_argument("--mode", default="int8", choices=["int8", "bf16", "auto"])
+    parser.add_argument("--sample", type=int, default=50)
+    parser.add_argument("--n", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--path", default=GOLDEN_TEST)
+    args = parser.parse_args()
+
+    baseline = run(args, None)
+    optimized = run(args, args.mode)
+    report = {
+        "baseline": baseline,
+        "optimized": optimized,
+        "speedup": optimized["sentences_per_second"] / baseline["sentences_per_second"],
+        "reference_nll_delta": optimized["reference_nll"] - baseline["reference_nll"],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Check evaluation.evaluate against NLGEval on dataset/golden_test.txt and compare speed.
+
+python benchmarks/evaluation.py [--limit 1000]
+Every origin sentence is the reference, its golden paraphrase and the
+paraphrase of the next line are hypotheses. NLGEval is used when it is
+installed, otherwise the pycocoevalcap scorers NLGEval is built on.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from russian_paraphrasers import evaluation  # noqa: E402
+from russian_paraphrasers.evaluation import METRICS, evaluate  # noqa: E402
+
+GOLDEN_TEST = os.path.join(os.path.dirname(__file__), "..", "dataset", "golden_test.txt")
+
+
+def load_groups(path, limit=None):
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            origin, _, paraphrase = line.strip().partition(" === ")
+            if origin and paraphrase:
+                pairs.append((origin, paraphrase))
+    pairs = pairs[:limit]
+    return [(origin, [paraphrase, pairs[(i + 1) % len(pairs)][1]]) for i, (origin, paraphrase) in enumerate(pairs)]
+
+
+def reference_scorer():
+    """compute_individual_metrics(ref, hyp) and compute_metrics(refs, hyps) as in NLGEval"""
+    try:
+        from nlgeval import NLGEval
+
+        nlgeval = NLGEval(metrics_to_omit=[
+            "EmbeddingAverageCosineSimilairty", "CIDEr", "METEOR", "SkipThoughtCS",
+            "VectorExtremaCosineSimilarity", "GreedyMatchingScore",
+        ])
+        return "nlgeval", nlgeval.compute_individual_metrics, lambda refs, hyps: nlgeval.compute_metrics([refs], hyps)
+    except ImportError:
+        from pycocoevalcap.bleu.bleu import Bleu
+        from pycocoevalcap.rouge.rouge import Rouge
+
+    def compute(refs, hyps):
+        refs = {i: [ref.strip()] for i, ref in enumerate(refs)}
+        hyps = {i: [hyp.strip()] for i, hyp in enumerate(hyps)}
+        # Bleu prints its statistics
+        with contextlib.redirect_stdout(io.StringIO()):
+            bleu, _ = Bleu(4).compute_score(refs, hyps)
+        rouge, _ = Rouge().compute_score(refs, hyps)
+        return dict(zip(METRICS, list(bleu) + [float(rouge)]))
+
+    return "pycocoevalcap", lambda ref, hyp: compute(ref, [hyp]), compute
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and benchmark evaluation.evaluate")
+    parser.add_argument("--path", default=GOLDEN_TEST)
+    parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    groups = load_groups(args.path, args.limit)
+    name, individual, corpus = reference_scorer()
+
+    start = time.perf_counter()
+    expected = [
+        [individual([ref.lower()], hyp.lower()) for hyp in hypotheses]
+        for ref, hypotheses in groups
+    ]
+    reference_time = time.perf_counter() - start
+
+    evaluation._bleu_ngrams.cache_clear()
+    evaluation._rouge_tokens.cache_clear()
+    start = time.perf_counter()
+    result = evaluate(groups)
+    batched_time = time.perf_counter() - start
+
+    pairs = sum(len(hypotheses) for _, hypotheses in groups)
+    print("groups: {}, hypotheses: {}, reference: {}".format(len(groups), pairs, name))
+    for metric in METRICS:
+        diff = max(
+            abs(scores[metric] - got[metric])
+            for group_expected, sentence in zip(expected, result["sentences"])
+            for scores, got in zip(group_expected, sentence["metrics"])
+        )
+        print("  {:8} max abs difference per hypothesis: {:.2e}".format(metric, diff))
+
+    refs = [ref.lower() for ref, hypotheses in groups for _ in hypotheses]
+    hyps = [hyp.lower() for _, hypotheses in groups for hyp in hypotheses]
+    expected_corpus = corpus(refs, hyps)
+    for metric in METRICS:
+        print("  {:8} corpus: {:.6f}, {}: {:.6f}".format(
+            metric, result["corpus"][metric], name, expected_corpus[metric]
+        ))
+
+    print("{} per hypothesis: {:.0f} hypotheses/s".format(name, pairs / reference_time))
+    print("evaluate:        {:.0f} hypotheses/s ({:.1f}x)".format(pairs / batched_time, reference_time / batched_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Near-duplicate index on dataset/golden_test.txt compared with brute force.
+
+python benchmarks/near_duplicates.py
+python benchmarks/near_duplicates.py --copies 100 --queries 1000
+
+The corpus is both sides of the golden pairs, repeated --copies times with a
+number appended to make it larger. Queries are corpus sentences with a few
+characters changed. The script reports build and query time of the index and,
+for a sample of queries, the exact max Jaccard similarity of character n-gram
+sets found by brute force: how many queries above max_jaccard the index finds
+(recall) and how many it reports falsely.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from suite import GOLDEN_TEST  # noqa: E402
+
+
+def ngrams(text, ngram):
+    text = " ".join(text.lower().split()).ljust(ngram)
+    return {text[i:i + ngram] for i in range(len(text) - ngram + 1)}
+
+
+def perturb(sentence, rng, edits):
+    chars = list(sentence)
+    for _ in range(edits):
+        chars[rng.randrange(len(chars))] = rng.choice("абвгдежзик ")
+    return "".join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate index benchmark")
+    parser.add_argument("--corpus", default=GOLDEN_TEST)
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--checked", type=int, default=100, help="queries compared with brute force")
+    parser.add_argument("--max_edits", type=int, default=8)
+    parser.add_argument("--max_jaccard", type=float, default=0.8)
+    args = parser.parse_args()
+
+    from russian_paraphrasers.near_duplicates import NGRAM, NearDuplicateIndex
+
+    golden = []
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        for line in f:
+            golden.extend(side for side in line.strip().split(" === ") if side)
+    corpus = [
+        sentence if copy == 0 else "{} {}".format(sentence, copy)
+        for copy in range(args.copies) for sentence in golden
+    ]
+    rng = random.Random(0)
+    queries = [
+        perturb(rng.choice(golden), rng, rng.randint(0, args.max_edits)) for _ in range(args.queries)
+    ]
+
+    path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        index = NearDuplicateIndex.build(path, corpus, max_jaccard=args.max_jaccard)
+        print("build: {} sentences, {:.2f}s".format(index.size, time.perf_counter() - start))
+        start = time.perf_counter()
+        found = index.is_duplicate(queries)
+        seconds = time.perf_counter() - start
+        print("query: {} candidates, {:.3f}s, {:.0f} candidates/s".format(
+            len(queries), seconds, len(queries) / seconds
+        ))
+
+        # brute force over the golden sentences, copies only add a number
+        golden_ngrams = [ngrams(sentence, NGRAM) for sentence in golden]
+        start = time.perf_counter()
+        relevant, true_positives, false_positives = 0, 0, 0
+        for query, duplicate in zip(queries[:args.checked], found[:args.checked]):
+            query_ngrams = ngrams(query, NGRAM)
+            best = max(len(query_ngrams & other) / len(query_ngrams | other) for other in golden_ngrams)
+            relevant += best >= args.max_jaccard
+            true_positives += bool(duplicate) and best >= args.max_jaccard
+            false_positives += bool(duplicate) and best < args.max_jaccard
+        seconds = time.perf_counter() - start
+        print("brute force: {} candidates, {:.1f}s over {} sentences".format(
+            min(args.checked, len(queries)), seconds, len(golden)
+        ))
+        print("recall {:.3f}, false duplicates {}".format(true_positives / max(relevant, 1), false_positives))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Saving of the shared prompt prefill as the number of samples n grows.
+
+python benchmarks/shared_prefill.py --tiny
+python benchmarks/shared_prefill.py --gpt_name gpt2 --n 1 10 20 50
+
+GPT runs with shared_prefill=False (hugging_face repeats every prompt n times
+and runs all copies through the model) and with shared_prefill=True (the
+prompt is run once and its key-value cache is repeated). For every n it
+reports seconds per generate_batch call and prompt tokens processed by the
+model. mT5 needs no switch: hugging_face runs the encoder before it repeats
+encoder outputs for num_return_sequences, so encoder tokens do not grow with n;
+the mT5 rows show that.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from suite import GOLDEN_TEST, load_sentences  # noqa: E402
+
+
+class TokenCounter:
+    """Counts tokens passed to a module, prefill calls are the ones with more than one position"""
+
+    def __init__(self, module):
+        self.prompt_tokens = 0
+        self.handle = module.register_forward_pre_hook(self, with_kwargs=True)
+
+    def __call__(self, module, args, kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is not None and input_ids.size(-1) > 1:
+            self.prompt_tokens += input_ids.numel()
+
+
+def measure(paraphraser, module, sentences, n, batch_size, repeat, **generate_kwargs):
+    counter = TokenCounter(module)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i in range(0, len(sentences), batch_size):
+            paraphraser.generate_batch(sentences[i:i + batch_size], n=n, seed=0, **generate_kwargs)
+    seconds = (time.perf_counter() - start) / repeat
+    counter.handle.remove()
+    return seconds, counter.prompt_tokens // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared prefill benchmark")
+    parser.add_argument("--tiny", action="store_true", help="tiny random models, works offline")
+    parser.add_argument("--gpt_name", default="gpt2")
+    parser.add_argument("--gpt_path", default=None)
+    parser.add_argument("--mt5_name", default="mt5-small")
+    parser.add_argument("--mt5_path", default=None)
+    parser.add_argument("--skip_mt5", action="store_true")
+    parser.add_argument("--corpus", default=GOLDEN_TEST)
+    parser.add_argument("--sample", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--n", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    parser.add_argument("--max_length", type=int, default=80)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+
+    gpt_path, mt5_path = args.gpt_path, args.mt5_path
+    if args.tiny:
+        from tiny_models import build_tiny_models
+
+        tiny = build_tiny_models()
+        gpt_path, mt5_path = gpt_path or tiny["gpt"], mt5_path or tiny["mt5"]
+    gpt_kwargs = dict(model_name=args.gpt_name, batch_size=args.batch_size)
+    if gpt_path:
+        gpt_kwargs.update(tokenizer_path=gpt_path, pretrained_path=gpt_path)
+    sentences = load_sentences(args.corpus, args.sample)
+
+    gpt = GPTParaphraser(**gpt_kwargs)
+    gpt.generate_batch(sentences[:2], n=2, max_length=args.max_length)
+    print("GPT, {} sentences, batch {}".format(len(sentences), args.batch_size))
+    print("{:>4} {:>12} {:>12} {:>8} {:>14} {:>14}".format(
+        "n", "repeated, s", "shared, s", "saving", "repeated tok", "shared tok"
+    ))
+    for n in args.n:
+        gpt.shared_prefill = False
+        repeated, repeated_tokens = measure(
+            gpt, gpt.model.transformer, sentences, n, args.batch_size, args.repeat, max_length=args.max_length
+        )
+        gpt.shared_prefill = True
+        shared, shared_tokens = measure(
+            gpt, gpt.model.transformer, sentences, n, args.batch_size, args.repeat, max_length=args.max_length
+        )
+        print("{:>4} {:>12.3f} {:>12.3f} {:>7.1f}% {:>14} {:>14}".format(
+            n, repeated, shared, 100 * (1 - shared / repeated), repeated_tokens, shared_tokens
+        ))
+    gpt.unload()
+
+    if args.skip_mt5:
+        return
+    mt5_kwargs = dict(model_name=args.mt5_name, batch_size=args.batch_size)
+    if mt5_path:
+        mt5_kwargs.update(tokenizer_path=mt5_path, pretrained_path=mt5_path)
+    mt5 = Mt5Paraphraser(**mt5_kwargs)
+    mt5.generate_batch(sentences[:2], n=2, max_length=args.max_length)
+    print("mT5, encoder tokens")
+    print("{:>4} {:>12} {:>14}".format("n", "seconds", "encoder tok"))
+    for n in args.n:
+        seconds, tokens = measure(
+            mt5, mt5.model.get_encoder(), sentences, n, args.batch_size, args.repeat, max_length=args.max_length
+        )
+        print("{:>4} {:>12.3f} {:>14}".format(n, seconds, tokens))
+
+
+if __name__ == "__main__":
+    main()
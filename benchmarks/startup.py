@@ -0,0 +1,68 @@
+"""
+Import and cold start time and memory of the paraphrasers.
+
+python benchmarks/startup.py --model_name mt5-small
+python benchmarks/startup.py --model_name mt5-large --low_memory --weights_dtype bfloat16
+Use `python -X importtime -c "import russian_paraphrasers"` to see the import tree.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+
+def measure_import() -> float:
+    code = (
+        "import time; start = time.perf_counter(); import russian_paraphrasers; "
+        "print(time.perf_counter() - start)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return float(output.decode().strip())
+
+
+def peak_rss() -> int:
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and cold start time")
+    parser.add_argument("--model_name", default="mt5-small")
+    parser.add_argument("--range_cand", action="store_true")
+    parser.add_argument("--lazy", action="store_true")
+    parser.add_argument("--path", default=None, help="local model, overrides --model_name paths")
+    parser.add_argument("--low_memory", action="store_true")
+    parser.add_argument("--weights_dtype", default=None, choices=["float16", "bfloat16", "float32"])
+    args = parser.parse_args()
+
+    print("import russian_paraphrasers: {:.3f}s".format(measure_import()))
+
+    from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+    paraphraser_class = Mt5Paraphraser if args.model_name.startswith("mt5") else GPTParaphraser
+    start = time.perf_counter()
+    kwargs = dict(
+        model_name=args.model_name, range_cand=args.range_cand, lazy=args.lazy,
+        low_memory=args.low_memory, weights_dtype=args.weights_dtype
+    )
+    if args.path:
+        kwargs.update(tokenizer_path=args.path, pretrained_path=args.path)
+    paraphraser = paraphraser_class(**kwargs)
+    print("constructor: {:.3f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+    paraphraser.generate("Мама мыла раму.", n=1)
+    print("first generate: {:.3f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+    paraphraser.generate("Мама мыла раму.", n=1)
+    print("second generate: {:.3f}s".format(time.perf_counter() - start))
+    for component, usage in paraphraser.memory_usage().items():
+        print("{}: {}".format(component, ", ".join(
+            "{} {:.1f} MB".format(name, value / 2 ** 20) for name, value in usage.items()
+        )))
+    print("peak RSS: {:.1f} MB".format(peak_rss() / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Benchmark suite of GPT and mT5 paraphrasers on dataset/golden_test.txt.
+
+python benchmarks/suite.py --tiny --output results.json
+python benchmarks/suite.py --families mt5 --mt5_name mt5-small --range_cand --make_eval --output mt5.json
+python benchmarks/suite.py --tiny --compare results.json
+
+Every family runs in a fresh process and reports sentences/s, generated
+tokens/s, p50/p99 latency of generate calls, peak RSS and time of every
+stage (tokenize, generate, decode, clean, rank, eval). With --tiny the
+models are tiny random ones built by tiny_models.py, nothing is downloaded.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+GOLDEN_TEST = os.path.join(os.path.dirname(__file__), "..", "dataset", "golden_test.txt")
+FAMILIES = ["gpt", "mt5"]
+# metrics compared by --compare, True - higher is better
+COMPARED = {
+    "sentences_per_second": True, "tokens_per_second": True,
+    "latency_p50_ms": False, "latency_p99_ms": False, "peak_rss_mb": False,
+}
+
+
+def load_sentences(path, sample):
+    sentences = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            origin = line.strip().partition(" === ")[0]
+            if origin:
+                sentences.append(origin)
+            if len(sentences) >= sample:
+                break
+    return sentences
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def percentile(values, q):
+    import numpy as np
+
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_family(config):
+    """Benchmark one family, runs in a separate process"""
+    from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+    from russian_paraphrasers.instrumentation import StageTimer
+
+    family = config["family"]
+    paraphraser_class = GPTParaphraser if family == "gpt" else Mt5Paraphraser
+    kwargs = dict(
+        model_name=config["model_name"], range_cand=config["range_cand"], make_eval=config["make_eval"],
+        num_threads=config["threads"]
+    )
+    if config["path"]:
+        kwargs.update(tokenizer_path=config["path"], pretrained_path=config["path"])
+    if config["ranker_path"]:
+        kwargs["ranker_path"] = config["ranker_path"]
+    generate_kwargs = dict(n=config["n"], max_length=config["max_length"])
+
+    start = time.perf_counter()
+    paraphraser = paraphraser_class(**kwargs)
+    load_seconds = time.perf_counter() - start
+
+    sentences = load_sentences(config["corpus"], config["sample"])
+    warmup = sentences[:config["warmup"]]
+    if warmup:
+        paraphraser.generate_batch(warmup, seed=config["seed"], **generate_kwargs)
+
+    timer = StageTimer()
+    paraphraser.hooks.append(timer)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(sentences), config["batch_size"]):
+        call_start = time.perf_counter()
+        paraphraser.generate_batch(sentences[i:i + config["batch_size"]], seed=config["seed"], **generate_kwargs)
+        latencies.append(time.perf_counter() - call_start)
+    seconds = time.perf_counter() - start
+    paraphraser.hooks.remove(timer)
+
+    tokens = timer.counters["output_tokens"]
+    stages = timer.stats()
+    for stage in stages.values():
+        stage["share"] = stage["seconds"] / seconds
+    return {
+        "model": config["path"] or config["model_name"],
+        "sentences": len(sentences),
+        "calls": len(latencies),
+        "seconds": seconds,
+        "load_seconds": load_seconds,
+        "sentences_per_second": len(sentences) / seconds,
+        "candidates": timer.counters["generated"],
+        "returned_candidates": timer.counters["returned"],
+        "input_tokens": timer.counters["input_tokens"],
+        "generated_tokens": tokens,
+        "tokens_per_second": tokens / seconds,
+        "latency_p50_ms": percentile(latencies, 50) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def environment():
+    import torch
+    import transformers
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+    }
+
+
+def print_results(results, baseline=None):
+    for family, result in results.items():
+        print("{} ({}): {:.2f} sentences/s, {:.1f} tokens/s, p50 {:.1f} ms, p99 {:.1f} ms, peak RSS {:.0f} MB".format(
+            family, result["model"], result["sentences_per_second"], result["tokens_per_second"],
+            result["latency_p50_ms"], result["latency_p99_ms"], result["peak_rss_mb"]
+        ))
+        for stage, stats in result["stages"].items():
+            print("  {:9} {:8.3f} s {:5.1f}%".format(stage, stats["seconds"], 100 * stats["share"]))
+        old = (baseline or {}).get(family)
+        if old:
+            changes = [
+                "{} {:+.1f}%{}".format(
+                    metric, 100 * (result[metric] / old[metric] - 1),
+                    "" if (result[metric] >= old[metric]) == higher else " (worse)"
+                )
+                for metric, higher in COMPARED.items() if old.get(metric)
+            ]
+            print("  vs baseline: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite")
+    parser.add_argument("--families", nargs="+", default=FAMILIES, choices=FAMILIES)
+    parser.add_argument("--tiny", action="store_true", help="tiny random models, works offline")
+    parser.add_argument("--tiny_dir", default=None)
+    parser.add_argument("--gpt_name", default="gpt2")
+    parser.add_argument("--mt5_name", default="mt5-small")
+    parser.add_argument("--gpt_path", default=None, help="local GPT model, overrides --gpt_name paths")
+    parser.add_argument("--mt5_path", default=None, help="local mT5 model, overrides --mt5_name paths")
+    parser.add_argument("--ranker_path", default=None)
+    parser.add_argument("--corpus", default=GOLDEN_TEST)
+    parser.add_argument("--sample", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--batch_size", type=int, default=1, help="sentences in one generate_batch call")
+    parser.add_argument("--n", type=int, default=5)
+    parser.add_argument("--max_length", type=int, default=50)
+    parser.add_argument("--range_cand", action="store_true")
+    parser.add_argument("--make_eval", action="store_true")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file for results")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    paths = {"gpt": args.gpt_path, "mt5": args.mt5_path}
+    ranker_path = args.ranker_path
+    if args.tiny:
+        from tiny_models import DEFAULT_ROOT, build_tiny_models
+
+        tiny = build_tiny_models(args.tiny_dir or DEFAULT_ROOT)
+        paths = {family: paths[family] or tiny[family] for family in FAMILIES}
+        ranker_path = ranker_path or tiny["ranker"]
+
+    config = {
+        key: getattr(args, key) for key in (
+            "corpus", "sample", "warmup", "batch_size", "n", "max_length",
+            "range_cand", "make_eval", "threads", "seed",
+        )
+    }
+    config["tiny"] = args.tiny
+    config["ranker_path"] = ranker_path
+
+    results = {}
+    for family in args.families:
+        family_config = dict(
+            config, family=family, path=paths[family],
+            model_name=args.gpt_name if family == "gpt" else args.mt5_name
+        )
+        # a fresh process for every family: peak RSS and caches of one family don't affect another
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            results[family] = executor.submit(run_family, family_config).result()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": config,
+            "environment": environment(),
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Tiny randomly initialized GPT-2, mT5 and ranker models for offline benchmarks.
+
+python benchmarks/tiny_models.py [--root ~/.cache/russian_paraphrasers/tiny]
+Tokenizers are trained on dataset/golden_test.txt, so the models produce
+Russian-looking tokens and take realistic input lengths; nothing is downloaded.
+"""
+import argparse
+import os
+
+GOLDEN_TEST = os.path.join(os.path.dirname(__file__), "..", "dataset", "golden_test.txt")
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "russian_paraphrasers", "tiny")
+VOCAB_SIZE = 1000
+
+
+def _lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_gpt(path, lines):
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import GPT2Config, GPT2LMHeadModel, GPT2Tokenizer
+
+    os.makedirs(path, exist_ok=True)
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(
+        ["<s>" + line + "</s>" for line in lines], vocab_size=VOCAB_SIZE,
+        special_tokens=["<s>", "</s>", "<pad>"]
+    )
+    bpe.save_model(path)
+    tokenizer = GPT2Tokenizer(
+        os.path.join(path, "vocab.json"), os.path.join(path, "merges.txt"),
+        bos_token="<s>", eos_token="</s>", pad_token="<pad>"
+    )
+    tokenizer.save_pretrained(path)
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_positions=256, n_embd=32, n_layer=2, n_head=2,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id
+    )
+    GPT2LMHeadModel(config).save_pretrained(path)
+
+
+def _t5_tokenizer(path, lines):
+    import sentencepiece as spm
+    import transformers
+    from transformers import T5Tokenizer
+
+    spm.SentencePieceTrainer.train(
+        sentence_iterator=iter(lines + ["перефразируй:"] * 10), model_prefix=os.path.join(path, "spiece"),
+        vocab_size=VOCAB_SIZE, pad_id=0, eos_id=1, unk_id=2, bos_id=-1
+    )
+    if transformers.__version__.startswith("4."):
+        return T5Tokenizer(os.path.join(path, "spiece.model"), extra_ids=0)
+    # transformers 5 builds T5Tokenizer from the vocabulary
+    processor = spm.SentencePieceProcessor(model_file=os.path.join(path, "spiece.model"))
+    vocab = [(processor.id_to_piece(i), processor.get_score(i)) for i in range(processor.get_piece_size())]
+    vocab[:3] = [("<pad>", 0.0), ("</s>", 0.0), ("<unk>", 0.0)]
+    return T5Tokenizer(vocab=vocab, extra_ids=0)
+
+
+def build_mt5(path, lines):
+    from transformers import MT5Config, MT5ForConditionalGeneration
+
+    os.makedirs(path, exist_ok=True)
+    tokenizer = _t5_tokenizer(path, lines)
+    tokenizer.save_pretrained(path)
+    config = MT5Config(
+        vocab_size=len(tokenizer), d_model=32, d_kv=8, d_ff=64, num_layers=2, num_heads=2,
+        decoder_start_token_id=0
+    )
+    MT5ForConditionalGeneration(config).save_pretrained(path)
+
+
+def build_ranker(path, tokenizer_path):
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import AutoTokenizer, BertConfig, BertModel
+
+    transformer_path = os.path.join(path, "transformer")
+    os.makedirs(transformer_path, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+    tokenizer.save_pretrained(transformer_path)
+    config = BertConfig(
+        vocab_size=len(tokenizer), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, max_position_embeddings=256, pad_token_id=tokenizer.pad_token_id
+    )
+    BertModel(config).save_pretrained(transformer_path)
+    transformer = models.Transformer(transformer_path, max_seq_length=128)
+    pooling = models.Pooling(transformer.get_word_embedding_dimension())
+    SentenceTransformer(modules=[transformer, pooling]).save(path)
+
+
+def build_tiny_models(root=DEFAULT_ROOT, corpus=GOLDEN_TEST):
+    """
+    Build tiny models once
+    :param root: directory for the models
+    :param corpus: text to train tokenizers on
+    :return: dict with paths of "gpt", "mt5" and "ranker"
+    """
+    import torch
+
+    paths = {name: os.path.join(root, name) for name in ("gpt", "mt5", "ranker")}
+    if all(os.path.exists(os.path.join(path, "config.json")) for path in paths.values()):
+        return paths
+    torch.manual_seed(0)
+    lines = _lines(corpus)
+    build_gpt(paths["gpt"], lines)
+    build_mt5(paths["mt5"], lines)
+    build_ranker(paths["ranker"], paths["mt5"])
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build tiny random models")
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    args = parser.parse_args()
+    for name, path in build_tiny_models(args.root).items():
+        print("{}: {}".format(name, path))
+
+
+if __name__ == "__main__":
+    main()
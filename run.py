@@ -1,6 +1,5 @@
 from russian_paraphrasers import GPTParaphraser
 from russian_paraphrasers import Mt5Paraphraser
-import time
 import pprint
 
 sentence_examples = [
@@ -12,36 +11,41 @@ sentence_examples = [
         "Скрипач Большого театра погиб после падения в оркестровую яму."
 ]
 
+def run_stream(paraphraser, sentence, **generate_kwargs):
+    """Print candidates as they are generated, time to the first one and the final result"""
+    first = None
+    for event in paraphraser.generate_stream(sentence, **generate_kwargs):
+        if event["event"] == "candidate":
+            if first is None:
+                first = event["time"]
+            print("{:.2f}s {}".format(event["time"], event["candidate"]))
+        else:
+            print("first paraphrase:", first, "time:", event["time"])
+            pprint.pprint(event["result"])
+
+
 def run_gpt2_example():
     """EXAMPLE FOR GPT2-large paraphraser"""
     paraphraser = GPTParaphraser(model_name="gpt2", range_cand=True, make_eval=False)
     for sentence_example in sentence_examples:
-        start = time.time()
-        results = paraphraser.generate(sentence_example, n=7, threshold=0.7, strategy="all_cs", top_k=5)
-        print("time:", time.time() - start)
-        pprint.pprint(results)
+        run_stream(paraphraser, sentence_example, n=7, threshold=0.7, strategy="all_cs", top_k=5)
 
 
 def run_gpt3_example():
     """EXAMPLE FOR GPT3-large paraphraser"""
     paraphraser = GPTParaphraser(model_name="gpt3", range_cand=True, make_eval=False)
     for sentence_example in sentence_examples:
-        start = time.time()
-        results = paraphraser.generate(sentence_example, n=10, threshold=0.7, strategy="cs")
-        print("time:", time.time() - start)
-        pprint.pprint(results)
+        run_stream(paraphraser, sentence_example, n=10, threshold=0.7, strategy="cs")
 
 
 def run_mt5_example():
     """EXAMPLE FOR Mt5 paraphrasers"""
     paraphraser = Mt5Paraphraser(model_name="mt5-small", range_cand=False, make_eval=False)
     for sentence_example in sentence_examples:
-        start = time.time()
-        results = paraphraser.generate(sentence_example, n=20)
-        print("time:", time.time() - start)
-        pprint.pprint(results)
+        run_stream(paraphraser, sentence_example, n=20)
 
 # run one by one, cause every model is big, may be Memory Error!
+# low_memory=True, weights_dtype="bfloat16" and paraphraser.unload() help to fit them
 run_mt5_example()
 # run_gpt2_example()
 # run_gpt3_example()
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Inference backends of the paraphrasers.
+
+A backend loads the hugging_face checkpoint into something with the
+hugging_face generate interface. "torch" (default) runs the PyTorch model,
+"onnx" exports the checkpoint once to ONNX and runs it with ONNX Runtime.
+"""
+import importlib.util
+import logging
+import os
+import re
+from typing import Any, Dict, Optional, Type
+
+from russian_paraphrasers.optimization import optimize_for_cpu
+
+logger = logging.getLogger(__name__)
+
+WEIGHT_DTYPES = ["float16", "bfloat16", "float32"]
+
+
+class Backend:
+    name = ""
+
+    def __init__(self, **kwargs) -> None:
+        pass
+
+    def load_model(self, model_class: Type, path: str, device: Any, **options) -> Any:
+        """
+        Load model with generate method
+        :param model_class: hugging_face PyTorch class of the model
+        :param path: model name or path in hugging_face format
+        :param device: torch device
+        :param options: low_memory=True - keep peak memory near the model size,
+        dtype="float16"/"bfloat16"/"float32" - dtype of the weights
+        :return: model
+        """
+        raise NotImplementedError
+
+    def optimize(self, model: Any, mode: Optional[str]) -> Any:
+        """
+        Apply cpu_optimize mode to the loaded model
+        :param model: model returned by load_model
+        :param mode: cpu_optimize mode or None
+        :return: model
+        """
+        return model
+
+
+class TorchBackend(Backend):
+    name = "torch"
+
+    def load_model(
+        self,
+        model_class: Type,
+        path: str,
+        device: Any,
+        low_memory: bool = False,
+        dtype: Optional[str] = None
+    ) -> Any:
+        import torch
+        import transformers
+
+        kwargs = {}
+        if dtype:
+            if dtype not in WEIGHT_DTYPES:
+                raise ValueError("Unknown dtype {}. Use one of these: {}".format(dtype, ", ".join(WEIGHT_DTYPES)))
+            # transformers 4.56 renamed torch_dtype to dtype
+            version = tuple(int(part) for part in re.findall(r"\d+", transformers.__version__)[:2])
+            kwargs["dtype" if version >= (4, 56) else "torch_dtype"] = getattr(torch, dtype)
+        if low_memory:
+            # weights are read from memory-mapped safetensors straight into modules created without init,
+            # no randomly initialized copy of the model
+            kwargs["low_cpu_mem_usage"] = True
+            if str(device) != "cpu" and importlib.util.find_spec("accelerate") is not None:
+                # no CPU copy before moving to the device
+                kwargs["device_map"] = str(device)
+        try:
+            model = model_class.from_pretrained(path, **kwargs)
+        except ImportError as e:
+            # old transformers need accelerate for low_cpu_mem_usage
+            logger.warning("Low memory loading is not available: {}".format(e))
+            kwargs.pop("low_cpu_mem_usage", None)
+            kwargs.pop("device_map", None)
+            model = model_class.from_pretrained(path, **kwargs)
+        return model.to(device)
+
+    def optimize(self, model: Any, mode: Optional[str]) -> Any:
+        return optimize_for_cpu(model, mode)
+
+
+class OnnxRuntimeBackend(Backend):
+    name = "onnx"
+
+    def __init__(self, export_dir: Optional[str] = None, **kwargs) -> None:
+        """
+        ONNX Runtime backend, needs optimum[onnxruntime]
+        :param export_dir: directory for exported models, default is ~/.cache/russian_paraphrasers/onnx
+        :param kwargs: options of other backends, ignored
+        """
+        if export_dir is None:
+            export_dir = os.path.join(os.path.expanduser("~"), ".cache", "russian_paraphrasers", "onnx")
+        self.export_dir = export_dir
+
+    def load_model(self, model_class: Type, path: str, device: Any, **options) -> Any:
+        if any(options.values()):
+            logger.warning("Loading options {} are not applied to the ONNX backend".format(options))
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM, ORTModelForSeq2SeqLM
+        except ImportError:
+            raise ImportError(
+                "ONNX backend needs optimum with onnxruntime: pip install optimum[onnxruntime]"
+            )
+        from transformers import AutoConfig
+
+        config = AutoConfig.from_pretrained(path)
+        ort_class = ORTModelForSeq2SeqLM if config.is_encoder_decoder else ORTModelForCausalLM
+        provider = "CUDAExecutionProvider" if str(device).startswith("cuda") else "CPUExecutionProvider"
+        model_dir = os.path.join(self.export_dir, re.sub(r"[^\w.-]+", "_", path.strip("/")))
+        if os.path.exists(os.path.join(model_dir, "config.json")):
+            return ort_class.from_pretrained(model_dir, provider=provider)
+        logger.info("Export {} to ONNX: {}".format(path, model_dir))
+        model = ort_class.from_pretrained(path, export=True, provider=provider)
+        model.save_pretrained(model_dir)
+        return model
+
+    def optimize(self, model: Any, mode: Optional[str]) -> Any:
+        if mode:
+            logger.warning("cpu_optimize={} is not applied to the ONNX backend".format(mode))
+        return model
+
+
+BACKENDS: Dict[str, Type[Backend]] = {
+    "torch": TorchBackend,
+    "onnx": OnnxRuntimeBackend,
+}
+
+
+def register_backend(name: str, backend_class: Type[Backend]) -> None:
+    """
+    Add custom backend
+    :param name: name to pass as backend parameter of a paraphraser
+    :param backend_class: Backend subclass
+    """
+    BACKENDS[name] = backend_class
+
+
+def get_backend(backend: Any = "torch", **kwargs) -> Backend:
+    """
+    Backend by name
+    :param backend: name from BACKENDS or Backend instance
+    :param kwargs: backend parameters (export_dir for "onnx")
+    :return: Backend
+    """
+    if isinstance(backend, Backend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend {}. Use one of these: {}".format(backend, ", ".join(BACKENDS)))
+    return BACKENDS[backend](**kwargs)
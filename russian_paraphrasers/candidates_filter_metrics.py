@@ -1,62 +1,171 @@
 from difflib import SequenceMatcher
-from sentence_transformers import util
-from collections import defaultdict
-from scipy.spatial import distance
+import numpy as np
 import logging
-import nltk
+import re
+import warnings
+
+from russian_paraphrasers.evaluation import evaluate
 
 logger = logging.getLogger(__name__)
+_punkt_checked = False
+_punkt_available = False
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+# a sentence end with words after it, texts without it are one sentence
+_INNER_SENTENCE_END = re.compile(r"[.!?…](?=.*\w)", re.S)
 
 
-def range_by_allcs(sentences, sent, smodel, threshold=0.7):
-    sentences = sentences + [sent]
-    hypothesis = []
-    paraphrases = util.paraphrase_mining(smodel, sentences)
-    good_hyp = set()
-    for paraphrase in paraphrases:
-        score, i, j = paraphrase
-        if threshold < score < 1.00:
-            if sentences[i] == sent:
-                good_hyp.add(sentences[j])
-            elif sentences[j] == sent:
-                good_hyp.add(sentences[i])
-    if len(list(good_hyp)) > 1:
-        hypothesis.extend(list(good_hyp))
-    else:
-        if paraphrases[0][1] != sent:
-            hypothesis.append(sentences[paraphrases[0][1]])
-        else:
-            hypothesis.append(sentences[paraphrases[0][2]])
-    return hypothesis
+def sent_tokenize(text):
+    """
+    nltk.sent_tokenize, nltk and punkt are loaded on the first call.
+    If punkt can't be downloaded (offline), text is split after ".", "!", "?" and "…".
+    Texts without sentence ends inside are returned as they are, without nltk
+    :param text: text
+    :return: list of sentences
+    """
+    global _punkt_checked, _punkt_available
+    stripped = text.strip()
+    if not _INNER_SENTENCE_END.search(stripped):
+        return [stripped] if stripped else []
+    import nltk
+
+    if not _punkt_checked:
+        # nltk>=3.9 uses punkt_tab instead of punkt
+        for resource in ("punkt_tab", "punkt"):
+            try:
+                nltk.data.find("tokenizers/" + resource)
+            except LookupError:
+                nltk.download(resource, quiet=True)
+        try:
+            nltk.sent_tokenize("Test.")
+            _punkt_available = True
+        except LookupError:
+            logger.warning("nltk punkt is not available, sentences are split by punctuation")
+        _punkt_checked = True
+    if _punkt_available:
+        return nltk.sent_tokenize(text)
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+
+def normalize_embeddings(embeddings):
+    """
+    Embeddings scaled to unit length, their dot products are cosine similarities
+    :param embeddings: array of embeddings, one per row
+    :return: float32 array
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def is_near_copy(sent, sentence, max_ratio=0.95):
+    """
+    Check that candidate is almost the same string as origin.
+    Cheap upper bounds of SequenceMatcher ratio are checked first.
+    :param sent: origin sentence
+    :param sentence: candidate
+    :param max_ratio: candidates with ratio >= max_ratio are near copies
+    :return: bool
+    """
+    if sent in sentence:
+        return True
+    matcher = SequenceMatcher(None, sent, sentence)
+    if matcher.real_quick_ratio() < max_ratio or matcher.quick_ratio() < max_ratio:
+        return False
+    return matcher.ratio() >= max_ratio
 
 
-def range_by_cs(sentences, sent, smodel, threshold=0.9):
+def range_by_cs(sentences, sent, smodel, threshold=0.9, max_candidates=None):
     try:
-        sentence_embeddings = smodel.encode(sentences)
-        origin_emb = smodel.encode([sent])
+        embeddings = normalize_embeddings(smodel.encode([sent] + sentences))
+        scores = embeddings[1:] @ embeddings[0]
+        passed = np.flatnonzero((scores >= threshold) & (scores < 1.0))
+        if max_candidates is not None:
+            # take best candidates first, near copies are dropped below
+            passed = passed[np.argsort(-scores[passed], kind="stable")]
         best_cands = []
-        for sentence, embedding in zip(sentences, sentence_embeddings):
-            if sent not in sentence:
-                if SequenceMatcher(None, sent, sentence).ratio() < 0.95:
-                    score = 1 - distance.cosine(embedding, origin_emb)
-                    if score >= threshold:
-                        if score != 1.0:
-                            if [score, sentence] not in best_cands:
-                                best_cands.append([score, sentence])
-        hypothesis = sorted(best_cands)
-        hypothesis = list([val for [_, val] in hypothesis])
+        seen = set()
+        for idx in passed:
+            sentence = sentences[idx]
+            if sentence in seen or is_near_copy(sent, sentence):
+                continue
+            seen.add(sentence)
+            best_cands.append((float(scores[idx]), sentence))
+            if max_candidates is not None and len(best_cands) >= max_candidates:
+                break
+        hypothesis = [val for _, val in sorted(best_cands)]
     except Exception as e:
         logger.warning("Can't measure embeddings scores. Error: " + str(e))
-        cands = []
-        for sentence in sentences:
-            if sent not in sentence:
-                if SequenceMatcher(None, sent, sentence).ratio() < 0.95:
-                    cands.append(sentence)
-        hypothesis = list(set(cands))
+        hypothesis = _without_scores(sentences, sent, max_candidates)
     return hypothesis
 
 
-def range_candidates(sentences, sent, smodel, threshold=0.9, strategy="cs"):
+def _without_scores(sentences, sent, max_candidates=None):
+    # fallback when embeddings can't be computed: all candidates which are not near copies
+    cands = []
+    for sentence in sentences:
+        if not is_near_copy(sent, sentence):
+            cands.append(sentence)
+    hypothesis = list(set(cands))
+    if max_candidates is not None:
+        hypothesis = hypothesis[:max_candidates]
+    return hypothesis
+
+
+def select_diverse(embeddings, scores, k, diversity=0.5):
+    """
+    Max marginal relevance selection
+    :param embeddings: normalized candidate embeddings
+    :param scores: similarity of every candidate to the origin
+    :param k: number of candidates to select
+    :param diversity: 0 - only similarity to the origin matters, 1 - only difference from the selected ones
+    :return: list of selected indexes
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    pair_scores = embeddings @ embeddings.T
+    selected = [int(np.argmax(scores))]
+    redundancy = pair_scores[selected[0]].copy()
+    available = np.ones(len(scores), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        mmr = (1 - diversity) * scores - diversity * redundancy
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, pair_scores[best], out=redundancy)
+    return selected
+
+
+def range_by_allcs(sentences, sent, smodel, threshold=0.7, max_candidates=None, diversity=0.5):
+    if not sentences:
+        return []
+    try:
+        embeddings = normalize_embeddings(smodel.encode([sent] + sentences))
+    except Exception as e:
+        logger.warning("Can't measure embeddings scores. Error: " + str(e))
+        return _without_scores(sentences, sent, max_candidates)
+    scores = embeddings[1:] @ embeddings[0]
+    scores[[is_near_copy(sent, sentence) for sentence in sentences]] = -np.inf
+    passed = np.flatnonzero((threshold < scores) & (scores < 1.0))
+    if len(passed) <= 1:
+        # nothing good enough, take the most similar candidate
+        best = int(np.argmax(scores))
+        return [sentences[best]] if np.isfinite(scores[best]) and scores[best] < 1.0 else []
+    if max_candidates is not None:
+        passed = passed[select_diverse(
+            embeddings[1:][passed], scores[passed], max_candidates, diversity=diversity
+        )]
+    # the same order as range_by_cs
+    passed = passed[np.argsort(scores[passed], kind="stable")]
+    return [sentences[i] for i in passed]
+
+
+def range_candidates(
+    sentences, sent, smodel, threshold=0.9, strategy="cs", max_candidates=None, diversity=0.5,
+    reference_index=None
+):
     """
     Range all possible candidates by one of the strategies
     :param sentences: candidates
@@ -64,42 +173,82 @@ def range_candidates(sentences, sent, smodel, threshold=0.9, strategy="cs"):
     :param smodel: sentence transformer model
     :param threshold: threshold for cosine similarity score
     :param strategy: best by cosine similarity between sentence origin and generated  - flag "cs",
-    best by cosine similary between all generated pairs - flag "all_cs"
-    :return: list: best candidates
+    candidates similar to the origin and diverse among themselves - flag "all_cs"
+    :param max_candidates: return only this number of the best candidates (None - all),
+    for "all_cs" they are selected by max marginal relevance
+    :param diversity: weight of the difference between selected candidates for "all_cs"
+    :param reference_index: NearDuplicateIndex, candidates near duplicating its corpus are dropped
+    :return: list: best candidates without near copies of the origin, for both strategies
+    in ascending order of cosine similarity to the origin (the last one is the closest)
     """
     sentences = list(set(sentences))
+    if reference_index is not None:
+        sentences = reference_index.filter(sentences, smodel)
     if strategy == "cs":
-        hypothesis = range_by_cs(sentences, sent, smodel, threshold=threshold)
+        hypothesis = range_by_cs(
+            sentences, sent, smodel, threshold=threshold, max_candidates=max_candidates
+        )
     else:
-        hypothesis = range_by_allcs(sentences, sent, smodel, threshold=threshold)
+        hypothesis = range_by_allcs(
+            sentences, sent, smodel, threshold=threshold,
+            max_candidates=max_candidates, diversity=diversity
+        )
     return hypothesis
 
 
-def get_scores(ngeval, best_candidates, sentence):
+def passing_candidates(sentences, sent, smodel, threshold=0.9, strategy="cs", reference_index=None):
+    """
+    Which candidates pass the threshold of range_candidates, for sampling in rounds
+    :param sentences: new candidates
+    :param sent: origin sentence reference
+    :param smodel: sentence transformer model
+    :param threshold: threshold for cosine similarity score
+    :param strategy: "cs" (score >= threshold) or "all_cs" (score > threshold)
+    :param reference_index: NearDuplicateIndex, candidates near duplicating its corpus do not pass
+    :return: list of bool, one per candidate
+    """
+    if not sentences:
+        return []
+    fresh = [True] * len(sentences)
+    if reference_index is not None:
+        fresh = [not dup for dup in reference_index.is_duplicate(sentences, smodel)]
+    try:
+        embeddings = normalize_embeddings(smodel.encode([sent] + sentences))
+    except Exception as e:
+        logger.warning("Can't measure embeddings scores. Error: " + str(e))
+        return [ok and not is_near_copy(sent, sentence) for ok, sentence in zip(fresh, sentences)]
+    scores = embeddings[1:] @ embeddings[0]
+    above = scores >= threshold if strategy == "cs" else scores > threshold
+    return [
+        bool(ok) and new and score < 1.0 and not is_near_copy(sent, sentence)
+        for ok, new, score, sentence in zip(above, fresh, scores, sentences)
+    ]
+
+
+def get_scores(best_candidates, sentence, *legacy, ngeval=None):
     """
     Average metrics of candidates
-    :param ngeval:
-    :param best_candidates:
-    :param sentence:
-    :return: metrics
+    :param best_candidates: candidates
+    :param sentence: origin sentence
+    :param legacy: the old call get_scores(ngeval, best_candidates, sentence) is still accepted
+    :param ngeval: deprecated and ignored, NLGEval is not needed any more
+    :return: metrics, the same as NLGEval gives for lowercased texts
     """
-    average_metrics = defaultdict(list)
-    if best_candidates:
-        for hyp in best_candidates:
-            metrics_dict = ngeval.compute_individual_metrics([sentence.lower()], hyp.lower())
-            for key, value in metrics_dict.items():
-                average_metrics[key].append(value)
-    metrics = {}
-    for key, value in average_metrics.items():
-        metrics[key] = sum(value)/len(value)
-    return metrics
+    if legacy or ngeval is not None:
+        warnings.warn(
+            "get_scores(ngeval, best_candidates, sentence) is deprecated, "
+            "use get_scores(best_candidates, sentence)", DeprecationWarning, stacklevel=2
+        )
+        if legacy:
+            best_candidates, sentence = sentence, legacy[0]
+    return evaluate([(sentence, best_candidates or [])])["sentences"][0]["average_metrics"]
 
 
 def check_input(sentence):
     warning = None
     if len(sentence) <= 7:
         warning = "Your sentence is too short. The results can be strange."
-    sentences = nltk.sent_tokenize(sentence)
+    sentences = sent_tokenize(sentence)
     if len(sentences) > 1:
         warning = "There are more than one sentence! We split it and paraphrase separately."
     return warning, sentences
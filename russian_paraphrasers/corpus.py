@@ -0,0 +1,491 @@
+"""
+Streaming paraphrasing of big corpora.
+
+Input is read line by line, results are appended to a JSONL file and
+the position in the input is checkpointed after every chunk, so a killed
+job continues from the last written chunk.
+
+paraphrase_file_parallel splits the input into shards by byte ranges and
+paraphrases them in several worker processes, each with its own model.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from russian_paraphrasers.preprocessing import Deduplicator
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["text", "pairs", "jsonl"]
+
+
+def detect_format(path: str) -> str:
+    """
+    Guess corpus format by file extension
+    :param path: path to corpus
+    :return: one of FORMATS
+    """
+    if path.endswith(".jsonl") or path.endswith(".json"):
+        return "jsonl"
+    with open(path, "r", encoding="utf-8") as f:
+        first_line = f.readline()
+    if " === " in first_line:
+        return "pairs"
+    return "text"
+
+
+def parse_line(line: str, fmt: str, text_field: str = "sentence") -> Optional[Dict]:
+    """
+    Parse one corpus line
+    :param line: line without newline
+    :param fmt: "text", "pairs" (origin === paraphrase as in dataset/golden_test.txt) or "jsonl"
+    :param text_field: field with sentence for jsonl format
+    :return: dict with "sentence" and optional "reference" or None for empty lines
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if fmt == "text":
+        return {"sentence": line}
+    if fmt == "pairs":
+        origin, _, reference = line.partition(" === ")
+        record = {"sentence": origin.strip()}
+        if reference:
+            record["reference"] = reference.strip()
+        return record
+    if fmt == "jsonl":
+        data = json.loads(line)
+        if isinstance(data, str):
+            return {"sentence": data}
+        record = {"sentence": data[text_field]}
+        if "reference" in data:
+            record["reference"] = data["reference"]
+        return record
+    raise ValueError("Unknown corpus format {}. Use one of these: {}".format(fmt, ", ".join(FORMATS)))
+
+
+def read_corpus(
+    path: str,
+    fmt: str = "auto",
+    offset: int = 0,
+    line_no: int = 0,
+    text_field: str = "sentence",
+    end: Optional[int] = None
+) -> Iterator[Tuple[int, int, Dict]]:
+    """
+    Read corpus lazily, in constant memory
+    :param path: path to corpus
+    :param fmt: "auto", "text", "pairs" or "jsonl"
+    :param offset: byte offset to start from
+    :param line_no: number of the line at offset
+    :param text_field: field with sentence for jsonl format
+    :param end: byte offset to stop at, None - end of file
+    :return: generator of (line number, byte offset after the line, record)
+    """
+    if fmt == "auto":
+        fmt = detect_format(path)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw_line in f:
+            if end is not None and offset >= end:
+                break
+            offset += len(raw_line)
+            record = parse_line(raw_line.decode("utf-8"), fmt, text_field=text_field)
+            if record is not None:
+                yield line_no, offset, record
+            line_no += 1
+
+
+def split_corpus(path: str, num_shards: int) -> List[Tuple[int, int, int]]:
+    """
+    Split corpus into shards of about the same size on line boundaries
+    :param path: path to corpus
+    :param num_shards: max number of shards
+    :return: list of (start offset, end offset, number of the first line)
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, num_shards):
+            f.seek(size * i // num_shards)
+            f.readline()
+            bound = f.tell()
+            if bound > bounds[-1] and bound < size:
+                bounds.append(bound)
+        bounds.append(size)
+
+        # count lines before every bound in one pass
+        line_numbers = [0]
+        f.seek(0)
+        position, lines = 0, 0
+        for bound in bounds[1:-1]:
+            while position < bound:
+                block = f.read(min(2 ** 20, bound - position))
+                position += len(block)
+                lines += block.count(b"\n")
+            line_numbers.append(lines)
+    return [(bounds[i], bounds[i + 1], line_numbers[i]) for i in range(len(bounds) - 1)]
+
+
+def load_checkpoint(checkpoint_path: str, offset: int = 0, line_no: int = 0) -> Dict:
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"offset": offset, "line_no": line_no, "output_size": 0, "done": 0}
+
+
+def save_checkpoint(checkpoint_path: str, state: Dict) -> None:
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def paraphrase_file(
+    paraphraser,
+    input_path: str,
+    output_path: str,
+    fmt: str = "auto",
+    chunk_size: int = 32,
+    checkpoint_path: Optional[str] = "default",
+    text_field: str = "sentence",
+    dedup: bool = True,
+    **generate_kwargs
+) -> int:
+    """
+    Paraphrase corpus line by line and append results to JSONL file
+    :param paraphraser: GPTParaphraser or Mt5Paraphraser
+    :param input_path: corpus in text, pairs or jsonl format
+    :param output_path: JSONL file with one result dict per input line
+    :param fmt: "auto", "text", "pairs" or "jsonl"
+    :param chunk_size: number of lines passed to the paraphraser at once
+    :param checkpoint_path: "default" (output_path + ".ckpt"), some path or None to disable resuming,
+    a checkpoint of an input of another size is not resumed (ValueError)
+    :param text_field: field with sentence for jsonl format
+    :param dedup: generate every unique normalized sentence once and copy its results to repeats
+    :param generate_kwargs: parameters for generate (n, temperature, threshold, ...)
+    :return: number of lines paraphrased in total
+    """
+    if checkpoint_path == "default":
+        checkpoint_path = output_path + ".ckpt"
+    return _paraphrase_range(
+        paraphraser, input_path, output_path, fmt, chunk_size,
+        checkpoint_path, text_field, generate_kwargs, dedup=dedup
+    )
+
+
+def _paraphrase_range(
+    paraphraser, input_path, output_path, fmt, chunk_size, checkpoint_path,
+    text_field, generate_kwargs, start=0, end=None, line_no=0, dedup=True
+):
+    resumed = bool(checkpoint_path) and os.path.exists(checkpoint_path)
+    state = load_checkpoint(checkpoint_path, offset=start, line_no=line_no)
+    input_size = os.path.getsize(input_path)
+    if resumed:
+        if state.get("input_size", input_size) != input_size:
+            raise ValueError(
+                "Input {} has changed since checkpoint {} ({} bytes, {} in the checkpoint). "
+                "Remove the checkpoint to start again".format(
+                    input_path, checkpoint_path, input_size, state["input_size"]
+                )
+            )
+    else:
+        # results are appended to an existing output, the checkpoint is saved before the first chunk
+        # so that a job killed during the first chunk does not write it twice
+        state["input_size"] = input_size
+        state["output_size"] = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, state)
+    deduplicator = Deduplicator() if dedup else None
+    if state["done"]:
+        logger.info("Resume {} from line {}".format(input_path, state["line_no"]))
+
+    with open(output_path, "ab") as out:
+        # drop results written after the last checkpoint, they will be generated again
+        out.truncate(state["output_size"])
+        out.seek(state["output_size"])
+
+        chunk = []
+        stream = read_corpus(
+            input_path, fmt=fmt, offset=state["offset"],
+            line_no=state["line_no"], text_field=text_field, end=end
+        )
+        for item in stream:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                _write_chunk(paraphraser, chunk, out, state, checkpoint_path, generate_kwargs, deduplicator)
+                chunk = []
+        if chunk:
+            _write_chunk(paraphraser, chunk, out, state, checkpoint_path, generate_kwargs, deduplicator)
+    if deduplicator is not None:
+        deduplicator.log()
+    return state["done"]
+
+
+def _write_chunk(paraphraser, chunk, out, state, checkpoint_path, generate_kwargs, deduplicator=None):
+    sentences = [record["sentence"] for _, _, record in chunk]
+
+    def generate(batch):
+        if hasattr(paraphraser, "generate_batch"):
+            return paraphraser.generate_batch(batch, **generate_kwargs)
+        return [paraphraser.generate(sentence, **generate_kwargs) for sentence in batch]
+
+    results = deduplicator.run(sentences, generate) if deduplicator is not None else generate(sentences)
+
+    for (line_no, _, record), result in zip(chunk, results):
+        result["line"] = line_no
+        if "reference" in record:
+            result["reference"] = record["reference"]
+        out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+    out.flush()
+    os.fsync(out.fileno())
+
+    last_line, last_offset, _ = chunk[-1]
+    state["offset"] = last_offset
+    state["line_no"] = last_line + 1
+    state["output_size"] = out.tell()
+    state["done"] += len(chunk)
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, state)
+    logger.info("Paraphrased {} lines".format(state["done"]))
+
+
+def _worker(worker_id, paraphraser_class, paraphraser_kwargs, num_threads, tasks, events, job):
+    # limit BLAS and OpenMP pools before torch is imported
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    paraphraser_kwargs = dict(paraphraser_kwargs)
+    paraphraser_kwargs.setdefault("num_threads", num_threads)
+    paraphraser_kwargs.setdefault("num_interop_threads", 1)
+    paraphraser = paraphraser_class(**paraphraser_kwargs)
+    events.put(("ready", worker_id, None))
+
+    while True:
+        shard = tasks.get()
+        if shard is None:
+            break
+        shard_id, start, end, line_no = shard
+        output_path = os.path.join(job["shard_dir"], "{:05d}.jsonl".format(shard_id))
+        _paraphrase_range(
+            paraphraser, job["input_path"], output_path, job["fmt"], job["chunk_size"],
+            output_path + ".ckpt", job["text_field"], job["generate_kwargs"],
+            start=start, end=end, line_no=line_no, dedup=job["dedup"]
+        )
+        events.put(("done", worker_id, shard_id))
+
+
+def load_layout(shard_dir: str, input_path: str, fmt: str, num_shards: int) -> List[Tuple[int, int, int]]:
+    """
+    Shards of a job: the saved layout when the job is resumed, otherwise a new split saved in shard_dir.
+    Checkpoints of shards are byte ranges, so a resumed job must use the same shards
+    whatever its number of workers is
+    :param shard_dir: directory with shard results and checkpoints
+    :param input_path: path to corpus
+    :param fmt: corpus format
+    :param num_shards: number of shards of a new job
+    :return: list of (start offset, end offset, number of the first line)
+    """
+    layout_path = os.path.join(shard_dir, "layout.json")
+    input_size = os.path.getsize(input_path)
+    if os.path.exists(layout_path):
+        with open(layout_path, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+        if layout["input_size"] != input_size or layout["fmt"] != fmt:
+            raise ValueError(
+                "Shards in {} were made for another input ({} bytes, format {}), "
+                "remove the directory to start again".format(shard_dir, layout["input_size"], layout["fmt"])
+            )
+        if len(layout["shards"]) != num_shards:
+            logger.info("Resume with {} shards of the first run".format(len(layout["shards"])))
+        return [tuple(shard) for shard in layout["shards"]]
+    shards = split_corpus(input_path, num_shards)
+    save_checkpoint(layout_path, {"input_size": input_size, "fmt": fmt, "shards": shards})
+    return shards
+
+
+def paraphrase_file_parallel(
+    paraphraser_class,
+    input_path: str,
+    output_path: str,
+    num_workers: Optional[int] = None,
+    threads_per_worker: Optional[int] = None,
+    paraphraser_kwargs: Optional[Dict] = None,
+    fmt: str = "auto",
+    chunk_size: int = 32,
+    shards_per_worker: int = 4,
+    max_retries: int = 2,
+    text_field: str = "sentence",
+    dedup: bool = True,
+    **generate_kwargs
+) -> int:
+    """
+    Paraphrase corpus in several processes and write results in input order.
+    Every worker loads its own paraphraser once and takes shards one by one,
+    shards of a crashed worker are given to a new worker and continue from their checkpoints.
+    Shard results are kept in output_path + ".shards" until all shards are done,
+    so a killed job continues from the last written chunks.
+    :param paraphraser_class: GPTParaphraser or Mt5Paraphraser
+    :param input_path: corpus in text, pairs or jsonl format
+    :param output_path: JSONL file with one result dict per input line
+    :param num_workers: number of processes, default is number of CPU cores // threads_per_worker
+    :param threads_per_worker: torch threads of every worker, default is number of CPU cores // num_workers
+    :param paraphraser_kwargs: parameters of paraphraser_class (model_name, range_cand, ...)
+    :param fmt: "auto", "text", "pairs" or "jsonl"
+    :param chunk_size: number of lines passed to the paraphraser at once
+    :param shards_per_worker: number of shards per worker, more shards - less work lost on crash
+    :param max_retries: how many times a shard is given to a new worker after a crash
+    :param text_field: field with sentence for jsonl format
+    :param dedup: generate every unique normalized sentence once per worker and copy its results to repeats
+    :param generate_kwargs: parameters for generate (n, temperature, threshold, ...)
+    :return: number of lines paraphrased in total
+    """
+    import multiprocessing
+
+    cpu_count = os.cpu_count() or 1
+    if num_workers is None:
+        num_workers = max(1, cpu_count // (threads_per_worker or 4))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, cpu_count // num_workers)
+    if fmt == "auto":
+        fmt = detect_format(input_path)
+
+    shard_dir = output_path + ".shards"
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = load_layout(shard_dir, input_path, fmt, num_workers * shards_per_worker)
+    job = {
+        "input_path": input_path, "shard_dir": shard_dir, "fmt": fmt, "chunk_size": chunk_size,
+        "text_field": text_field, "generate_kwargs": generate_kwargs, "dedup": dedup,
+    }
+
+    # spawn: forked workers would inherit torch thread pools of the parent
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    workers = {}
+    pending = list(range(len(shards)))
+    current = {}
+    done = set()
+    retries = [0] * len(shards)
+
+    def start_worker(worker_id):
+        tasks = context.Queue()
+        process = context.Process(
+            target=_worker, daemon=True,
+            args=(worker_id, paraphraser_class, paraphraser_kwargs or {}, threads_per_worker, tasks, events, job),
+        )
+        process.start()
+        workers[worker_id] = (process, tasks, False)
+
+    def give_shard(worker_id):
+        process, tasks, _ = workers[worker_id]
+        workers[worker_id] = (process, tasks, True)
+        if pending:
+            shard_id = pending.pop(0)
+            current[worker_id] = shard_id
+            tasks.put((shard_id,) + shards[shard_id])
+        else:
+            tasks.put(None)
+
+    next_id = min(num_workers, len(shards))
+    for worker_id in range(next_id):
+        start_worker(worker_id)
+    logger.info("Paraphrase {} shards in {} workers with {} threads each".format(
+        len(shards), next_id, threads_per_worker
+    ))
+    try:
+        while len(done) < len(shards):
+            received = []
+            try:
+                received.append(events.get(timeout=1.0))
+                while True:
+                    received.append(events.get_nowait())
+            except queue.Empty:
+                pass
+            for event, worker_id, shard_id in received:
+                if event == "done":
+                    done.add(shard_id)
+                    current.pop(worker_id, None)
+                    logger.info("Shard {} is done, {}/{}".format(shard_id, len(done), len(shards)))
+                give_shard(worker_id)
+
+            # checked on every iteration: other workers can keep sending events while one is dead
+            for worker_id, (process, _, ready) in list(workers.items()):
+                if process.exitcode is None:
+                    continue
+                del workers[worker_id]
+                shard_id = current.pop(worker_id, None)
+                if not ready:
+                    raise RuntimeError("Worker {} failed to load the paraphraser".format(worker_id))
+                if shard_id is None or shard_id in done:
+                    continue
+                retries[shard_id] += 1
+                if retries[shard_id] > max_retries:
+                    raise RuntimeError("Shard {} failed {} times".format(shard_id, retries[shard_id]))
+                logger.warning("Worker {} died with exit code {}, retry shard {}".format(
+                    worker_id, process.exitcode, shard_id
+                ))
+                pending.insert(0, shard_id)
+                start_worker(next_id)
+                next_id += 1
+    finally:
+        for process, tasks, _ in workers.values():
+            if process.is_alive():
+                tasks.put(None)
+        for process, _, _ in workers.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    total = 0
+    with open(output_path, "wb") as out:
+        for shard_id in range(len(shards)):
+            shard_path = os.path.join(shard_dir, "{:05d}.jsonl".format(shard_id))
+            total += load_checkpoint(shard_path + ".ckpt")["done"]
+            if os.path.exists(shard_path):
+                with open(shard_path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+    shutil.rmtree(shard_dir)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paraphrase corpus file")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--model_name", default="mt5-small")
+    parser.add_argument("--format", default="auto", choices=["auto"] + FORMATS)
+    parser.add_argument("--chunk_size", type=int, default=32)
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--range_cand", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--threads_per_worker", type=int, default=None)
+    parser.add_argument("--no_dedup", action="store_true", help="generate repeated sentences again")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+    paraphraser_class = Mt5Paraphraser if args.model_name.startswith("mt5") else GPTParaphraser
+    paraphraser_kwargs = {"model_name": args.model_name, "range_cand": args.range_cand}
+    if args.num_workers > 1:
+        paraphrase_file_parallel(
+            paraphraser_class, args.input_path, args.output_path, num_workers=args.num_workers,
+            threads_per_worker=args.threads_per_worker, paraphraser_kwargs=paraphraser_kwargs,
+            fmt=args.format, chunk_size=args.chunk_size, dedup=not args.no_dedup,
+            n=args.n, threshold=args.threshold
+        )
+        return
+    paraphraser = paraphraser_class(**paraphraser_kwargs)
+    paraphrase_file(
+        paraphraser, args.input_path, args.output_path, fmt=args.format,
+        chunk_size=args.chunk_size, dedup=not args.no_dedup, n=args.n, threshold=args.threshold
+    )
+
+
+if __name__ == "__main__":
+    main()
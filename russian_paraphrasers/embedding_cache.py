@@ -0,0 +1,227 @@
+"""
+Cache of sentence embeddings for the candidates ranker.
+
+EmbeddingCache wraps SentenceTransformer and has the same encode method,
+so it can be passed everywhere instead of the model itself.
+"""
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from russian_paraphrasers.utils import normalize_text
+
+try:
+    import fcntl
+except ImportError:  # Windows, disk tier works without locking
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# encode parameters which do not change embeddings, other parameters are a part of the cache key
+NEUTRAL_ENCODE_KWARGS = {"batch_size", "show_progress_bar", "convert_to_numpy", "device"}
+
+
+class DiskEmbeddingStore:
+    def __init__(self, cache_dir: str, dim: Optional[int] = None, model_name: str = "") -> None:
+        """
+        Append-only embedding storage which can be shared by several processes.
+        Vectors are kept in a raw float32 file read through np.memmap,
+        keys are kept in a text file, one key per line, line number is the vector row.
+        :param cache_dir: directory for the cache files
+        :param dim: embedding size, None to take it from the existing cache
+        :param model_name: name of the encoder, the cache of another encoder is not reused
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.dim = dim
+        self.keys_path = os.path.join(cache_dir, "keys.txt")
+        self.vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self.lock_path = os.path.join(cache_dir, "lock")
+        meta_path = os.path.join(cache_dir, "meta.json")
+        meta = {"dim": dim, "model_name": model_name}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if dim is None:
+                meta["dim"] = self.dim = stored["dim"]
+            if stored != meta:
+                raise ValueError(
+                    "Embedding cache in {} was built for {}, not for {}".format(cache_dir, stored, meta)
+                )
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self.index = {}
+        self._keys_size = 0
+        self._vectors = None
+        self._refresh()
+
+    def _lock(self):
+        lock_file = open(self.lock_path, "a")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _refresh(self) -> None:
+        # read keys appended by other processes since the last refresh
+        if not os.path.exists(self.keys_path):
+            return
+        size = os.path.getsize(self.keys_path)
+        if size == self._keys_size:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_size)
+            data = f.read(size - self._keys_size)
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].decode("utf-8").splitlines():
+            self.index.setdefault(line, len(self.index))
+        self._keys_size += complete
+        self._vectors = None
+
+    def _matrix(self):
+        if self._vectors is None and self.index:
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.index), self.dim)
+            )
+        return self._vectors
+
+    def get(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        if any(key not in self.index for key in keys):
+            self._refresh()
+        matrix = self._matrix()
+        return [
+            np.array(matrix[self.index[key]]) if key in self.index else None
+            for key in keys
+        ]
+
+    def put(self, keys: List[str], vectors: np.ndarray) -> None:
+        lock_file = self._lock()
+        try:
+            self._refresh()
+            new_rows = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.index]
+            new_rows = list(OrderedDict(new_rows).items())
+            if not new_rows:
+                return
+            row_size = self.dim * 4
+            with open(self.vectors_path, "ab") as f:
+                # drop vectors left without keys by a crashed writer
+                f.truncate(len(self.index) * row_size)
+                for _, vector in new_rows:
+                    f.write(np.asarray(vector, dtype=np.float32).tobytes())
+            # keys are written after vectors, so every visible key has its vector
+            with open(self.keys_path, "ab") as f:
+                f.write("".join(key + "\n" for key, _ in new_rows).encode("utf-8"))
+            self._refresh()
+        finally:
+            lock_file.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        smodel,
+        max_size: int = 10000,
+        cache_dir: Optional[str] = None,
+        model_name: str = ""
+    ) -> None:
+        """
+        LRU cache of embeddings in memory with an optional shared disk tier
+        :param smodel: SentenceTransformer model
+        :param max_size: max number of embeddings kept in memory
+        :param cache_dir: directory for the disk tier, None to keep embeddings only in memory
+        :param model_name: name of the encoder, used to check the disk tier
+        """
+        self.smodel = smodel
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.memory = OrderedDict()
+        self.disk = None
+        if cache_dir is not None and os.path.exists(os.path.join(cache_dir, "meta.json")):
+            self.disk = DiskEmbeddingStore(cache_dir, model_name=model_name)
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    @staticmethod
+    def _key_prefix(kwargs: dict) -> str:
+        # embeddings of the same text with e.g. normalize_embeddings=True are cached separately,
+        # keys are normalized texts, they have no tabs
+        options = {name: value for name, value in kwargs.items() if name not in NEUTRAL_ENCODE_KWARGS}
+        if not options:
+            return ""
+        return json.dumps(options, sort_keys=True, default=str) + "\t"
+
+    def encode(self, sentences, convert_to_tensor: bool = False, **kwargs):
+        """
+        Same as SentenceTransformer.encode, but takes known embeddings from the cache
+        :param sentences: str or list of sentences
+        :param convert_to_tensor: return torch tensor instead of numpy array
+        :param kwargs: other SentenceTransformer.encode parameters, the ones changing embeddings
+        (e.g. normalize_embeddings) are a part of the cache key
+        :return: embeddings
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        prefix = self._key_prefix(kwargs)
+        keys = [prefix + normalize_text(sentence) for sentence in sentences]
+        vectors = [self.memory.get(key) for key in keys]
+        for key, vector in zip(keys, vectors):
+            if vector is not None:
+                self.memory.move_to_end(key)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing and self.disk is not None:
+            for i, vector in zip(missing, self.disk.get([keys[i] for i in missing])):
+                if vector is not None:
+                    vectors[i] = vector
+                    self._remember(keys[i], vector)
+            missing = [i for i in missing if vectors[i] is None]
+        self.hits += len(sentences) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            to_encode = list(OrderedDict((keys[i], sentences[i]) for i in missing).items())
+            kwargs.pop("convert_to_numpy", None)
+            encoded = np.asarray(
+                self.smodel.encode([sentence for _, sentence in to_encode], **kwargs),
+                dtype=np.float32
+            )
+            if self.cache_dir is not None and self.disk is None:
+                self.disk = DiskEmbeddingStore(self.cache_dir, encoded.shape[-1], self.model_name)
+            new_vectors = {}
+            for (key, _), vector in zip(to_encode, encoded):
+                new_vectors[key] = vector
+                self._remember(key, vector)
+            if self.disk is not None:
+                self.disk.put(list(new_vectors.keys()), encoded)
+            for i in missing:
+                vectors[i] = new_vectors[keys[i]]
+
+        embeddings = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        if single:
+            embeddings = embeddings[0]
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(embeddings)
+        return embeddings
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_size": len(self.memory),
+            "disk_size": len(self.disk) if self.disk is not None else 0,
+        }
@@ -0,0 +1,144 @@
+"""
+Batched BLEU-1..4 and ROUGE-L.
+
+Scores are the same as NLGEval (pycocoevalcap Bleu(4) and Rouge scorers)
+gives for lowercased texts, but all (reference, hypotheses) groups are
+scored in one pass: tokens and n-gram counts of every text are computed
+once and BLEU of all pairs is computed with numpy.
+"""
+import logging
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAX_ORDER = 4
+BETA = 1.2
+METRICS = ["Bleu_{}".format(k) for k in range(1, MAX_ORDER + 1)] + ["ROUGE_L"]
+
+# smoothing constants of pycocoevalcap BleuScorer
+_TINY = 1e-15
+_SMALL = 1e-9
+
+References = Union[str, Sequence[str]]
+
+
+@lru_cache(maxsize=100000)
+def _bleu_ngrams(text: str) -> Tuple[int, Tuple[Counter, ...]]:
+    # pycocoevalcap Bleu splits by whitespace
+    words = text.lower().strip().split()
+    return len(words), tuple(Counter(zip(*[words[i:] for i in range(k)])) for k in range(1, MAX_ORDER + 1))
+
+
+@lru_cache(maxsize=100000)
+def _rouge_tokens(text: str) -> Tuple[str, ...]:
+    # pycocoevalcap Rouge splits by single spaces
+    return tuple(text.lower().strip().split(" "))
+
+
+def lcs_length(a: Sequence, b: Sequence) -> int:
+    """
+    Length of the longest common subsequence, bit-parallel algorithm
+    (Crochemore et al., 2001), O(len(b)) operations on len(a)-bit integers
+    :param a: tokens
+    :param b: tokens
+    :return: length
+    """
+    masks = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+def _pair_counts(references: List[str], hypothesis: str):
+    testlen, test_counts = _bleu_ngrams(hypothesis)
+    if len(references) == 1:
+        reflen, max_counts = _bleu_ngrams(references[0])
+    else:
+        reflens = []
+        max_counts = tuple(Counter() for _ in range(MAX_ORDER))
+        for reference in references:
+            length, ref_counts = _bleu_ngrams(reference)
+            reflens.append(length)
+            for merged, counts in zip(max_counts, ref_counts):
+                merged |= counts
+        # "closest" reference length
+        reflen = min((abs(length - testlen), length) for length in reflens)[1]
+    correct = [
+        sum(min(test[ngram], ref[ngram]) for ngram in test.keys() & ref.keys())
+        for test, ref in zip(test_counts, max_counts)
+    ]
+    guess = [max(0, testlen - k) for k in range(MAX_ORDER)]
+    return correct, guess, testlen, reflen
+
+
+def _rouge_l(references: List[str], hypothesis: str) -> float:
+    candidate = _rouge_tokens(hypothesis)
+    precisions, recalls = [], []
+    for reference in references:
+        tokens = _rouge_tokens(reference)
+        lcs = lcs_length(tokens, candidate)
+        precisions.append(lcs / len(candidate))
+        recalls.append(lcs / len(tokens))
+    prec_max, rec_max = max(precisions), max(recalls)
+    if prec_max == 0 or rec_max == 0:
+        return 0.0
+    return ((1 + BETA ** 2) * prec_max * rec_max) / (rec_max + BETA ** 2 * prec_max)
+
+
+def _bleu(correct: np.ndarray, guess: np.ndarray, testlen: np.ndarray, reflen: np.ndarray) -> np.ndarray:
+    precisions = (correct + _TINY) / (guess + _SMALL)
+    orders = np.arange(1, MAX_ORDER + 1)
+    bleu = np.cumprod(precisions, axis=-1) ** (1.0 / orders)
+    ratio = (testlen + _TINY) / (reflen + _SMALL)
+    with np.errstate(divide="ignore"):
+        brevity = np.where(ratio < 1, np.exp(1 - 1 / ratio), 1.0)
+    return bleu * brevity[..., None]
+
+
+def evaluate(groups: Sequence[Tuple[References, Sequence[str]]]) -> Dict:
+    """
+    BLEU-1..4 and ROUGE-L of many hypotheses at once
+    :param groups: list of (reference or list of references, list of hypotheses)
+    :return: dict with "sentences" - for every group "metrics" of every hypothesis and their "average_metrics"
+    (empty for a group without hypotheses), and "corpus" - BLEU of all pairs together and mean ROUGE-L
+    """
+    pairs = []
+    for group_id, (references, hypotheses) in enumerate(groups):
+        if isinstance(references, str):
+            references = [references]
+        for hypothesis in hypotheses:
+            pairs.append((group_id, list(references), hypothesis))
+
+    sentences = [{"metrics": [], "average_metrics": {}} for _ in groups]
+    if not pairs:
+        return {"sentences": sentences, "corpus": {}}
+
+    counts = [_pair_counts(references, hypothesis) for _, references, hypothesis in pairs]
+    correct = np.array([c[0] for c in counts], dtype=np.float64)
+    guess = np.array([c[1] for c in counts], dtype=np.float64)
+    testlen = np.array([c[2] for c in counts], dtype=np.float64)
+    reflen = np.array([c[3] for c in counts], dtype=np.float64)
+    rouge = np.array([_rouge_l(references, hypothesis) for _, references, hypothesis in pairs])
+    scores = np.column_stack([_bleu(correct, guess, testlen, reflen), rouge])
+
+    group_ids = np.array([group_id for group_id, _, _ in pairs])
+    for (group_id, _, _), row in zip(pairs, scores.tolist()):
+        sentences[group_id]["metrics"].append(dict(zip(METRICS, row)))
+    sums = np.zeros((len(groups), len(METRICS)))
+    np.add.at(sums, group_ids, scores)
+    sizes = np.bincount(group_ids, minlength=len(groups))
+    for group_id in np.nonzero(sizes)[0]:
+        sentences[group_id]["average_metrics"] = dict(zip(METRICS, (sums[group_id] / sizes[group_id]).tolist()))
+
+    corpus_bleu = _bleu(correct.sum(0), guess.sum(0), testlen.sum(), reflen.sum())
+    corpus = dict(zip(METRICS, corpus_bleu.tolist() + [float(rouge.mean())]))
+    return {"sentences": sentences, "corpus": corpus}
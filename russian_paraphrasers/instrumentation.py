@@ -0,0 +1,170 @@
+"""
+Instrumentation of paraphrasers: stage events, timings and counters.
+
+Stages are tokenize, generate, decode, clean, rank and eval. Counters are
+numbers of generated, deduplicated, filtered and returned candidates,
+sentences taken from the result cache and input and output tokens.
+Nothing is measured while a paraphraser has no hooks and timings=False.
+"""
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["tokenize", "generate", "decode", "clean", "rank", "eval"]
+COUNTERS = ["generated", "deduplicated", "filtered", "returned", "cached", "input_tokens", "output_tokens"]
+
+
+def _stage_order(stage: str) -> int:
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+class StageHook:
+    """Base class of hooks, pass them as Paraphraser(hooks=[...]) or append to paraphraser.hooks"""
+
+    def on_stage_start(self, stage: str) -> None:
+        pass
+
+    def on_stage_end(self, stage: str, seconds: float) -> None:
+        pass
+
+    def on_request_end(self, timings: Dict[str, float], counters: Dict[str, int]) -> None:
+        """
+        Called after every generate or generate_batch call
+        :param timings: seconds of every stage and "total"
+        :param counters: COUNTERS values
+        """
+        pass
+
+
+class Recorder:
+    def __init__(self, hooks: List[StageHook]) -> None:
+        """
+        Timings and counters of one generate_batch call
+        :param hooks: hooks to notify
+        """
+        self.hooks = hooks
+        self.timings = defaultdict(float)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.start = time.perf_counter()
+
+    def stage(self, stage: str) -> "_Stage":
+        return _Stage(self, stage)
+
+    def count(self, counter: str, value: int) -> None:
+        self.counters[counter] += value
+
+    def finish(self) -> Dict[str, float]:
+        timings = dict(sorted(self.timings.items(), key=lambda item: _stage_order(item[0])))
+        timings["total"] = time.perf_counter() - self.start
+        for hook in self.hooks:
+            hook.on_request_end(timings, self.counters)
+        return timings
+
+
+class _Stage:
+    __slots__ = ("recorder", "stage", "start")
+
+    def __init__(self, recorder: Recorder, stage: str) -> None:
+        self.recorder = recorder
+        self.stage = stage
+
+    def __enter__(self):
+        for hook in self.recorder.hooks:
+            hook.on_stage_start(self.stage)
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.recorder.timings[self.stage] += seconds
+        for hook in self.recorder.hooks:
+            hook.on_stage_end(self.stage, seconds)
+        return False
+
+
+class StageTimer(StageHook):
+    def __init__(self) -> None:
+        """Total time and number of calls of every stage and total counters"""
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def on_stage_end(self, stage: str, seconds: float) -> None:
+        self.totals[stage] += seconds
+        self.calls[stage] += 1
+
+    def on_request_end(self, timings: Dict[str, float], counters: Dict[str, int]) -> None:
+        for counter, value in counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def reset(self) -> None:
+        self.totals.clear()
+        self.calls.clear()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            stage: {"seconds": self.totals[stage], "calls": self.calls[stage]}
+            for stage in sorted(self.totals, key=_stage_order)
+        }
+
+
+class TimingAggregator(StageHook):
+    def __init__(
+        self,
+        window: int = 1000,
+        log_every: Optional[int] = 100,
+        percentiles: tuple = (50, 90, 99)
+    ) -> None:
+        """
+        Rolling percentiles of stage and total times of the last requests
+        :param window: number of last requests
+        :param log_every: log percentiles every log_every requests, None - never
+        :param percentiles: percentiles to report
+        """
+        self.window = window
+        self.log_every = log_every
+        self.percentiles = percentiles
+        self.requests = 0
+        self._timings = defaultdict(lambda: deque(maxlen=window))
+        self._counters = defaultdict(lambda: deque(maxlen=window))
+
+    def on_request_end(self, timings: Dict[str, float], counters: Dict[str, int]) -> None:
+        for stage, seconds in timings.items():
+            self._timings[stage].append(seconds)
+        for counter, value in counters.items():
+            self._counters[counter].append(value)
+        self.requests += 1
+        if self.log_every and self.requests % self.log_every == 0:
+            self.log()
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Percentiles of the last requests
+        :return: {stage or "total": {"p50": seconds, ...}, "counters": {counter: mean per request}}
+        """
+        stats = {}
+        for stage in sorted(self._timings, key=_stage_order):
+            values = sorted(self._timings[stage])
+            stats[stage] = {
+                "p{}".format(q): values[min(len(values) - 1, int(len(values) * q / 100))]
+                for q in self.percentiles
+            }
+        stats["counters"] = {
+            counter: sum(values) / len(values) for counter, values in self._counters.items() if values
+        }
+        return stats
+
+    def log(self) -> None:
+        stats = self.stats()
+        counters = stats.pop("counters")
+        logger.info("Last {} requests: {}; per request: {}".format(
+            min(self.requests, self.window),
+            ", ".join(
+                "{} {}".format(stage, "/".join("{:.1f}".format(1000 * value) for value in values.values()))
+                for stage, values in stats.items()
+            ) + " ms ({})".format("/".join("p{}".format(q) for q in self.percentiles)),
+            ", ".join("{} {:.1f}".format(counter, value) for counter, value in counters.items()),
+        ))
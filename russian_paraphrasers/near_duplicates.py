@@ -0,0 +1,340 @@
+"""
+Near-duplicate index over a reference corpus.
+
+The index is built once. It keeps MinHash signatures of character n-grams
+with LSH bands for lexical near duplicates and normalized sentence
+embeddings for semantic ones. All arrays are raw files read through
+np.memmap, so an index of millions of sentences opens at once and is
+shared by processes through the page cache. Candidates are checked in
+batches: LSH buckets are found with np.searchsorted and embeddings are
+compared by matrix products over chunks of the corpus.
+
+python -m russian_paraphrasers.near_duplicates dataset/golden_test.txt golden_index --ranker_path paraphrase-xlm-r-multilingual-v1
+"""
+import argparse
+import json
+import logging
+import os
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from russian_paraphrasers.candidates_filter_metrics import normalize_embeddings
+
+logger = logging.getLogger(__name__)
+
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16
+
+_MASK = np.uint64(0xFFFFFFFF)
+_SHINGLE_BASE = np.uint64(1000003)
+_BAND_BASE = np.uint64(0x100000001B3)
+
+
+def _permutations(num_perm: int, seed: int = 1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _fmix(h: np.ndarray) -> np.ndarray:
+    # murmur3 32-bit finalizer on uint64 arrays of 32-bit values
+    h = h ^ (h >> np.uint64(16))
+    h = (h * np.uint64(0x85EBCA6B)) & _MASK
+    h = h ^ (h >> np.uint64(13))
+    h = (h * np.uint64(0xC2B2AE35)) & _MASK
+    return h ^ (h >> np.uint64(16))
+
+
+def _shingles(texts: List[str], ngram: int):
+    """
+    32-bit hashes of character n-grams of all texts
+    :return: hashes and start of every text in them, every text has at least one n-gram
+    """
+    codes = [
+        np.frombuffer(" ".join(text.lower().split()).ljust(ngram).encode("utf-32-le"), dtype=np.uint32)
+        for text in texts
+    ]
+    lengths = np.array([len(c) for c in codes])
+    codes = np.concatenate(codes).astype(np.uint64)
+    ends = np.cumsum(lengths)
+    count = len(codes) - ngram + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for k in range(ngram):
+        hashes = (hashes * _SHINGLE_BASE + codes[k:k + count]) & _MASK
+    # n-grams which do not cross the end of their text
+    text_ids = np.repeat(np.arange(len(texts)), lengths)[:count]
+    valid = np.arange(count) + ngram <= ends[text_ids]
+    starts = np.searchsorted(text_ids[valid], np.arange(len(texts)))
+    return hashes[valid], starts
+
+
+def minhash(texts: List[str], ngram: int = NGRAM, num_perm: int = NUM_PERM, seed: int = 1) -> np.ndarray:
+    """
+    MinHash signatures of character n-gram sets of lowercased texts with collapsed whitespace
+    :param texts: strings
+    :param ngram: n-gram length in characters
+    :param num_perm: signature length
+    :param seed: seed of the hash functions, must be the same for the index and queries
+    :return: uint32 array (len(texts), num_perm)
+    """
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    if not texts:
+        return signatures
+    hashes, starts = _shingles(texts, ngram)
+    hashes = _fmix(hashes)
+    a, b = _permutations(num_perm, seed)
+    for i in range(num_perm):
+        # a * x + b mod 2^32 with odd a and the murmur3 finalizer are permutations of 32-bit values
+        signatures[:, i] = np.minimum.reduceat(_fmix((a[i] * hashes + b[i]) & _MASK), starts)
+    return signatures
+
+
+def band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """
+    LSH keys: every band of rows of a signature is hashed into one 64-bit key
+    :param signatures: (n, num_perm) MinHash signatures
+    :param bands: number of bands, num_perm must be divisible by it
+    :return: uint64 array (n, bands)
+    """
+    n, num_perm = signatures.shape
+    rows = signatures.reshape(n, bands, num_perm // bands).astype(np.uint64)
+    keys = np.zeros((n, bands), dtype=np.uint64)
+    for r in range(rows.shape[-1]):
+        # wraps around 2^64
+        keys = keys * _BAND_BASE + rows[:, :, r]
+    return keys
+
+
+class NearDuplicateIndex:
+    def __init__(self, path: str, max_jaccard: float = 0.8, max_similarity: Optional[float] = 0.95) -> None:
+        """
+        Open an index built by NearDuplicateIndex.build
+        :param path: index directory
+        :param max_jaccard: candidates with estimated Jaccard similarity of character n-grams
+        to a corpus sentence >= max_jaccard are near duplicates
+        :param max_similarity: candidates with cosine similarity of embeddings to a corpus sentence
+        >= max_similarity are near duplicates, None - embeddings are not compared
+        """
+        self.path = path
+        self.max_jaccard = max_jaccard
+        self.max_similarity = max_similarity
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.size = self.meta["size"]
+        self.ngram = self.meta["ngram"]
+        self.num_perm = self.meta["num_perm"]
+        self.bands = self.meta["bands"]
+        self.seed = self.meta["seed"]
+        self.signatures = self._memmap("signatures.u32", np.uint32, (self.size, self.num_perm))
+        self.band_keys = self._memmap("band_keys.u64", np.uint64, (self.bands, self.size))
+        self.band_ids = self._memmap("band_ids.u32", np.uint32, (self.bands, self.size))
+        self.offsets = self._memmap("offsets.u64", np.uint64, (self.size + 1,))
+        self.embeddings = None
+        if self.meta["dim"]:
+            self.embeddings = self._memmap("embeddings.f32", np.float32, (self.size, self.meta["dim"]))
+
+    def _memmap(self, name: str, dtype, shape) -> np.ndarray:
+        if not all(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        sentences: Iterable[str],
+        smodel=None,
+        model_name: str = "",
+        ngram: int = NGRAM,
+        num_perm: int = NUM_PERM,
+        bands: int = BANDS,
+        seed: int = 1,
+        chunk_size: int = 10000,
+        **kwargs
+    ) -> "NearDuplicateIndex":
+        """
+        Build an index over a corpus. Sentences, signatures and embeddings are processed by chunks,
+        sorting of LSH bands keeps about 30 bytes per corpus sentence in memory
+        :param path: index directory, existing index files are overwritten
+        :param sentences: corpus sentences, list or stream
+        :param smodel: SentenceTransformer (ranker of the paraphraser), None - lexical index only
+        :param model_name: name of the encoder, stored to check queries
+        :param ngram: n-gram length in characters
+        :param num_perm: MinHash signature length
+        :param bands: number of LSH bands, more bands - lower Jaccard similarities are found
+        :param seed: seed of the hash functions
+        :param chunk_size: number of sentences processed at once
+        :param kwargs: parameters of NearDuplicateIndex (max_jaccard, max_similarity)
+        :return: opened index
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm {} is not divisible by bands {}".format(num_perm, bands))
+        os.makedirs(path, exist_ok=True)
+        size, dim, offset = 0, 0, 0
+        iterator = iter(sentences)
+        with open(os.path.join(path, "sentences.txt"), "wb") as text_file, \
+                open(os.path.join(path, "offsets.u64"), "wb") as offsets_file, \
+                open(os.path.join(path, "signatures.u32"), "wb") as signatures_file, \
+                open(os.path.join(path, "embeddings.f32"), "wb") as embeddings_file:
+            while True:
+                chunk = [" ".join(sentence.split()) for sentence in islice(iterator, chunk_size)]
+                if not chunk:
+                    break
+                lines = [(sentence + "\n").encode("utf-8") for sentence in chunk]
+                starts = offset + np.cumsum([0] + [len(line) for line in lines[:-1]])
+                offset += sum(len(line) for line in lines)
+                text_file.write(b"".join(lines))
+                starts.astype(np.uint64).tofile(offsets_file)
+                minhash(chunk, ngram, num_perm, seed).tofile(signatures_file)
+                if smodel is not None:
+                    embeddings = normalize_embeddings(smodel.encode(chunk))
+                    dim = embeddings.shape[1]
+                    embeddings.tofile(embeddings_file)
+                size += len(chunk)
+                logger.info("Indexed {} sentences".format(size))
+            np.array([offset], dtype=np.uint64).tofile(offsets_file)
+
+        # every band sorted by key, bucket of a key is a range found by np.searchsorted;
+        # signatures are read from disk by chunks, only the keys of one band are in memory
+        rows = num_perm // bands
+        with open(os.path.join(path, "band_keys.u64"), "wb") as keys_file, \
+                open(os.path.join(path, "band_ids.u32"), "wb") as ids_file:
+            if size:
+                signatures = np.memmap(
+                    os.path.join(path, "signatures.u32"), dtype=np.uint32, mode="r", shape=(size, num_perm)
+                )
+                for band in range(bands):
+                    keys = np.empty(size, dtype=np.uint64)
+                    for start in range(0, size, chunk_size):
+                        band_rows = signatures[start:start + chunk_size, band * rows:(band + 1) * rows]
+                        keys[start:start + chunk_size] = band_keys(np.ascontiguousarray(band_rows), 1)[:, 0]
+                    order = np.argsort(keys, kind="stable")
+                    keys[order].tofile(keys_file)
+                    order.astype(np.uint32).tofile(ids_file)
+                del signatures
+
+        meta = {
+            "size": size, "dim": dim, "model_name": model_name,
+            "ngram": ngram, "num_perm": num_perm, "bands": bands, "seed": seed,
+        }
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return cls(path, **kwargs)
+
+    def sentence(self, idx: int) -> str:
+        """Corpus sentence by its number"""
+        with open(os.path.join(self.path, "sentences.txt"), "rb") as f:
+            f.seek(int(self.offsets[idx]))
+            return f.read(int(self.offsets[idx + 1] - self.offsets[idx])).decode("utf-8").rstrip("\n")
+
+    def query(self, candidates: List[str], smodel=None, chunk_size: int = 65536) -> Dict[str, np.ndarray]:
+        """
+        The most similar corpus sentences of every candidate
+        :param candidates: strings
+        :param smodel: the encoder the index was built with, None - embeddings are not compared
+        :param chunk_size: number of corpus embeddings multiplied at once
+        :return: dict of arrays, one value per candidate: "jaccard" - max estimated Jaccard similarity among
+        sentences sharing an LSH bucket with the candidate (0 if none) and "jaccard_match" - its number (-1 if none);
+        "similarity" and "similarity_match" - max cosine similarity of embeddings and its number (with smodel)
+        """
+        result = {
+            "jaccard": np.zeros(len(candidates)),
+            "jaccard_match": np.full(len(candidates), -1),
+        }
+        if not candidates or not self.size:
+            return result
+        signatures = minhash(candidates, self.ngram, self.num_perm, self.seed)
+        keys = band_keys(signatures, self.bands)
+        lefts = np.empty(keys.shape, dtype=np.int64)
+        rights = np.empty(keys.shape, dtype=np.int64)
+        for band in range(self.bands):
+            lefts[:, band] = np.searchsorted(self.band_keys[band], keys[:, band], side="left")
+            rights[:, band] = np.searchsorted(self.band_keys[band], keys[:, band], side="right")
+        for i in np.flatnonzero((rights > lefts).any(axis=1)):
+            ids = np.unique(np.concatenate([
+                self.band_ids[band, lefts[i, band]:rights[i, band]] for band in range(self.bands)
+            ]))
+            scores = (self.signatures[ids] == signatures[i]).mean(axis=1)
+            best = int(np.argmax(scores))
+            result["jaccard"][i] = scores[best]
+            result["jaccard_match"][i] = ids[best]
+
+        if smodel is not None and self.embeddings is not None:
+            queries = normalize_embeddings(smodel.encode(candidates))
+            similarity = np.full(len(candidates), -np.inf, dtype=np.float32)
+            match = np.full(len(candidates), -1)
+            for start in range(0, self.size, chunk_size):
+                scores = np.asarray(self.embeddings[start:start + chunk_size]) @ queries.T
+                best = scores.argmax(axis=0)
+                best_scores = scores[best, np.arange(len(candidates))]
+                better = best_scores > similarity
+                similarity[better] = best_scores[better]
+                match[better] = best[better] + start
+            result["similarity"] = similarity
+            result["similarity_match"] = match
+        return result
+
+    def is_duplicate(self, candidates: List[str], smodel=None) -> np.ndarray:
+        """
+        :param candidates: strings
+        :param smodel: the encoder the index was built with, None - only n-grams are compared
+        :return: bool array, True for candidates within max_jaccard or max_similarity of a corpus sentence
+        """
+        result = self.query(candidates, smodel if self.max_similarity is not None else None)
+        duplicate = result["jaccard"] >= self.max_jaccard
+        if "similarity" in result:
+            duplicate |= result["similarity"] >= self.max_similarity
+        return duplicate
+
+    def filter(self, candidates: List[str], smodel=None) -> List[str]:
+        """
+        Candidates which are not near duplicates of the corpus
+        :param candidates: strings
+        :param smodel: the encoder the index was built with, None - only n-grams are compared
+        :return: list of candidates
+        """
+        if not candidates:
+            return []
+        duplicate = self.is_duplicate(candidates, smodel)
+        return [candidate for candidate, dup in zip(candidates, duplicate) if not dup]
+
+
+def main():
+    from russian_paraphrasers.corpus import FORMATS, read_corpus
+
+    parser = argparse.ArgumentParser(description="Build near-duplicate index over a corpus")
+    parser.add_argument("input_path")
+    parser.add_argument("index_path")
+    parser.add_argument("--format", default="auto", choices=["auto"] + FORMATS)
+    parser.add_argument("--ranker_path", default=None, help="SentenceTransformer for embeddings, default - no embeddings")
+    parser.add_argument("--ngram", type=int, default=NGRAM)
+    parser.add_argument("--num_perm", type=int, default=NUM_PERM)
+    parser.add_argument("--bands", type=int, default=BANDS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    def sentences():
+        # both sides of pairs are in the corpus
+        for _, _, record in read_corpus(args.input_path, fmt=args.format):
+            yield record["sentence"]
+            if record.get("reference"):
+                yield record["reference"]
+
+    smodel = None
+    if args.ranker_path:
+        from sentence_transformers import SentenceTransformer
+
+        smodel = SentenceTransformer(args.ranker_path)
+    index = NearDuplicateIndex.build(
+        args.index_path, sentences(), smodel=smodel, model_name=args.ranker_path or "",
+        ngram=args.ngram, num_perm=args.num_perm, bands=args.bands
+    )
+    print("{} sentences indexed in {}".format(index.size, args.index_path))
+
+
+if __name__ == "__main__":
+    main()
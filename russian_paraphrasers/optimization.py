@@ -0,0 +1,121 @@
+"""
+CPU inference optimizations: dynamic int8 quantization, bf16 and thread control.
+"""
+import logging
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+CPU_OPTIMIZATIONS = ["int8", "bf16", "auto"]
+
+
+# thread pool sizes set by set_threads, they are process-wide
+_threads = {}
+
+
+def set_threads(num_threads: Optional[int] = None, num_interop_threads: Optional[int] = None) -> None:
+    """
+    Pin torch intra-op and inter-op thread pools. They are process-wide:
+    all paraphrasers of the process share them, the last call wins
+    :param num_threads: intra-op threads, None - do not change
+    :param num_interop_threads: inter-op threads, None - do not change
+    """
+    if not num_threads and not num_interop_threads:
+        return
+    import torch
+
+    for name, value in (("num_threads", num_threads), ("num_interop_threads", num_interop_threads)):
+        if value and _threads.get(name, value) != value:
+            logger.warning("{} of the process is changed from {} to {}".format(name, _threads[name], value))
+    if num_threads:
+        torch.set_num_threads(num_threads)
+        _threads["num_threads"] = num_threads
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+            _threads["num_interop_threads"] = num_interop_threads
+        except RuntimeError as e:
+            # can be set only once, before any inter-op parallel work
+            logger.warning("Can't set inter-op threads: " + str(e))
+
+
+def cpu_supports_bf16() -> bool:
+    """
+    Check CPU flags for native bf16 instructions (avx512_bf16 or amx_bf16), Linux only
+    :return: bool
+    """
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def conv1d_to_linear(model):
+    """
+    Replace transformers Conv1D layers (GPT-2 attention and mlp) by equal nn.Linear,
+    dynamic quantization works only with nn.Linear
+    :param model: torch model
+    :return: the same model
+    """
+    import torch
+
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if type(child).__name__ != "Conv1D":
+                continue
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, bias=child.bias is not None)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(module, child_name, linear)
+    return model
+
+
+def quantize_int8(model, skip: Iterable[str] = ("lm_head",)):
+    """
+    Dynamic int8 quantization of nn.Linear layers
+    :param model: torch model on CPU
+    :param skip: names of layers kept in float (lm_head is tied with embeddings)
+    :return: quantized model
+    """
+    import torch
+
+    conv1d_to_linear(model)
+    skip = set(skip)
+    layers = {
+        name for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.split(".")[-1] not in skip
+    }
+    quantize_dynamic = getattr(torch, "ao", torch).quantization.quantize_dynamic
+    return quantize_dynamic(model, layers, dtype=torch.qint8)
+
+
+def optimize_for_cpu(model, mode: Optional[str] = "auto"):
+    """
+    Optimize model for inference on CPU
+    :param model: torch model on CPU
+    :param mode: "int8" - dynamic quantization, "bf16" - bfloat16 weights,
+    "auto" - bf16 if CPU supports it, otherwise int8, None - nothing
+    :return: optimized model in eval mode
+    """
+    import torch
+
+    if mode is None:
+        return model
+    if mode not in CPU_OPTIMIZATIONS:
+        raise ValueError("Unknown cpu optimization {}. Use one of these: {}".format(
+            mode, ", ".join(CPU_OPTIMIZATIONS)
+        ))
+    if mode == "auto":
+        mode = "bf16" if cpu_supports_bf16() else "int8"
+    model.eval()
+    if mode == "bf16":
+        model = model.to(torch.bfloat16)
+    else:
+        model = quantize_int8(model)
+    logger.info("Model {} optimized for CPU: {}".format(type(model).__name__, mode))
+    return model
@@ -1,15 +1,25 @@
 import logging
+import math
+import os
 from abc import abstractmethod
-from sentence_transformers import SentenceTransformer, util
-from nlgeval import NLGEval
-from typing import Any
-import torch
-import nltk
+from contextlib import nullcontext
+from itertools import islice
+from russian_paraphrasers.candidates_filter_metrics import check_input, passing_candidates, range_candidates
+from russian_paraphrasers.backends import WEIGHT_DTYPES, Backend, get_backend
+from russian_paraphrasers.embedding_cache import EmbeddingCache
+from russian_paraphrasers.evaluation import evaluate
+from russian_paraphrasers.instrumentation import Recorder, StageHook
+from russian_paraphrasers.near_duplicates import NearDuplicateIndex
+from russian_paraphrasers.optimization import CPU_OPTIMIZATIONS, cpu_supports_bf16, optimize_for_cpu, set_threads
+from russian_paraphrasers.preprocessing import Deduplicator
+from russian_paraphrasers.registry import ModelRegistry, model_key, registry as default_registry, resident_memory
+from russian_paraphrasers.result_cache import ResultCache, make_key
+from russian_paraphrasers.streaming import CandidateStream, agenerate_stream, generate_stream
+from russian_paraphrasers.utils import normalize_text, set_seed
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Type, Union
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+RANKER_MODEL = "paraphrase-xlm-r-multilingual-v1"
+_NO_STAGE = nullcontext()
 
 
 class Paraphraser:
@@ -19,36 +29,218 @@ class Paraphraser:
         range_cand: bool = False,
         make_eval: bool = False,
         tokenizer_path: str = "default",
-        pretrained_path: str = "default"
+        pretrained_path: str = "default",
+        embedding_cache_size: int = 10000,
+        embedding_cache_dir: Optional[str] = None,
+        lazy: bool = False,
+        registry: Optional[ModelRegistry] = None,
+        result_cache: Optional[ResultCache] = None,
+        cpu_optimize: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        num_interop_threads: Optional[int] = None,
+        backend: Union[str, Backend] = "torch",
+        export_dir: Optional[str] = None,
+        ranker_path: str = RANKER_MODEL,
+        hooks: Optional[List[StageHook]] = None,
+        timings: bool = False,
+        low_memory: bool = False,
+        weights_dtype: Optional[str] = None,
+        reference_index: Union[str, NearDuplicateIndex, None] = None
     ) -> None:
         """
         Possible models: mt5-large, mt5-base, mt5-small, gpt2, gpt3
-        :param model_name:
-        :param make_filter:
-        :param cache_file_path:
+        :param model_name: one of the models above
+        :param range_cand: True/False. Range candidates with the ranker, results get "best_candidates"
+        :param make_eval: True/False. Make or not average evaluation for n samples.
+        :param tokenizer_path: "default" or some model name in hugging_face format
+        :param pretrained_path: "default" or some model name in hugging_face format
+        :param embedding_cache_size: number of ranker embeddings kept in memory, 0 to disable the cache
+        :param embedding_cache_dir: directory to share ranker embeddings between runs and processes
+        :param lazy: load model weights on the first generate call instead of the constructor
+        :param registry: registry of shared models, default is the process-wide one
+        :param result_cache: ResultCache to reuse results for repeated sentences and parameters, None - no cache
+        :param cpu_optimize: None, "int8" (dynamic quantization), "bf16" or "auto" (bf16 if CPU supports it).
+        Used only when the model runs on CPU, the ranker is quantized to int8 with any of them
+        :param num_threads: torch intra-op threads, None - do not change them. Thread pools are process-wide,
+        they are set only when passed and the last paraphraser that sets them wins
+        :param num_interop_threads: torch inter-op threads, None - do not change them, process-wide too
+        :param backend: "torch" (hugging_face PyTorch model), "onnx" (exported once and run with ONNX Runtime)
+        or Backend instance
+        :param export_dir: directory for exported models of the "onnx" backend
+        :param ranker_path: SentenceTransformer model name or path of the ranker
+        :param hooks: StageHook objects notified about stages and finished requests
+        :param timings: add "timings" (seconds of every stage) and "counters" to every result dict
+        :param low_memory: load weights from memory-mapped safetensors without an initialized copy of the model,
+        peak memory stays near the model size; with cpu_optimize="bf16" weights are loaded in bf16 at once
+        :param weights_dtype: None (as saved), "float16", "bfloat16" or "float32" - dtype of model weights,
+        half precision halves the memory of the model
+        :param reference_index: NearDuplicateIndex or its directory, with range_cand candidates near duplicating
+        its corpus are dropped; the index should be built with the same ranker to compare embeddings
         """
         self.logger = logging.getLogger(__name__)
         self.tokenizer_path = tokenizer_path
         self.pretrained_path = pretrained_path
         self.make_eval = make_eval
         self.range_cand = range_cand
-        self.device = torch.device("cpu")
-        if self.range_cand:
-            self.smodel = SentenceTransformer("paraphrase-xlm-r-multilingual-v1")
-        if self.make_eval:
-            self.ngeval = NLGEval(
-                metrics_to_omit=[
-                    "EmbeddingAverageCosineSimilairty",
-                    "CIDEr",
-                    "METEOR",
-                    "SkipThoughtCS",
-                    "VectorExtremaCosineSimilarity",
-                    "GreedyMatchingScore",
-                ]
-            )
+        self.device = "cpu"
+        self.lazy = lazy
+        self.model = None
+        self.tokenizer = None
+        self.registry = registry if registry is not None else default_registry
+        self._acquired = []
+        self.result_cache = result_cache
+        if cpu_optimize is not None and cpu_optimize not in CPU_OPTIMIZATIONS:
+            raise ValueError("Unknown cpu optimization {}. Use one of these: {}".format(
+                cpu_optimize, ", ".join(CPU_OPTIMIZATIONS)
+            ))
+        self.cpu_optimize = cpu_optimize
+        self.backend = get_backend(backend, export_dir=export_dir)
+        set_threads(num_threads, num_interop_threads)
+        self.embedding_cache_size = embedding_cache_size
+        self.embedding_cache_dir = embedding_cache_dir
+        self._smodel = None
+        self.ranker_path = ranker_path
+        self.hooks = list(hooks or [])
+        self.timings = timings
+        if weights_dtype is not None and weights_dtype not in WEIGHT_DTYPES:
+            raise ValueError("Unknown weights dtype {}. Use one of these: {}".format(
+                weights_dtype, ", ".join(WEIGHT_DTYPES)
+            ))
+        self.low_memory = low_memory
+        self.weights_dtype = weights_dtype
+        if isinstance(reference_index, str):
+            reference_index = NearDuplicateIndex(reference_index)
+        if reference_index is not None and reference_index.meta["model_name"] not in ("", ranker_path):
+            self.logger.warning("Reference index embeddings are built with {}, the ranker is {}".format(
+                reference_index.meta["model_name"], ranker_path
+            ))
+        self.reference_index = reference_index
+        self._recorder: Optional[Recorder] = None
+        self._stream: Optional[CandidateStream] = None
         self.model_name = model_name
         self._check_model(model_name)
 
+    @property
+    def smodel(self):
+        """SentenceTransformer ranker, created on the first use"""
+        if self._smodel is None:
+            from sentence_transformers import SentenceTransformer
+
+            def load_ranker():
+                smodel = SentenceTransformer(self.ranker_path)
+                # SentenceTransformer.device is missing in old sentence-transformers
+                if self.cpu_optimize and next(smodel.parameters()).device.type == "cpu":
+                    # bf16 embeddings can't be converted to numpy, int8 is used for the ranker
+                    smodel = optimize_for_cpu(smodel, "int8")
+                return smodel
+
+            kind = "ranker-int8" if self.cpu_optimize else "ranker"
+            self._smodel = self._acquire(model_key(kind, self.ranker_path), load_ranker)
+            if self.embedding_cache_size > 0 or self.embedding_cache_dir:
+                self._smodel = EmbeddingCache(
+                    self._smodel, max_size=self.embedding_cache_size,
+                    cache_dir=self.embedding_cache_dir,
+                    model_name=self.ranker_path
+                )
+        return self._smodel
+
+    def _acquire(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        obj = self.registry.acquire(key, factory)
+        self._acquired.append(key)
+        return obj
+
+    def _acquire_model(self, kind: str, model_class: Type) -> Any:
+        """
+        Load the model with the backend or get it from the registry,
+        optimized for CPU if cpu_optimize is set
+        :param kind: "gpt" or "mt5"
+        :param model_class: hugging_face PyTorch class of the model
+        :return: model
+        """
+        optimize = self.cpu_optimize if str(self.device) == "cpu" else None
+        options = {}
+        if self.low_memory:
+            options["low_memory"] = True
+        dtype = self.weights_dtype
+        if optimize:
+            if dtype:
+                self.logger.warning("weights_dtype={} is not used with cpu_optimize={}".format(dtype, optimize))
+                dtype = None
+            mode = optimize if optimize != "auto" else "bf16" if cpu_supports_bf16() else "int8"
+            if self.low_memory and mode == "bf16":
+                # the same weights cpu_optimize makes, without a float32 copy
+                options["dtype"] = "bfloat16"
+        elif dtype:
+            options["dtype"] = dtype
+        kind = "-".join(part for part in [kind, self.backend.name, optimize, dtype] if part and part != "torch")
+        return self._acquire(
+            model_key(kind, self.pretrained_path, self.device),
+            lambda: self.backend.optimize(
+                self.backend.load_model(model_class, self.pretrained_path, self.device, **options), optimize
+            )
+        )
+
+    def _stage(self, stage: str):
+        """Context which reports the stage to hooks, does nothing if instrumentation is off"""
+        if self._recorder is None:
+            return _NO_STAGE
+        return self._recorder.stage(stage)
+
+    @staticmethod
+    def _inference_mode():
+        import torch
+
+        return torch.inference_mode() if hasattr(torch, "inference_mode") else torch.no_grad()
+
+    def unload(self, evict: bool = True) -> None:
+        """
+        Release model, tokenizer and ranker. They are loaded again on the next generate call.
+        :param evict: free them at once if no other paraphraser uses them,
+        otherwise they stay in the registry while they fit into its memory budget
+        """
+        acquired, self._acquired = self._acquired, []
+        self.model = None
+        self.tokenizer = None
+        self._smodel = None
+        for key in acquired:
+            self.registry.release(key, evict=evict)
+
+    def reload(self) -> None:
+        """
+        Unload model, tokenizer and ranker and load them again,
+        e.g. after unload or after a change of cpu_optimize, low_memory or weights_dtype
+        """
+        self.unload(evict=True)
+        self.load()
+
+    def memory_usage(self) -> Dict[str, Dict[str, int]]:
+        """
+        Memory of loaded components in bytes
+        :return: {"model"/"tokenizer"/"ranker": {"size": weights, "rss": growth of resident memory
+        while the component was loaded}, "process": {"rss": resident memory of the process}};
+        components shared with other paraphrasers are counted for every one of them
+        """
+        usage = {}
+        for key in self._acquired:
+            info = self.registry.info(key)
+            if info is None:
+                continue
+            kind = key[0]
+            component = "tokenizer" if "tokenizer" in kind else "ranker" if kind.startswith("ranker") else "model"
+            usage[component] = {"size": info["size"], "rss": info["rss"]}
+        usage["process"] = {"rss": resident_memory()}
+        return usage
+
+    def __del__(self):
+        try:
+            self.unload(evict=False)
+        except Exception:
+            pass
+
+    def _ensure_loaded(self) -> None:
+        if self.model is None:
+            self.load()
+
     def _check_model(self, model_name: str) -> bool:
         __models_dict = ["mt5-large", "mt5-base", "mt5-small", "gpt2", "gpt3"]
         if model_name not in __models_dict:
@@ -60,6 +252,283 @@ class Paraphraser:
             )
         return True
 
+    def _process_candidates(
+        self,
+        sentence: str,
+        predictions: List[str],
+        threshold: float,
+        strategy: str,
+        max_candidates: Optional[int] = None
+    ) -> Dict:
+        """
+        Range generated predictions for one origin sentence
+        :param sentence: origin sentence
+        :param predictions: generated candidates
+        :param threshold: param for cosine similarity range
+        :param strategy: param for range strategy
+        :param max_candidates: max number of best candidates
+        :return: dict with predictions and optional best_candidates
+        """
+        sentence_res = {"predictions": predictions}
+        if self.range_cand:
+            with self._stage("rank"):
+                sentence_res["best_candidates"] = range_candidates(
+                    predictions, sentence, self.smodel,
+                    threshold=threshold, strategy=strategy,
+                    max_candidates=max_candidates, reference_index=self.reference_index
+                )
+        return sentence_res
+
+    def _generate_results(
+        self,
+        sentences: List[str],
+        predict: Callable[[List[str]], List[List[str]]],
+        params: Dict,
+        threshold: float,
+        strategy: str,
+        max_candidates: Optional[int] = None,
+        seed: Optional[int] = None,
+        want: Optional[int] = None,
+        max_samples: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Common part of generate_batch: split inputs into sentences, take cached results,
+        generate candidates for the rest, range and evaluate them
+        :param sentences: list of input strings
+        :param predict: function which generates candidates for a list of sentences,
+        predict(sentences, n=k) generates k sequences per sentence
+        :param params: generation parameters, they are a part of the cache key
+        :param threshold: param for cosine similarity range
+        :param strategy: param for range strategy
+        :param max_candidates: max number of best candidates
+        :param seed: random seed set before generation
+        :param want: sample in rounds until want candidates pass, None - sample params["n"] sequences at once
+        :param max_samples: max number of sequences sampled per sentence in rounds, default is params["n"]
+        :return: list of dicts in the same format as generate, one per input string
+        """
+        args = (sentences, predict, params, threshold, strategy, max_candidates, seed, want, max_samples)
+        if not self.hooks and not self.timings:
+            return self._generate_all(*args)
+
+        self._recorder = Recorder(self.hooks)
+        try:
+            results = self._generate_all(*args)
+        finally:
+            recorder, self._recorder = self._recorder, None
+        timings = recorder.finish()
+        if self.timings:
+            # generate_batch results share timings and counters of the whole call
+            for result in results:
+                result["timings"] = dict(timings)
+                result["counters"] = dict(recorder.counters)
+        return results
+
+    def _generate_all(self, sentences, predict, params, threshold, strategy, max_candidates, seed, want, max_samples):
+        if want is not None:
+            max_samples = max_samples or params["n"]
+            params = dict(params, want=want, max_samples=max_samples)
+            if max_candidates is None:
+                max_candidates = want
+        results = []
+        queue = []
+        for sentence in sentences:
+            result = {"origin": sentence}
+            warning, splitted = check_input(sentence)
+            if warning:
+                result["warning"] = warning
+            result["results"] = [None] * len(splitted)
+            for pos, one in enumerate(splitted):
+                key = None
+                if self.result_cache is not None:
+                    key = self._cache_key(one, params, threshold, strategy, max_candidates, seed)
+                    cached = self.result_cache.get(key)
+                    if cached is not None:
+                        result["results"][pos] = cached
+                        if self._recorder is not None:
+                            self._recorder.count("cached", 1)
+                        continue
+                queue.append((result, pos, one, key))
+            results.append(result)
+        if not queue:
+            return results
+
+        self._ensure_loaded()
+        if seed is not None:
+            set_seed(seed)
+        batch = [one for _, _, one, _ in queue]
+        if want is None:
+            predictions = predict(batch)
+            sampled = [params["n"]] * len(batch)
+        else:
+            predictions, sampled = self._predict_adaptive(
+                predict, batch, want, max_samples, threshold, strategy
+            )
+        processed = [
+            self._process_candidates(sentence, candidates, threshold, strategy, max_candidates)
+            for (_, _, sentence, _), candidates in zip(queue, predictions)
+        ]
+        if self.make_eval:
+            # best candidates or all predictions of all sentences are scored in one pass
+            groups = [
+                (sentence, sentence_res.get("best_candidates") or sentence_res["predictions"])
+                for (_, _, sentence, _), sentence_res in zip(queue, processed)
+            ]
+            with self._stage("eval"):
+                scores = evaluate(groups)["sentences"]
+            for sentence_res, sentence_scores in zip(processed, scores):
+                sentence_res["average_metrics"] = sentence_scores["average_metrics"]
+        if self._recorder is not None:
+            self._count_candidates(processed, sampled)
+        for (result, pos, _, key), sentence_res in zip(queue, processed):
+            if key is not None:
+                self.result_cache.put(key, sentence_res)
+            result["results"][pos] = sentence_res
+        return results
+
+    def _predict_adaptive(
+        self,
+        predict: Callable[..., List[List[str]]],
+        sentences: List[str],
+        want: int,
+        max_samples: int,
+        threshold: float,
+        strategy: str
+    ) -> Tuple[List[List[str]], List[int]]:
+        """
+        Sample candidates in rounds, only new candidates of every round are deduplicated and
+        filtered (by the ranker threshold if range_cand is set). A sentence leaves the rounds
+        as soon as want candidates passed or max_samples sequences were sampled for it.
+        :return: unique candidates and number of sampled sequences for every sentence
+        """
+        candidates = [[] for _ in sentences]
+        seen = [set() for _ in sentences]
+        passed = [0] * len(sentences)
+        sampled = [0] * len(sentences)
+        active = list(range(len(sentences)))
+        while active:
+            # expected number of samples to get the rest, pass rate is estimated with Laplace smoothing
+            needed = max(
+                math.ceil((want - passed[i]) * (sampled[i] + 2) / (passed[i] + 1)) for i in active
+            )
+            size = max(1, min(needed, max(max_samples - sampled[i] for i in active)))
+            outputs = predict([sentences[i] for i in active], n=size)
+            for i, output in zip(active, outputs):
+                budget = min(size, max_samples - sampled[i])
+                sampled[i] += budget
+                new = []
+                with self._stage("clean"):
+                    for candidate in output[:budget]:
+                        if candidate and candidate not in seen[i] and candidate.lower() != sentences[i].lower():
+                            seen[i].add(candidate)
+                            new.append(candidate)
+                candidates[i].extend(new)
+                if self.range_cand:
+                    with self._stage("rank"):
+                        passed[i] += sum(passing_candidates(
+                            new, sentences[i], self.smodel, threshold=threshold, strategy=strategy,
+                            reference_index=self.reference_index
+                        ))
+                else:
+                    passed[i] += len(new)
+            active = [i for i in active if passed[i] < want and sampled[i] < max_samples]
+        return candidates, sampled
+
+    def _count_candidates(self, processed: List[Dict], sampled: List[int]) -> None:
+        """
+        generated - sampled sequences; deduplicated - sequences dropped as repeats (mT5 and adaptive sampling
+        also drop copies of the origin while cleaning, GPT predictions keep repeats and they are dropped by ranking);
+        filtered - unique candidates dropped by ranking; returned - best_candidates or predictions
+        """
+        for sentence_res, sentence_sampled in zip(processed, sampled):
+            predictions = sentence_res["predictions"]
+            if "best_candidates" in sentence_res:
+                returned = len(sentence_res["best_candidates"])
+                unique = len(set(predictions))
+            else:
+                # nothing is dropped after cleaning without ranking
+                returned = unique = len(predictions)
+            self._recorder.count("generated", sentence_sampled)
+            self._recorder.count("deduplicated", sentence_sampled - unique)
+            self._recorder.count("filtered", unique - returned)
+            self._recorder.count("returned", returned)
+
+    def _cache_key(self, sentence, params, threshold, strategy, max_candidates, seed) -> str:
+        extra = {}
+        # fields are added only when set, so keys of the default fp32 torch model do not change
+        if self.backend.name != "torch":
+            extra["backend"] = self.backend.name
+        if self.cpu_optimize:
+            extra["cpu_optimize"] = self.cpu_optimize
+        if self.weights_dtype:
+            extra["weights_dtype"] = self.weights_dtype
+        if self.range_cand and self.reference_index is not None:
+            index = self.reference_index
+            extra["reference_index"] = [
+                os.path.abspath(index.path), index.size, index.max_jaccard, index.max_similarity
+            ]
+        return make_key(
+            model_name=self.model_name,
+            pretrained_path=self.pretrained_path,
+            sentence=normalize_text(sentence),
+            params=params,
+            range_cand=self.range_cand,
+            ranker_path=self.ranker_path if self.range_cand else None,
+            make_eval=self.make_eval,
+            threshold=threshold if self.range_cand else None,
+            strategy=strategy if self.range_cand else None,
+            max_candidates=max_candidates if self.range_cand else None,
+            seed=seed,
+            **extra
+        )
+
+    def generate_stream(self, sentence: str, **generate_kwargs) -> Iterator[Dict]:
+        """
+        Generate paraphrases of one sentence and yield candidates as soon as they are sampled.
+        Generation runs in a background thread, use one call of a paraphraser at a time.
+        :param sentence: str: obligatory one sentence
+        :param generate_kwargs: parameters of generate
+        :return: iterator of event dicts, every one has "event" and "time" (seconds since the call):
+        {"event": "candidate", "sentence", "candidate"} for every new decoded and cleaned candidate
+        ("sentence" is one of the sentences the input was split into),
+        the last one is {"event": "result", "result"} with the same dict as generate returns
+        """
+        return generate_stream(self, sentence, generate_kwargs)
+
+    def agenerate_stream(self, sentence: str, **generate_kwargs) -> AsyncIterator[Dict]:
+        """
+        Async iterator version of generate_stream: async for event in paraphraser.agenerate_stream(...)
+        """
+        return agenerate_stream(self, sentence, generate_kwargs)
+
+    def generate_corpus(
+        self,
+        texts: Iterable[str],
+        chunk_size: int = 1000,
+        normalize: Callable[[str], str] = normalize_text,
+        max_remembered: Optional[int] = 100000,
+        **generate_kwargs
+    ) -> Iterator[Dict]:
+        """
+        Generate paraphrases for a list or a stream of inputs. Inputs are split into sentences and
+        normalized, every unique sentence is generated once and its results are copied to all repeats
+        :param texts: input strings
+        :param chunk_size: number of inputs preprocessed and passed to generate_batch at once
+        :param normalize: sentence -> normalized sentence, equal normalized sentences are generated once
+        :param max_remembered: number of last unique sentences whose results are reused in next chunks,
+        None - all
+        :param generate_kwargs: parameters of generate_batch
+        :return: iterator of dicts in the same format as generate, one per input, in input order;
+        with timings=True results of a chunk share timings and counters of its generate_batch call
+        """
+        deduplicator = Deduplicator(normalize, max_remembered)
+        iterator = iter(texts)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            yield from deduplicator.run(chunk, lambda sentences: self.generate_batch(sentences, **generate_kwargs))
+        deduplicator.log()
+
     @abstractmethod
     def load(self):
         raise NotImplemented
@@ -1,18 +1,9 @@
 # coding=utf-8
-from typing import Dict
+from typing import Dict, List, Optional
 from russian_paraphrasers.paraphrasers import Paraphraser
-from russian_paraphrasers.candidates_filter_metrics import (
-    get_scores,
-    range_candidates,
-    check_input,
-)
-from russian_paraphrasers.utils import clean
-from transformers import (
-    GPT2LMHeadModel,
-    GPT2Tokenizer,
-)
+from russian_paraphrasers.registry import model_key
+from russian_paraphrasers.utils import chunks, clean
 import logging
-import torch
 
 
 class GPTParaphraser(Paraphraser):
@@ -22,7 +13,10 @@ class GPTParaphraser(Paraphraser):
         range_cand: bool = False,
         make_eval: bool = False,
         tokenizer_path: str = "default",
-        pretrained_path: str = "default"
+        pretrained_path: str = "default",
+        batch_size: int = 8,
+        shared_prefill: bool = True,
+        **kwargs
     ):
         """
         The class for GPT2 hugging_face interface.
@@ -31,8 +25,12 @@ class GPTParaphraser(Paraphraser):
         :param make_eval: True/False. Make or not average evaluation for n samples.
         :param tokenizer_path: "default" or some model name in hugging_face format
         :param pretrained_path: "default" or some model name in hugging_face format
+        :param batch_size: default number of prompts in one generate_batch call
+        :param shared_prefill: run every prompt through the model once and share its key-value cache
+        between the n sampled sequences instead of repeating the prompt n times (torch backend only)
+        :param kwargs: other Paraphraser parameters, see Paraphraser.__init__
         """
-        super().__init__(model_name, range_cand, make_eval, tokenizer_path, pretrained_path)
+        super().__init__(model_name, range_cand, make_eval, tokenizer_path, pretrained_path, **kwargs)
         self.logger = logging.getLogger(__name__)
         if tokenizer_path == "default":
             tokenizer_path = "alenusch/ru{}-paraphraser".format(model_name)
@@ -40,14 +38,28 @@ class GPTParaphraser(Paraphraser):
             pretrained_path = "alenusch/ru{}-paraphraser".format(model_name)
         self.tokenizer_path = tokenizer_path
         self.pretrained_path = pretrained_path
-        self.batch_size = 1
-        self.load()
+        self.batch_size = batch_size
+        self.shared_prefill = shared_prefill
+        if not self.lazy:
+            self.load()
 
     def load(self):
-        self.tokenizer = GPT2Tokenizer.from_pretrained(self.tokenizer_path)
-        model = GPT2LMHeadModel.from_pretrained(self.pretrained_path)
+        import torch
+        from transformers import GPT2LMHeadModel, GPT2Tokenizer
+
+        def load_tokenizer():
+            tokenizer = GPT2Tokenizer.from_pretrained(self.tokenizer_path)
+            # left padding keeps every prompt right next to its continuation in a batch
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            return tokenizer
+
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = model.to(self.device)
+        self.tokenizer = self._acquire(
+            model_key("gpt_tokenizer", self.tokenizer_path), load_tokenizer
+        )
+        self.model = self._acquire_model("gpt", GPT2LMHeadModel)
         self.logger.info(
             "Pretrained file and tokenizer for model {} were loaded. {}, {}".format(
                 self.model_name, self.tokenizer_path, self.pretrained_path
@@ -65,7 +77,11 @@ class GPTParaphraser(Paraphraser):
         repetition_penalty: float = 1.5,
         threshold: float = 0.7,
         strategy: str = "cs",
-        stop_token: str = "</s>"
+        stop_token: str = "</s>",
+        max_candidates: Optional[int] = None,
+        seed: Optional[int] = None,
+        want: Optional[int] = None,
+        max_samples: Optional[int] = None
     ) -> Dict:
         """
         Generate paraphrase. You can set parameters
@@ -74,83 +90,210 @@ class GPTParaphraser(Paraphraser):
         :param temperature: temperature
         :param top_k: top_k
         :param top_p: top_p
-        :param max_length: max_length (default is -1)
+        :param max_length: max number of tokens of the prompt with the paraphrase, longer than the prompt
         :param repetition_penalty: repetition_penalty
         :param threshold: param for cosine similarity range
         :param strategy: param for range strategy
-        :param stop_token </s> for gpt2s
+        :param stop_token: generation stops at this token, </s> for gpt2s
+        :param max_candidates: max number of best candidates (diverse ones for "all_cs" strategy)
+        :param seed: random seed for sampling, None - do not reset it
+        :param want: sample in small rounds and stop when want candidates pass deduplication
+        and the threshold (if range_cand), None - sample n sequences at once
+        :param max_samples: max number of sampled sequences with want, default is n
         :return: dict with fields
         obligatory: origin, predictions;
         optional: warning, best_candidates, average_metrics
         """
-        result = {"origin": sentence, "results": []}
-        warning, sentences = check_input(sentence)
-        if warning:
-            result["warning"] = warning
+        return self.generate_batch(
+            [sentence], n=n, temperature=temperature, top_k=top_k, top_p=top_p,
+            max_length=max_length, repetition_penalty=repetition_penalty,
+            threshold=threshold, strategy=strategy, stop_token=stop_token,
+            max_candidates=max_candidates, seed=seed, want=want, max_samples=max_samples
+        )[0]
 
-        for sentence in sentences:
-            my_sentence = "<s>{} === ".format(sentence)
+    def generate_batch(
+        self,
+        sentences: List[str],
+        n: int = 10,
+        temperature: float = 1.0,
+        top_k: int = 10,
+        top_p: float = 0.9,
+        max_length: int = 100,
+        repetition_penalty: float = 1.5,
+        threshold: float = 0.7,
+        strategy: str = "cs",
+        stop_token: str = "</s>",
+        max_candidates: Optional[int] = None,
+        seed: Optional[int] = None,
+        want: Optional[int] = None,
+        max_samples: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Generate paraphrases for many sentences at once.
+        Prompts are left-padded and passed to one model.generate call per batch.
+        :param sentences: list of input strings
+        :param batch_size: number of prompts in one model.generate call (default is self.batch_size)
+        Other parameters are the same as in generate
+        :return: list of dicts in the same format as generate, one per input string
+        """
+        batch_size = batch_size or self.batch_size
+        params = dict(
+            n=n, temperature=temperature, top_k=top_k, top_p=top_p, max_length=max_length,
+            repetition_penalty=repetition_penalty, stop_token=stop_token
+        )
 
-            encoded_prompt = self.tokenizer.encode(
-                my_sentence, add_special_tokens=False, return_tensors="pt"
-            )
-            encoded_prompt = encoded_prompt.to(self.device)
+        def predict(batch_sentences, **overrides):
+            round_params = dict(params, **overrides)
+            predictions = []
+            for batch in chunks(batch_sentences, batch_size):
+                predictions.extend(self._generate_predictions(batch, **round_params))
+            return predictions
 
-            if encoded_prompt.size()[-1] == 0:
-                input_ids = None
-            else:
-                input_ids = encoded_prompt
+        return self._generate_results(
+            sentences, predict, params, threshold, strategy,
+            max_candidates=max_candidates, seed=seed, want=want, max_samples=max_samples
+        )
+
+    def _generate_predictions(
+        self,
+        sentences: List[str],
+        n: int,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        max_length: int,
+        repetition_penalty: float,
+        stop_token: str
+    ) -> List[List[str]]:
+        prompts = ["<s>{} === ".format(sentence) for sentence in sentences]
+        with self._stage("tokenize"):
+            encoding = self.tokenizer(
+                prompts, add_special_tokens=False, padding=True, return_tensors="pt"
+            )
+        input_ids = encoding["input_ids"].to(self.device)
+        attention_mask = encoding["attention_mask"].to(self.device)
+        if self._recorder is not None:
+            self._recorder.count("input_tokens", int(attention_mask.sum()))
+        prompt_length = input_ids.size()[-1]
+        prompt_lengths = attention_mask.sum(dim=1).tolist()
+        if max(prompt_lengths) >= max_length:
+            # older transformers only warn and return the prompt
+            raise ValueError("max_length {} is not longer than the prompt ({} tokens)".format(
+                max_length, max(prompt_lengths)
+            ))
+        # generate runs until the shortest prompt uses up its budget,
+        # continuations of longer prompts are cut at their own budget as if they were not padded
+        budgets = [max_length - length for length in prompt_lengths]
 
+        stop_ids = self._stop_token_ids(stop_token)
+        # cut every continuation at the first stop token, finished sequences are padded after it
+        cut_ids = set(stop_ids)
+        cut_ids.add(self.tokenizer.pad_token_id)
+        streamer = None
+        if self._stream is not None:
+            streamer = self._stream.streamer(
+                sentences, n, stop_ids=cut_ids, budgets=budgets,
+                decode=lambda ids: self._candidate(
+                    self.tokenizer.decode(ids, clean_up_tokenization_spaces=True), stop_token
+                )
+            )
+        num_return_sequences = n
+        prefill = {}
+        with self._stage("generate"), self._inference_mode():
+            if n > 1 and prompt_length > 1 and self.shared_prefill and self.backend.name == "torch":
+                past_key_values = self._prefill(input_ids, attention_mask, n)
+                if past_key_values is not None:
+                    prefill["past_key_values"] = past_key_values
+                else:
+                    # models which do not return their cache, prompts are repeated as hugging_face does
+                    self.logger.debug("Shared prefill is not used: the model returned no cache")
+            if prefill:
+                input_ids = input_ids.repeat_interleave(n, dim=0)
+                attention_mask = attention_mask.repeat_interleave(n, dim=0)
+                num_return_sequences = 1
             output_sequences = self.model.generate(
                 input_ids=input_ids,
-                max_length=max_length,
+                attention_mask=attention_mask,
+                max_length=prompt_length + max(budgets),
                 temperature=temperature,
                 top_k=top_k,
                 top_p=top_p,
                 repetition_penalty=repetition_penalty,
                 do_sample=True,
-                num_return_sequences=n,
+                num_return_sequences=num_return_sequences,
+                eos_token_id=stop_ids,
+                pad_token_id=self.tokenizer.pad_token_id,
+                streamer=streamer,
+                **prefill
             )
 
-            if len(output_sequences.shape) > 2:
-                output_sequences.squeeze_()
+        with self._stage("decode"):
+            continuations = []
+            for row, generated_sequence in enumerate(output_sequences[:, prompt_length:].tolist()):
+                generated_sequence = generated_sequence[:budgets[row // n]]
+                for position, token_id in enumerate(generated_sequence):
+                    if token_id in cut_ids:
+                        generated_sequence = generated_sequence[:position]
+                        break
+                continuations.append(generated_sequence)
+            if self._recorder is not None:
+                self._recorder.count("output_tokens", sum(len(ids) for ids in continuations))
+            texts = self.tokenizer.batch_decode(continuations, clean_up_tokenization_spaces=True)
 
-            generated_sequences = []
-            for generated_sequence_idx, generated_sequence in enumerate(
-                output_sequences
-            ):
-                generated_sequence = generated_sequence.tolist()
-                text = self.tokenizer.decode(
-                    generated_sequence, clean_up_tokenization_spaces=True
-                )
+        predictions = []
+        with self._stage("clean"):
+            for idx in range(len(sentences)):
+                predictions.append([self._candidate(text, stop_token) for text in texts[idx * n:(idx + 1) * n]])
+        return predictions
 
-                text = text[: text.find(stop_token) if stop_token else None]
-
-                text = text.split("</s>")[0].split("\n")[0]
-                total_sequence = (
-                    text[
-                        len(
-                            self.tokenizer.decode(
-                                encoded_prompt[0], clean_up_tokenization_spaces=True
-                            )
-                        ):
-                    ]
-                )
-                total_sequence = clean(total_sequence)
-                generated_sequences.append(total_sequence)
-
-            sentence_res = {"predictions": generated_sequences}
-            best_candidates = []
-            if self.range_cand:
-                best_candidates = range_candidates(
-                    generated_sequences, sentence, self.smodel,
-                    threshold=threshold, strategy=strategy)
-                sentence_res["best_candidates"] = best_candidates
-            if self.make_eval:
-                if not best_candidates:
-                    best_candidates = generated_sequences
-                metrics = get_scores(self.ngeval, best_candidates, sentence)
-                sentence_res["average_metrics"] = metrics
-
-            result["results"].append(sentence_res)
-        return result
+    @staticmethod
+    def _candidate(text: str, stop_token: str) -> str:
+        """Decoded continuation -> candidate"""
+        if stop_token:
+            text = text.split(stop_token)[0]
+        return clean(text)
+
+    def _prefill(self, input_ids, attention_mask, n: int):
+        """
+        Key-value cache of the prompts without their last tokens, computed once and repeated for n samples.
+        generate runs only the last prompt token and the continuations.
+        :param input_ids: left-padded prompts
+        :param attention_mask: attention mask of the prompts
+        :param n: number of samples of every prompt
+        :return: cache for input_ids.repeat_interleave(n, dim=0), None if the model returns no cache
+        """
+        # the same positions generate gives to left-padded prompts
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        outputs = self.model(
+            input_ids=input_ids[:, :-1],
+            attention_mask=attention_mask[:, :-1],
+            position_ids=position_ids[:, :-1],
+            use_cache=True,
+        )
+        past_key_values = getattr(outputs, "past_key_values", None)
+        if past_key_values is None:
+            return None
+        if hasattr(past_key_values, "batch_repeat_interleave"):
+            # Cache object of newer transformers
+            past_key_values.batch_repeat_interleave(n)
+            return past_key_values
+        # tuples of (key, value) per layer of older transformers
+        return tuple(tuple(tensor.repeat_interleave(n, dim=0) for tensor in layer) for layer in past_key_values)
+
+    def _stop_token_ids(self, stop_token: str) -> List[int]:
+        """
+        Ids of single tokens which finish a paraphrase: stop_token, "===", new line and eos
+        :param stop_token: stop token, longer stop strings are cut after decoding
+        :return: list of token ids
+        """
+        stop_ids = set()
+        for token in [stop_token, "</s>", "===", " ===", "\n"]:
+            if token:
+                encoded = self.tokenizer.encode(token, add_special_tokens=False)
+                if len(encoded) == 1:
+                    stop_ids.add(encoded[0])
+        if self.tokenizer.eos_token_id is not None:
+            stop_ids.add(self.tokenizer.eos_token_id)
+        return sorted(stop_ids)
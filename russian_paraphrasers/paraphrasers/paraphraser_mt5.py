@@ -1,13 +1,7 @@
-import torch
-from typing import Dict
-from transformers import MT5ForConditionalGeneration, AutoTokenizer
-from russian_paraphrasers.utils import set_seed
+from typing import Dict, List, Optional
+from russian_paraphrasers.registry import model_key
+from russian_paraphrasers.utils import chunks, set_seed
 from russian_paraphrasers.paraphrasers import Paraphraser
-from russian_paraphrasers.candidates_filter_metrics import (
-    get_scores,
-    range_candidates,
-    check_input,
-)
 import logging
 
 
@@ -18,7 +12,9 @@ class Mt5Paraphraser(Paraphraser):
         range_cand: bool = False,
         make_eval: bool = False,
         tokenizer_path: str = "default",
-        pretrained_path: str = "default"
+        pretrained_path: str = "default",
+        batch_size: int = 8,
+        **kwargs
     ):
         """
         The class for Mt5 hugging_face interface.
@@ -27,8 +23,10 @@ class Mt5Paraphraser(Paraphraser):
         :param make_eval: True/False. Make or not average evaluation for n samples.
         :param tokenizer_path: "default" or some model name in hugging_face format
         :param pretrained_path: "default" or some model name in hugging_face format
+        :param batch_size: default number of sentences in one generate_batch call
+        :param kwargs: other Paraphraser parameters, see Paraphraser.__init__
         """
-        super().__init__(model_name, range_cand, make_eval, tokenizer_path, pretrained_path)
+        super().__init__(model_name, range_cand, make_eval, tokenizer_path, pretrained_path, **kwargs)
         self.logger = logging.getLogger(__name__)
         if tokenizer_path == "default":
             tokenizer_path = "alenusch/{}-ruparaphraser".format(
@@ -40,14 +38,21 @@ class Mt5Paraphraser(Paraphraser):
             )
         self.tokenizer_path = tokenizer_path
         self.pretrained_path = pretrained_path
-        self.load()
+        self.batch_size = batch_size
+        if not self.lazy:
+            self.load()
 
     def load(self):
+        import torch
+        from transformers import MT5ForConditionalGeneration, AutoTokenizer
+
         set_seed(42)
-        _model = MT5ForConditionalGeneration.from_pretrained(self.pretrained_path)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_path)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = _model.to(self.device)
+        self.model = self._acquire_model("mt5", MT5ForConditionalGeneration)
+        self.tokenizer = self._acquire(
+            model_key("mt5_tokenizer", self.tokenizer_path),
+            lambda: AutoTokenizer.from_pretrained(self.tokenizer_path)
+        )
         self.logger.info(
             "Pretrained file and tokenizer for model {} were loaded.".format(
                 self.model_name
@@ -64,7 +69,12 @@ class Mt5Paraphraser(Paraphraser):
         max_length: int = 150,
         repetition_penalty: float = 1.5,
         threshold: float = 0.8,
-        strategy: str = "cs"
+        strategy: str = "cs",
+        length_ratio: Optional[float] = 2.0,
+        max_candidates: Optional[int] = None,
+        seed: Optional[int] = None,
+        want: Optional[int] = None,
+        max_samples: Optional[int] = None
     ) -> Dict:
         """
         Generate paraphrase. You can set parameters
@@ -73,30 +83,115 @@ class Mt5Paraphraser(Paraphraser):
         :param temperature: temperature
         :param top_k: top_k
         :param top_p: top_p
-        :param max_length: max_length
+        :param max_length: max_length, upper bound for the output length
         :param repetition_penalty: repetition_penalty
         :param threshold: param for cosine similarity range
         :param strategy: param for range strategy
+        :param length_ratio: output length cap relative to the source token length, None to use max_length
+        :param max_candidates: max number of best candidates (diverse ones for "all_cs" strategy)
+        :param seed: random seed for sampling, None - do not reset it
+        :param want: sample in small rounds and stop when want candidates pass deduplication
+        and the threshold (if range_cand), None - sample n sequences at once
+        :param max_samples: max number of sampled sequences with want, default is n
         :return: dict with fields
         obligatory: origin, predictions;
         optional: warning, best_candidates, average_metrics
         """
-        result = {"origin": sentence, "results": []}
-        warning, sentences = check_input(sentence)
-        if warning:
-            result["warning"] = warning
+        return self.generate_batch(
+            [sentence], n=n, temperature=temperature, top_k=top_k, top_p=top_p,
+            max_length=max_length, repetition_penalty=repetition_penalty,
+            threshold=threshold, strategy=strategy, length_ratio=length_ratio,
+            max_candidates=max_candidates, seed=seed, want=want, max_samples=max_samples
+        )[0]
 
-        for sentence in sentences:
-            final_outputs = []
-            lsentence = "перефразируй: " + sentence + "</s>"
-            encoding = self.tokenizer.encode_plus(
-                lsentence, pad_to_max_length=True, return_tensors="pt"
-            )
-            input_ids, attention_masks = (
-                encoding["input_ids"].to(self.device),
-                encoding["attention_mask"].to(self.device),
+    def generate_batch(
+        self,
+        sentences: List[str],
+        n: int = 10,
+        temperature: float = 1.0,
+        top_k: int = 10,
+        top_p: float = 0.95,
+        max_length: int = 150,
+        repetition_penalty: float = 1.5,
+        threshold: float = 0.8,
+        strategy: str = "cs",
+        length_ratio: Optional[float] = 2.0,
+        max_candidates: Optional[int] = None,
+        seed: Optional[int] = None,
+        want: Optional[int] = None,
+        max_samples: Optional[int] = None,
+        batch_size: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Generate paraphrases for many sentences at once.
+        Sentences are grouped into buckets of similar token length and
+        every bucket is padded only to its longest sentence.
+        :param sentences: list of input strings
+        :param batch_size: number of sentences in one model.generate call (default is self.batch_size)
+        Other parameters are the same as in generate
+        :return: list of dicts in the same format as generate, one per input string
+        """
+        batch_size = batch_size or self.batch_size
+        params = dict(
+            n=n, temperature=temperature, top_k=top_k, top_p=top_p, max_length=max_length,
+            repetition_penalty=repetition_penalty, length_ratio=length_ratio
+        )
+
+        def predict(batch_sentences, **overrides):
+            round_params = dict(params, **overrides)
+            with self._stage("tokenize"):
+                encodings = self.tokenizer(
+                    ["перефразируй: " + one + "</s>" for one in batch_sentences]
+                )["input_ids"]
+            order = sorted(range(len(batch_sentences)), key=lambda i: len(encodings[i]))
+            predictions = [None] * len(batch_sentences)
+            for bucket in chunks(order, batch_size):
+                bucket_predictions = self._generate_predictions(
+                    [batch_sentences[i] for i in bucket], [encodings[i] for i in bucket], **round_params
+                )
+                for i, final_outputs in zip(bucket, bucket_predictions):
+                    predictions[i] = final_outputs
+            return predictions
+
+        return self._generate_results(
+            sentences, predict, params, threshold, strategy,
+            max_candidates=max_candidates, seed=seed, want=want, max_samples=max_samples
+        )
+
+    def _generate_predictions(
+        self,
+        sentences: List[str],
+        input_ids: List[List[int]],
+        n: int,
+        temperature: float,
+        top_k: int,
+        top_p: float,
+        max_length: int,
+        repetition_penalty: float,
+        length_ratio: Optional[float]
+    ) -> List[List[str]]:
+        with self._stage("tokenize"):
+            encoding = self.tokenizer.pad(
+                {"input_ids": input_ids}, padding="longest", return_tensors="pt"
             )
+        input_ids, attention_masks = (
+            encoding["input_ids"].to(self.device),
+            encoding["attention_mask"].to(self.device),
+        )
+        if self._recorder is not None:
+            self._recorder.count("input_tokens", int(attention_masks.sum()))
+        if length_ratio:
+            max_length = min(max_length, int(input_ids.size()[-1] * length_ratio) + 10)
 
+        streamer = None
+        if self._stream is not None:
+            streamer = self._stream.streamer(
+                sentences, n, stop_ids=[self.tokenizer.eos_token_id],
+                decode=lambda ids: self.tokenizer.decode(
+                    ids, skip_special_tokens=True, clean_up_tokenization_spaces=True
+                )
+            )
+        with self._stage("generate"), self._inference_mode():
             beam_outputs = self.model.generate(
                 input_ids=input_ids,
                 attention_mask=attention_masks,
@@ -108,29 +203,24 @@ class Mt5Paraphraser(Paraphraser):
                 early_stopping=True,
                 num_return_sequences=n,
                 repetition_penalty=repetition_penalty,
+                streamer=streamer,
+            )
+        if self._recorder is not None:
+            # decoder start token is the pad token
+            self._recorder.count("output_tokens", int((beam_outputs != self.tokenizer.pad_token_id).sum()))
+        with self._stage("decode"):
+            decoded = self.tokenizer.batch_decode(
+                beam_outputs,
+                skip_special_tokens=True,
+                clean_up_tokenization_spaces=True,
             )
-            for beam_output in beam_outputs:
-                sent = self.tokenizer.decode(
-                    beam_output,
-                    skip_special_tokens=True,
-                    clean_up_tokenization_spaces=True,
-                )
-                if sent.lower() != sentence.lower() and sent not in final_outputs:
-                    final_outputs.append(sent)
-
-            sentence_res = {"predictions": final_outputs}
-            best_candidates = []
-            if self.range_cand:
-                best_candidates = range_candidates(
-                    final_outputs, sentence, self.smodel,
-                    threshold=threshold, strategy=strategy
-                )
-                sentence_res["best_candidates"] = best_candidates
-            if self.make_eval:
-                if not best_candidates:
-                    best_candidates = final_outputs
-                metrics = get_scores(self.ngeval, best_candidates, sentence)
-                sentence_res["average_metrics"] = metrics
 
-            result["results"].append(sentence_res)
-        return result
\ No newline at end of file
+        predictions = []
+        with self._stage("clean"):
+            for idx, sentence in enumerate(sentences):
+                final_outputs = []
+                for sent in decoded[idx * n:(idx + 1) * n]:
+                    if sent.lower() != sentence.lower() and sent not in final_outputs:
+                        final_outputs.append(sent)
+                predictions.append(final_outputs)
+        return predictions
@@ -0,0 +1,124 @@
+"""
+Bulk preprocessing of inputs before generation.
+
+Inputs are split into sentences with check_input, sentences are normalized
+and exact and normalized duplicates are collapsed, so every unique sentence
+is generated once. Results are expanded back to every input with its own
+origin and warning. Deduplicator remembers results of the last unique
+sentences, so repeats are collapsed across chunks of a stream too.
+"""
+import copy
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from russian_paraphrasers.candidates_filter_metrics import check_input
+from russian_paraphrasers.utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# fields of a generate result which describe the whole generate_batch call
+CALL_FIELDS = ["timings", "counters"]
+
+
+class Prepared:
+    def __init__(self) -> None:
+        """Inputs split into unique normalized sentences"""
+        # origin, warning and positions of its sentences in self.sentences
+        self.inputs: List[Tuple[str, Optional[str], List[int]]] = []
+        self.sentences: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.total = 0
+
+    def add(self, text: str, normalize: Callable[[str], str] = normalize_text) -> None:
+        warning, splitted = check_input(text)
+        ids = []
+        for sentence in splitted:
+            sentence = normalize(sentence)
+            if sentence not in self.positions:
+                self.positions[sentence] = len(self.sentences)
+                self.sentences.append(sentence)
+            ids.append(self.positions[sentence])
+        self.total += len(ids)
+        self.inputs.append((text, warning, ids))
+
+
+def prepare(texts: List[str], normalize: Callable[[str], str] = normalize_text) -> Prepared:
+    """
+    Split inputs into sentences, normalize them and collapse duplicates
+    :param texts: input strings
+    :param normalize: sentence -> normalized sentence, equal normalized sentences are generated once
+    :return: Prepared with unique sentences in .sentences
+    """
+    prepared = Prepared()
+    for text in texts:
+        prepared.add(text, normalize)
+    return prepared
+
+
+def expand(prepared: Prepared, results: Dict[str, List[Dict]], call_fields: Optional[Dict] = None) -> List[Dict]:
+    """
+    Results of unique sentences -> results of all inputs
+    :param prepared: prepared inputs
+    :param results: unique sentence -> "results" of generate for it
+    :param call_fields: fields copied to every result, e.g. "timings" and "counters" of the generate_batch call
+    :return: list of dicts in the same format as generate, one per input
+    """
+    expanded = []
+    for text, warning, ids in prepared.inputs:
+        result = {"origin": text}
+        if warning:
+            result["warning"] = warning
+        result["results"] = [
+            copy.deepcopy(sentence_res) for i in ids for sentence_res in results[prepared.sentences[i]]
+        ]
+        for key, value in (call_fields or {}).items():
+            result[key] = copy.deepcopy(value)
+        expanded.append(result)
+    return expanded
+
+
+class Deduplicator:
+    def __init__(self, normalize: Callable[[str], str] = normalize_text, max_size: Optional[int] = 100000) -> None:
+        """
+        Generate every unique sentence of a list or a stream of inputs once
+        :param normalize: sentence -> normalized sentence, equal normalized sentences are generated once
+        :param max_size: number of last unique sentences whose results are kept for next chunks, None - all
+        """
+        self.normalize = normalize
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self.counters = {"inputs": 0, "sentences": 0, "generated": 0}
+
+    def run(self, texts: List[str], generate: Callable[[List[str]], List[Dict]]) -> List[Dict]:
+        """
+        :param texts: input strings
+        :param generate: list of sentences -> list of generate results, e.g. paraphraser.generate_batch
+        :return: list of dicts in the same format as generate, one per input;
+        timings and counters of the generate call (if it adds them) are copied to every result of the chunk,
+        results of a chunk whose sentences were all generated in earlier chunks have none
+        """
+        prepared = prepare(texts, self.normalize)
+        new = [sentence for sentence in prepared.sentences if sentence not in self._results]
+        call_fields = {}
+        if new:
+            generated = generate(new)
+            for sentence, result in zip(new, generated):
+                self._results[sentence] = result["results"]
+            call_fields = {key: generated[0][key] for key in CALL_FIELDS if key in generated[0]}
+        expanded = expand(prepared, self._results, call_fields)
+
+        for sentence in prepared.sentences:
+            self._results.move_to_end(sentence)
+        if self.max_size is not None:
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+        self.counters["inputs"] += len(texts)
+        self.counters["sentences"] += prepared.total
+        self.counters["generated"] += len(new)
+        return expanded
+
+    def log(self) -> None:
+        logger.info("{} inputs, {} sentences, {} generated".format(
+            self.counters["inputs"], self.counters["sentences"], self.counters["generated"]
+        ))
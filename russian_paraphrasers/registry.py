@@ -0,0 +1,175 @@
+"""
+Process-wide registry of loaded models.
+
+Paraphrasers with the same model path and device get the same model,
+tokenizer and ranker instead of loading their own copies.
+"""
+import gc
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def model_key(kind: str, path: str, device: Any = None) -> Tuple[str, str, str]:
+    """
+    Registry key
+    :param kind: "gpt", "mt5", "tokenizer", "ranker", ...
+    :param path: model name or path in hugging_face format
+    :param device: device of the model, None for objects without device
+    :return: key
+    """
+    return kind, path, str(device) if device is not None else ""
+
+
+def estimate_size(obj: Any) -> int:
+    """
+    Memory of torch module parameters and buffers in bytes, 0 for other objects
+    :param obj: model
+    :return: size in bytes
+    """
+    if not callable(getattr(obj, "parameters", None)) or not callable(getattr(obj, "buffers", None)):
+        return 0
+    size = sum(p.numel() * p.element_size() for p in obj.parameters())
+    size += sum(b.numel() * b.element_size() for b in obj.buffers())
+    return size
+
+
+def resident_memory() -> int:
+    """
+    Resident memory of the process in bytes
+    :return: bytes, 0 if it is unknown
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    return psutil.Process().memory_info().rss
+
+
+class _Entry:
+    def __init__(self, obj: Any, size: int, rss: int = 0) -> None:
+        self.obj = obj
+        self.size = size
+        self.rss = rss
+        self.refs = 0
+
+    def info(self) -> Dict[str, int]:
+        return {"refs": self.refs, "size": self.size, "rss": self.rss}
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget: Optional[int] = None) -> None:
+        """
+        Shared models with reference counting.
+        Models nobody uses any more stay loaded while they fit into the memory budget,
+        the least recently used of them are evicted first.
+        :param memory_budget: max size of all models in bytes, None - no limit
+        """
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def acquire(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Get shared object, load it with factory if it is not in the registry
+        :param key: model_key(...)
+        :param factory: function which loads the object
+        :return: shared object
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                rss = resident_memory()
+                obj = factory()
+                entry = _Entry(obj, estimate_size(obj), max(0, resident_memory() - rss))
+                self._entries[key] = entry
+                logger.info("Loaded {} into registry ({:.1f} MB, resident memory +{:.1f} MB)".format(
+                    key, entry.size / 2 ** 20, entry.rss / 2 ** 20
+                ))
+            entry.refs += 1
+            self._entries.move_to_end(key)
+            self._enforce_budget()
+            return entry.obj
+
+    def release(self, key: Hashable, evict: bool = False) -> None:
+        """
+        Drop one reference to the shared object
+        :param key: model_key(...)
+        :param evict: remove the object from the registry at once if nobody uses it
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            if evict and entry.refs == 0:
+                self._evict(key)
+            else:
+                self._enforce_budget()
+
+    def set_memory_budget(self, memory_budget: Optional[int]) -> None:
+        with self._lock:
+            self.memory_budget = memory_budget
+            self._enforce_budget()
+
+    def total_size(self) -> int:
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def _evict(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        logger.info("Evicted {} from registry ({:.1f} MB)".format(key, entry.size / 2 ** 20))
+        del entry
+        gc.collect()
+
+    def _enforce_budget(self) -> None:
+        if self.memory_budget is None:
+            return
+        total = self.total_size()
+        for key in list(self._entries.keys()):
+            if total <= self.memory_budget:
+                return
+            entry = self._entries[key]
+            if entry.refs == 0:
+                total -= entry.size
+                self._evict(key)
+        if total > self.memory_budget:
+            logger.warning(
+                "Models in use take {:.1f} MB, memory budget is {:.1f} MB".format(
+                    total / 2 ** 20, self.memory_budget / 2 ** 20
+                )
+            )
+
+    def info(self, key: Hashable) -> Optional[Dict[str, int]]:
+        """
+        :param key: model_key(...)
+        :return: {"refs", "size" - bytes of weights, "rss" - growth of resident memory while it was loaded}
+        or None if the object is not in the registry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.info() if entry is not None else None
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                ":".join(part for part in key if part): entry.info()
+                for key, entry in self._entries.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            gc.collect()
+
+
+registry = ModelRegistry()
@@ -0,0 +1,128 @@
+"""
+Cache of paraphrasing results.
+
+Results are kept in memory (LRU with TTL) and optionally in a local
+SQLite database, so they survive restarts.
+"""
+import copy
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# seconds between deletions of expired rows from the database
+PURGE_INTERVAL = 60.0
+
+
+def make_key(**fields) -> str:
+    """
+    Stable cache key for model name and path, sentence and generation parameters
+    :param fields: json serializable values
+    :return: sha256 hex digest
+    """
+    data = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: Optional[float] = None,
+        db_path: Optional[str] = None
+    ) -> None:
+        """
+        Two-level cache of generate results for one sentence
+        :param max_size: max number of results kept in memory
+        :param ttl: seconds while a result is valid, None - forever.
+        Expired rows are deleted from the database by put, at most once a minute
+        :param db_path: path to SQLite database, None to keep results only in memory
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+            self._db.commit()
+        self._purged = 0.0
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self.memory.get(key)
+            if item is not None and self._expired(item[0]):
+                del self.memory[key]
+                item = None
+            if item is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    item = (row[1], json.loads(row[0]))
+                    self._remember(key, item)
+            if item is None:
+                self.misses += 1
+                return None
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(item[1])
+
+    def put(self, key: str, value: Dict) -> None:
+        with self._lock:
+            created = time.time()
+            self._remember(key, (created, copy.deepcopy(value)))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), created),
+                )
+                self._purge_expired(created)
+                self._db.commit()
+
+    def _purge_expired(self, now: float) -> None:
+        # expired rows are deleted at most once per PURGE_INTERVAL (or ttl if it is shorter)
+        if self.ttl is None or now - self._purged < min(self.ttl, PURGE_INTERVAL):
+            return
+        self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        self._purged = now
+
+    def _remember(self, key: str, item) -> None:
+        self.memory[key] = item
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_size": len(self.memory)}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
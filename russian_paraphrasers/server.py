@@ -0,0 +1,317 @@
+"""
+Asyncio HTTP/JSON paraphrase server with request coalescing.
+
+Sentences from concurrent requests are queued and passed to
+generate_batch together, up to max_batch_size sentences or after
+max_wait_ms, in one worker thread.
+
+POST /paraphrase {"sentence": "...", "params": {"n": 10, ...}} -> generate result
+GET /health -> status and queue stats
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import numbers
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# parameter -> (type, can be null, min value); "int" and "float" are json numbers, bool is not one of them
+PARAM_TYPES = {
+    "n": ("int", False, 1),
+    "temperature": ("float", False, 0),
+    "top_k": ("int", False, 0),
+    "top_p": ("float", False, 0),
+    "max_length": ("int", False, 1),
+    "repetition_penalty": ("float", False, 0),
+    "threshold": ("float", False, None),
+    "strategy": ("str", False, None),
+    "max_candidates": ("int", True, 1),
+    "seed": ("int", True, 0),
+    "stop_token": ("str", False, None),
+    "length_ratio": ("float", True, 0),
+    "want": ("int", True, 1),
+    "max_samples": ("int", True, 1),
+}
+ALLOWED_PARAMS = set(PARAM_TYPES)
+_TYPE_NAMES = {"int": "an integer", "float": "a number", "str": "a string"}
+STRATEGIES = ["cs", "all_cs"]
+
+
+def check_params(params, allowed=ALLOWED_PARAMS) -> None:
+    """
+    Check generate parameters of a request before it is queued,
+    so a bad request does not fail the batch it would share with others
+    :param params: parameters from the request
+    :param allowed: names of parameters accepted by the paraphraser
+    :raise ValueError: with the reason
+    """
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    unknown = set(params) - allowed
+    if unknown:
+        raise ValueError("Unknown parameters: {}. Use these: {}".format(
+            ", ".join(sorted(unknown)), ", ".join(sorted(allowed))
+        ))
+    for name, value in params.items():
+        kind, nullable, minimum = PARAM_TYPES[name]
+        if value is None:
+            if nullable:
+                continue
+            raise ValueError("{} can't be null".format(name))
+        if kind == "str":
+            valid = isinstance(value, str)
+        elif kind == "int":
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, numbers.Real) and not isinstance(value, bool)
+        if not valid:
+            raise ValueError("{} must be {}, not {}".format(
+                name, _TYPE_NAMES[kind], json.dumps(value, ensure_ascii=False)
+            ))
+        if minimum is not None and value < minimum:
+            raise ValueError("{} must be >= {}, not {}".format(name, minimum, value))
+    if params.get("strategy", "cs") not in STRATEGIES:
+        raise ValueError("Unknown strategy {}. Use one of these: {}".format(
+            params["strategy"], ", ".join(STRATEGIES)
+        ))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        paraphraser,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 1024,
+        generate_kwargs: Optional[Dict] = None
+    ) -> None:
+        """
+        Coalesce single sentences into generate_batch calls
+        :param paraphraser: GPTParaphraser or Mt5Paraphraser
+        :param max_batch_size: max number of sentences in one generate_batch call
+        :param max_wait_ms: how long the first queued sentence waits for others
+        :param max_queue_size: max number of waiting sentences, new ones are rejected
+        :param generate_kwargs: default generate parameters
+        """
+        self.paraphraser = paraphraser
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.generate_kwargs = generate_kwargs or {}
+        accepted = inspect.signature(paraphraser.generate_batch).parameters
+        self.allowed_params = {name for name in ALLOWED_PARAMS if name in accepted}
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self._worker = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, sentence: str, params: Optional[Dict] = None) -> Dict:
+        """
+        Paraphrase one sentence as a part of some batch
+        :param sentence: input string
+        :param params: generate parameters for this sentence
+        :return: generate result
+        """
+        params = dict(self.generate_kwargs, **(params or {}))
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self.queue.put_nowait((sentence, params, future))
+        except asyncio.QueueFull:
+            raise QueueFullError("Too many requests in the queue")
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, Dict, asyncio.Future]]:
+        items = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            items = await self._collect()
+            # only sentences with the same parameters can share a generate_batch call
+            groups = {}
+            for sentence, params, future in items:
+                key = json.dumps(params, sort_keys=True, default=str)
+                groups.setdefault(key, (params, []))[1].append((sentence, future))
+            for params, group in groups.values():
+                sentences = [sentence for sentence, _ in group]
+                try:
+                    results = await loop.run_in_executor(
+                        self.executor, lambda: self.paraphraser.generate_batch(sentences, **params)
+                    )
+                except Exception as e:
+                    self.errors += 1
+                    logger.exception("Batch failed")
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.processed += len(group)
+                for (_, future), result in zip(group, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_size": self.queue.maxsize,
+            "processed": self.processed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "avg_batch_size": self.processed / self.batches if self.batches else 0.0,
+        }
+
+
+class ParaphraseServer:
+    def __init__(self, batcher: MicroBatcher, host: str = "127.0.0.1", port: int = 8000) -> None:
+        """
+        Minimal HTTP/1.1 JSON server in front of MicroBatcher
+        :param batcher: MicroBatcher
+        :param host: host to listen, localhost by default
+        :param port: port to listen
+        """
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self) -> None:
+        self.batcher.start()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Paraphrase server is listening on {}:{}".format(self.host, self.port))
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+
+                status, payload = await self._route(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    "HTTP/1.1 {}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                    "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                        status, len(data), "keep-alive" if keep_alive else "close"
+                    ).encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[str, Dict]:
+        if method == "GET" and path in ("/health", "/stats"):
+            return "200 OK", dict(status="ok", **self.batcher.stats())
+        if method == "POST" and path == "/paraphrase":
+            try:
+                request = json.loads(body.decode("utf-8"))
+                if not isinstance(request, dict):
+                    raise ValueError("the body must be an object")
+                if "sentence" not in request:
+                    raise ValueError("sentence is missing")
+                sentence = request["sentence"]
+                if not isinstance(sentence, str) or not sentence.strip():
+                    raise ValueError("sentence must be a non-empty string")
+                params = request.get("params", {})
+                check_params(params, self.batcher.allowed_params)
+            except ValueError as e:
+                return "400 Bad Request", {"error": "Bad request: {}".format(e)}
+            try:
+                return "200 OK", await self.batcher.submit(sentence, params)
+            except QueueFullError as e:
+                return "503 Service Unavailable", {"error": str(e)}
+            except Exception as e:
+                return "500 Internal Server Error", {"error": str(e)}
+        return "404 Not Found", {"error": "Not found"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Paraphrase HTTP server")
+    parser.add_argument("--model_name", default="mt5-small")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=16)
+    parser.add_argument("--max_wait_ms", type=float, default=10.0)
+    parser.add_argument("--max_queue_size", type=int, default=1024)
+    parser.add_argument("--range_cand", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+    paraphraser_class = Mt5Paraphraser if args.model_name.startswith("mt5") else GPTParaphraser
+    paraphraser = paraphraser_class(model_name=args.model_name, range_cand=args.range_cand)
+
+    async def serve():
+        batcher = MicroBatcher(
+            paraphraser, max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_wait_ms, max_queue_size=args.max_queue_size
+        )
+        await ParaphraseServer(batcher, host=args.host, port=args.port).serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
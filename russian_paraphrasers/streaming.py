@@ -0,0 +1,161 @@
+"""
+Streaming of candidates: Paraphraser.generate_stream and agenerate_stream.
+
+generate runs in a background thread and hugging_face generate reports every
+sampled token to a RowStreamer. As soon as a sampled sequence finishes it is
+decoded and cleaned, and the candidate is yielded if it is new. The last
+event is the result dict of generate with ranking and metrics.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Collection, Dict, Iterator, List, Optional
+
+from russian_paraphrasers.candidates_filter_metrics import check_input
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class CandidateStream:
+    def __init__(self) -> None:
+        """Events of one generate_stream call, filled by the generation thread"""
+        self.start = time.perf_counter()
+        self.events = queue.Queue()
+        self._seen = defaultdict(set)
+
+    def emit(self, event: str, **fields) -> None:
+        self.events.put(dict(event=event, time=time.perf_counter() - self.start, **fields))
+
+    def add(self, sentence: str, candidate: str) -> None:
+        """
+        Emit a candidate event unless the candidate is empty, the origin sentence or already emitted
+        :param sentence: origin sentence (one of sentences the input was split into)
+        :param candidate: decoded and cleaned candidate
+        """
+        if candidate and candidate not in self._seen[sentence] and candidate.lower() != sentence.lower():
+            self._seen[sentence].add(candidate)
+            self.emit("candidate", sentence=sentence, candidate=candidate)
+
+    def streamer(
+        self,
+        sentences: List[str],
+        n: int,
+        decode: Callable[[List[int]], str],
+        stop_ids: Collection[int],
+        budgets: Optional[List[int]] = None
+    ) -> "RowStreamer":
+        """
+        Streamer for one model.generate call
+        :param sentences: sentences of the call, n sampled sequences each
+        :param n: number of sequences per sentence
+        :param decode: token ids of a sequence without the stop token -> cleaned candidate
+        :param stop_ids: ids of tokens which finish a sequence
+        :param budgets: max number of tokens of a sequence per sentence, None - no limit
+        """
+        limits = [budget for budget in budgets for _ in range(n)] if budgets is not None else None
+        return RowStreamer(lambda row, ids: self.add(sentences[row // n], decode(ids)), stop_ids, limits)
+
+
+class RowStreamer:
+    def __init__(
+        self,
+        on_finished: Callable[[int, List[int]], None],
+        stop_ids: Collection[int],
+        limits: Optional[List[int]] = None
+    ) -> None:
+        """
+        hugging_face streamer which collects tokens of every sequence in a batch
+        and reports a sequence as soon as it samples a stop token or reaches its limit
+        :param on_finished: called with the row and token ids of a finished sequence
+        :param stop_ids: ids of tokens which finish a sequence
+        :param limits: max number of tokens of every sequence, None - no limit
+        """
+        self.on_finished = on_finished
+        self.stop_ids = set(stop_ids)
+        self.limits = limits
+        self.prompt_seen = False
+        self.rows = None
+        self.finished = None
+
+    def put(self, value) -> None:
+        if not self.prompt_seen:
+            # the first call passes the prompts (decoder start tokens for encoder-decoder models),
+            # older transformers pass them before they are repeated for num_return_sequences
+            self.prompt_seen = True
+            return
+        token_ids = value.view(-1).tolist()
+        if self.rows is None:
+            self.rows = [[] for _ in token_ids]
+            self.finished = [False] * len(self.rows)
+        for row, token_id in enumerate(token_ids):
+            if self.finished[row]:
+                continue
+            if token_id in self.stop_ids:
+                self.finished[row] = True
+                self.on_finished(row, self.rows[row])
+            else:
+                self.rows[row].append(token_id)
+                if self.limits is not None and len(self.rows[row]) >= self.limits[row]:
+                    self.finished[row] = True
+                    self.on_finished(row, self.rows[row])
+
+    def end(self) -> None:
+        # sequences cut by max_length
+        for row, ids in enumerate(self.rows or []):
+            if not self.finished[row]:
+                self.finished[row] = True
+                self.on_finished(row, ids)
+
+
+def generate_stream(paraphraser, sentence: str, generate_kwargs: Dict) -> Iterator[Dict]:
+    """
+    Run paraphraser.generate in a thread and yield its events, see Paraphraser.generate_stream
+    """
+    stream = CandidateStream()
+
+    def run():
+        paraphraser._stream = stream
+        try:
+            result = paraphraser.generate(sentence, **generate_kwargs)
+        except BaseException as e:
+            stream.events.put(e)
+            return
+        finally:
+            paraphraser._stream = None
+        # cached results and models which do not support streamers
+        _, splitted = check_input(sentence)
+        for one, sentence_res in zip(splitted, result["results"]):
+            for candidate in sentence_res["predictions"]:
+                stream.add(one, candidate)
+        stream.emit("result", result=result)
+        stream.events.put(_DONE)
+
+    thread = threading.Thread(target=run, name="paraphraser-stream", daemon=True)
+    thread.start()
+    while True:
+        event = stream.events.get()
+        if event is _DONE:
+            break
+        if isinstance(event, BaseException):
+            raise event
+        yield event
+    thread.join()
+
+
+async def agenerate_stream(paraphraser, sentence: str, generate_kwargs: Dict) -> AsyncIterator[Dict]:
+    """
+    Async version of generate_stream, waiting for events does not block the event loop
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    events = generate_stream(paraphraser, sentence, generate_kwargs)
+    while True:
+        event = await loop.run_in_executor(None, next, events, _DONE)
+        if event is _DONE:
+            break
+        yield event
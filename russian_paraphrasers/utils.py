@@ -1,14 +1,36 @@
 import re
-import nltk
-import torch
+import unicodedata
 
 
 def set_seed(seed):
+    import torch
+
     torch.manual_seed(seed)
     if torch.cuda.is_available():
         torch.cuda.manual_seed_all(seed)
 
 
+def normalize_text(text):
+    """
+    Cache key for the sentence: NFC form with collapsed whitespace
+    :param text: sentence
+    :return: normalized sentence
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def chunks(items, size):
+    """
+    Split list into consecutive chunks of the given size
+    :param items: list
+    :param size: chunk size
+    :return: generator of lists
+    """
+    size = max(1, size)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
 def adjust_length_to_model(length, max_sequence_length):
     if length < 0 and max_sequence_length > 0:
         length = max_sequence_length
@@ -19,47 +41,102 @@ def adjust_length_to_model(length, max_sequence_length):
     return length
 
 
+# Text after any of these markers is dropped
+CUT_MARKERS = ["===", "\n", "< EOS>", "<EOS>"]
+
+# Replacement stages, every stage is done in one pass by one compiled regex.
+# Patterns are regexes, a stage sees the result of the previous one.
+CLEAN_STAGES = [
+    [
+        ("<UNK>", ""),
+        ("&amp;", "&"),
+        ("lt;", ""),
+        ("gt;", ""),
+        ("</s>", ""),
+        ("<s>", ""),
+        ("< ?(?:BOS|SHORT|LONG)>", " "),
+        (" ul ", "\n"),
+        # " pre " -> " " and others, the space after the tag stays for the next tag
+        (" (?:pre|/pre|/ pre|hr)(?= )", ""),
+        ("/ ?code", "\n/code\n"),
+        (" code", "\ncode\n"),
+        (" e f ", "\n"),
+        ("/h1", "\n"),
+        ("nbsp;", " "),
+        ("/blockquote", "\n"),
+    ],
+    [
+        (" {2,}", " "),
+        ("&zwj;", ""),
+        ("\\.<", "."),
+        ("/", "."),
+    ],
+    [
+        ("tml", ""),
+        ("\\.\\.s", ""),
+        ("&#[0-9]+;", ""),
+        ("\\(версия 2\\)", ""),
+        ("\\(примечание\\)", ""),
+    ],
+]
+
+CLEAN_TRANSLATION = {"ћ": "м", "ƒ": "д"}
+
+
+class TextCleaner:
+    def __init__(self, cut_markers=None, stages=None, translation=None):
+        """
+        Cleaner of generated text, compiled once
+        :param cut_markers: text after any of these markers is dropped
+        :param stages: list of stages, stage is a list of (regex pattern, replacement)
+        :param translation: dict of plain substring replacements
+        """
+        cut_markers = CUT_MARKERS if cut_markers is None else cut_markers
+        stages = CLEAN_STAGES if stages is None else stages
+        translation = CLEAN_TRANSLATION if translation is None else translation
+        self.cut_regex = re.compile("|".join(re.escape(marker) for marker in cut_markers))
+        self.stages = []
+        for rules in stages:
+            # capturing groups would disable the fast search of the alternation,
+            # the rule is found again only for the (rare) matches
+            regex = re.compile("|".join("(?:{})".format(pattern) for pattern, _ in rules))
+            compiled_rules = [(re.compile(pattern), replacement) for pattern, replacement in rules]
+            self.stages.append((regex, self._replacer(compiled_rules)))
+        self.translation = list(translation.items())
+
+    @staticmethod
+    def _replacer(compiled_rules):
+        def replace(match):
+            for regex, replacement in compiled_rules:
+                if regex.match(match.string, match.start()):
+                    return replacement
+            return match.group()
+        return replace
+
+    def __call__(self, text):
+        if len(text) > 1:
+            cut = self.cut_regex.search(text)
+            if cut:
+                text = text[:cut.start()]
+            for regex, replace in self.stages:
+                text = regex.sub(replace, text)
+            for char, replacement in self.translation:
+                if char in text:
+                    text = text.replace(char, replacement)
+        return text.strip()
+
+
+_cleaner = TextCleaner()
+
+
 def clean(text):
-    if len(text) > 1:
-        text = text.split("===")[0]
-        text = text.split("\n")[0]
-        text = re.sub('\\n', '\n', text)
-        text = re.sub('<UNK>', '', text)
-        text = re.sub('&amp;', '&', text)
-        text = re.sub('lt;', '', text)
-        text = re.sub('gt;', '', text)
-        text = text.split("< EOS>")[0]
-        text = text.split("<EOS>")[0]
-        text = re.sub('< EOS>', ' ', text)
-        text = re.sub('<s>', '', text)
-        text = re.sub('</s>', '', text)
-        text = re.sub('<EOS>', ' ', text)
-        text = re.sub('< BOS>', ' ', text)
-        text = re.sub('<BOS>', ' ', text)
-        text = re.sub('< SHORT>', ' ', text)
-        text = re.sub('<SHORT>', ' ', text)
-        text = re.sub('<LONG>', ' ', text)
-        text = re.sub('< LONG>', ' ', text)
-        text = re.sub(' ul ', '\n', text)
-        text = re.sub(' pre ', ' ', text)
-        text = re.sub(r' /pre ', ' ', text)
-        text = re.sub(r' / pre ', ' ', text)
-        text = re.sub(r'/code', '\n/code\n', text)
-        text = re.sub(r'/ code', '\n/code\n', text)
-        text = re.sub(' code', '\ncode\n', text)
-        text = re.sub(' hr ', ' ', text)
-        text = re.sub(' e f ', '\n', text)
-        text = re.sub('/h1', '\n', text)
-        text = re.sub('nbsp;', ' ', text)
-        text = re.sub('/blockquote', '\n', text)
-        text = re.sub(' +', ' ', text)
-        text = re.sub('&zwj;', '', text)
-        text = re.sub('.<', '.', text)
-        text = re.sub('/', '.', text)
-        text = re.sub('tml', '', text)
-        text = re.sub("</s", '', text)
-        text = re.sub("..s", '', text)
-        text = re.sub("&#[0-9]+;", "", text)
-        text = text.replace("ћ", "м").replace("ƒ", "д")
-        text = text.replace("(версия 2)", "").replace("(примечание)", "")
-    return text.strip()
+    """
+    Remove special tokens, html remains and text after the end of the sentence.
+    Differences from the old sequential cleaner:
+    ".<" and "..s" are literal now (they used to match any character),
+    " / pre " is removed (it used to be shadowed by " pre "), unreachable "</s" rule is removed,
+    replacements inside one stage do not see each other results.
+    :param text: generated text
+    :return: cleaned text
+    """
+    return _cleaner(text)
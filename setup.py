@@ -19,8 +19,8 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    install_requires=["nltk", "scipy", "transformers>=4.0.1",
-                      "sentence-transformers==0.4.0",
-                      "nlg-eval @ git+https://github.com/Maluuba/nlg-eval.git@master"],
+    install_requires=["nltk", "numpy", "transformers>=4.28.0",
+                      "sentence-transformers==0.4.0"],
+    extras_require={"onnx": ["optimum[onnxruntime]"], "low_memory": ["accelerate"]},
     setup_requires=[]
 )
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def tiny_models():
+    """Paths of the tiny random models of benchmarks/tiny_models.py, built once"""
+    from tiny_models import build_tiny_models
+
+    return build_tiny_models()
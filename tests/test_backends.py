@@ -0,0 +1,49 @@
+import pytest
+
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.backends import (
+    BACKENDS, Backend, OnnxRuntimeBackend, TorchBackend, get_backend, register_backend
+)
+from russian_paraphrasers.registry import ModelRegistry
+
+
+def test_get_backend():
+    assert isinstance(get_backend(), TorchBackend)
+    backend = get_backend("onnx", export_dir="/tmp/onnx")
+    assert isinstance(backend, OnnxRuntimeBackend) and backend.export_dir == "/tmp/onnx"
+    assert get_backend(backend) is backend
+    with pytest.raises(ValueError, match="Unknown backend"):
+        get_backend("tensorrt")
+
+
+def test_register_backend():
+    class Custom(Backend):
+        name = "custom"
+
+    register_backend("custom", Custom)
+    try:
+        assert isinstance(get_backend("custom"), Custom)
+    finally:
+        BACKENDS.pop("custom")
+
+
+def test_unknown_dtype(tiny_models):
+    from transformers import GPT2LMHeadModel
+
+    with pytest.raises(ValueError, match="Unknown dtype"):
+        TorchBackend().load_model(GPT2LMHeadModel, tiny_models["gpt"], "cpu", dtype="int4")
+
+
+def test_onnx_generates_same_as_torch(tiny_models, tmp_path):
+    pytest.importorskip("optimum.onnxruntime")
+    kwargs = dict(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=ModelRegistry())
+    torch_paraphraser = GPTParaphraser(**kwargs)
+    onnx_paraphraser = GPTParaphraser(backend="onnx", export_dir=str(tmp_path), **kwargs)
+    # top_k=1 - greedy decoding
+    options = dict(n=2, max_length=30, top_k=1, seed=0)
+    sentence = "Мама мыла раму."
+    onnx_result = onnx_paraphraser.generate(sentence, **options)
+    assert onnx_result == torch_paraphraser.generate(sentence, **options)
+    assert onnx_result["results"][0]["predictions"]
+    # exported once into export_dir
+    assert any(tmp_path.rglob("*.onnx"))
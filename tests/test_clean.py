@@ -0,0 +1,30 @@
+from clean import GOLDEN_TEST, legacy_clean, load_texts
+
+from russian_paraphrasers.utils import TextCleaner, clean
+
+
+def test_same_as_legacy_cleaner_on_golden_set():
+    # the legacy "..s" and ".<" patterns matched any characters, texts with them differ on purpose
+    texts = [text for text in load_texts(GOLDEN_TEST) if "s" not in text and "<" not in text]
+    assert texts
+    assert [clean(text) for text in texts] == [legacy_clean(text) for text in texts]
+
+
+def test_documented_differences():
+    assert clean("Самолет Lufthansa вернулся") == "Самолет Lufthansa вернулся"
+    assert legacy_clean("Самолет Lufthansa вернулся") == "Самолет Luftha вернулся"
+    assert clean("текст / pre конец") == "текст конец"
+    assert clean("конец.<x") == "конец.x"
+
+
+def test_special_tokens_and_cut_markers():
+    assert clean("<s>Мама <UNK>мыла раму.</s> === Мама мыла") == "Мама мыла раму."
+    assert clean("Мама мыла раму.<EOS> лишнее") == "Мама мыла раму."
+    assert clean("<BOS>Мама&amp;папа\nлишнее") == "Мама&папа"
+    assert clean("ћама ƒома &#8212;") == "мама дома"
+    assert clean("a") == "a"
+
+
+def test_custom_stages():
+    cleaner = TextCleaner(cut_markers=["|"], stages=[[("кот", "пёс")], [("пёс", "собака")]], translation={})
+    assert cleaner("кот и кот | хвост") == "собака и собака"
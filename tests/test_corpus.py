@@ -0,0 +1,160 @@
+import json
+import os
+
+import pytest
+
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.corpus import (
+    detect_format, paraphrase_file, paraphrase_file_parallel, read_corpus, split_corpus
+)
+
+GENERATE_KWARGS = dict(n=2, max_length=30, seed=0)
+
+
+class FailingParaphraser(GPTParaphraser):
+    """Crashes its worker on one sentence, a job with it is killed half way"""
+
+    def __init__(self, fail_on="", **kwargs):
+        super().__init__(**kwargs)
+        self.fail_on = fail_on
+
+    def generate_batch(self, sentences, **kwargs):
+        if self.fail_on in sentences:
+            os._exit(1)
+        return super().generate_batch(sentences, **kwargs)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.txt"
+    lines = ["Предложение номер {}.".format(i) for i in range(40)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path), lines
+
+
+def read_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_formats(tmp_path):
+    pairs = tmp_path / "pairs.txt"
+    pairs.write_text("Мама мыла раму. === Мама вымыла раму.\n\nГде ты?\n", encoding="utf-8")
+    jsonl = tmp_path / "corpus.jsonl"
+    jsonl.write_text('{"text": "Мама мыла раму.", "reference": "Рама вымыта."}\n"Где ты?"\n', encoding="utf-8")
+    assert detect_format(str(pairs)) == "pairs"
+    assert detect_format(str(jsonl)) == "jsonl"
+    assert [(line_no, record) for line_no, _, record in read_corpus(str(pairs))] == [
+        (0, {"sentence": "Мама мыла раму.", "reference": "Мама вымыла раму."}), (2, {"sentence": "Где ты?"}),
+    ]
+    assert [record for _, _, record in read_corpus(str(jsonl), text_field="text")] == [
+        {"sentence": "Мама мыла раму.", "reference": "Рама вымыта."}, {"sentence": "Где ты?"},
+    ]
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingParaphraser:
+    """Wraps a paraphraser and raises on the chunk with one sentence"""
+
+    def __init__(self, paraphraser, fail_on):
+        self.paraphraser = paraphraser
+        self.fail_on = fail_on
+
+    def generate_batch(self, sentences, **kwargs):
+        if self.fail_on in sentences:
+            raise Crash()
+        return self.paraphraser.generate_batch(sentences, **kwargs)
+
+
+def test_killed_job_continues(tiny_models, corpus, tmp_path):
+    path, lines = corpus
+    output_path = str(tmp_path / "out.jsonl")
+    paraphraser = GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"])
+    with pytest.raises(Crash):
+        paraphrase_file(CrashingParaphraser(paraphraser, lines[21]), path, output_path, chunk_size=4,
+                        **GENERATE_KWARGS)
+    assert len(read_results(output_path)) == 20
+    # a chunk written after the last checkpoint is dropped and generated again
+    with open(output_path, "a", encoding="utf-8") as f:
+        f.write('{"origin": "unfinished"}\n')
+    paraphrase_file(paraphraser, path, output_path, chunk_size=4, **GENERATE_KWARGS)
+    results = read_results(output_path)
+    assert [result["origin"] for result in results] == lines
+    assert [result["line"] for result in results] == list(range(len(lines)))
+
+
+def test_split_corpus(corpus):
+    path, lines = corpus
+    shards = split_corpus(path, 3)
+    items = [
+        record["sentence"] for start, end, line_no in shards
+        for _, _, record in read_corpus(path, fmt="text", offset=start, line_no=line_no, end=end)
+    ]
+    assert items == lines
+
+
+def test_resume(tiny_models, corpus, tmp_path):
+    path, lines = corpus
+    output_path = str(tmp_path / "out.jsonl")
+    paraphrase_file(
+        GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"]),
+        path, output_path, chunk_size=4, **GENERATE_KWARGS
+    )
+    first = read_results(output_path)
+    # a finished job is not repeated
+    paraphrase_file(None, path, output_path, chunk_size=4, **GENERATE_KWARGS)
+    assert read_results(output_path) == first
+    assert [result["origin"] for result in first] == lines
+    assert [result["line"] for result in first] == list(range(len(lines)))
+
+
+def test_parallel_resume_with_other_layout(tiny_models, corpus, tmp_path):
+    path, lines = corpus
+    output_path = str(tmp_path / "out.jsonl")
+    model_kwargs = {"tokenizer_path": tiny_models["gpt"], "pretrained_path": tiny_models["gpt"]}
+    with pytest.raises(RuntimeError, match="failed"):
+        paraphrase_file_parallel(
+            FailingParaphraser, path, output_path, num_workers=2, threads_per_worker=1,
+            paraphraser_kwargs=dict(model_kwargs, fail_on=lines[30]),
+            chunk_size=4, shards_per_worker=2, max_retries=0, **GENERATE_KWARGS
+        )
+    assert os.path.exists(os.path.join(output_path + ".shards", "layout.json"))
+
+    # resumed with another number of workers and shards, the saved layout is used
+    total = paraphrase_file_parallel(
+        GPTParaphraser, path, output_path, num_workers=1, threads_per_worker=1,
+        paraphraser_kwargs=model_kwargs, chunk_size=4, shards_per_worker=3, **GENERATE_KWARGS
+    )
+    results = read_results(output_path)
+    assert total == len(lines)
+    assert [result["origin"] for result in results] == lines
+    assert [result["line"] for result in results] == list(range(len(lines)))
+    assert not os.path.exists(output_path + ".shards")
+
+
+def test_existing_output_is_kept(tiny_models, corpus, tmp_path):
+    path, lines = corpus
+    output_path = str(tmp_path / "out.jsonl")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write('{"origin": "earlier job"}\n')
+    paraphraser = GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"])
+    paraphrase_file(paraphraser, path, output_path, chunk_size=8, checkpoint_path=None, **GENERATE_KWARGS)
+    results = read_results(output_path)
+    assert [result["origin"] for result in results] == ["earlier job"] + lines
+
+
+def test_changed_input_is_not_resumed(tiny_models, corpus, tmp_path):
+    path, lines = corpus
+    output_path = str(tmp_path / "out.jsonl")
+    paraphraser = GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"])
+    with pytest.raises(Crash):
+        paraphrase_file(CrashingParaphraser(paraphraser, lines[10]), path, output_path, chunk_size=4,
+                        **GENERATE_KWARGS)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("Новое предложение.\n")
+    with pytest.raises(ValueError, match="has changed"):
+        paraphrase_file(paraphraser, path, output_path, chunk_size=4, **GENERATE_KWARGS)
+    assert len(read_results(output_path)) == 8
@@ -0,0 +1,42 @@
+import numpy as np
+
+from russian_paraphrasers.embedding_cache import EmbeddingCache
+
+
+class CountingEncoder:
+    """Deterministic encoder which counts encoded sentences"""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, sentences, normalize_embeddings=False, **kwargs):
+        self.encoded += len(sentences)
+        vectors = np.array([[len(sentence), 1.0, 2.0] for sentence in sentences], dtype=np.float32)
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def test_memory_hits():
+    encoder = CountingEncoder()
+    cache = EmbeddingCache(encoder)
+    first = cache.encode(["мама мыла раму", "папа"])
+    second = cache.encode(["мама  мыла раму", "папа"], batch_size=8)
+    assert encoder.encoded == 2
+    np.testing.assert_array_equal(first, second)
+
+
+def test_options_are_part_of_key(tmp_path):
+    encoder = CountingEncoder()
+    cache = EmbeddingCache(encoder, cache_dir=str(tmp_path))
+    raw = cache.encode(["мама мыла раму"])
+    normalized = cache.encode(["мама мыла раму"], normalize_embeddings=True)
+    assert encoder.encoded == 2
+    assert not np.allclose(raw, normalized)
+    np.testing.assert_allclose(np.linalg.norm(normalized, axis=1), 1.0, rtol=1e-6)
+
+    # the disk tier keeps both variants
+    other = EmbeddingCache(encoder, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(other.encode(["мама мыла раму"], normalize_embeddings=True), normalized)
+    np.testing.assert_array_equal(other.encode(["мама мыла раму"]), raw)
+    assert encoder.encoded == 2
@@ -0,0 +1,52 @@
+import pytest
+
+from russian_paraphrasers.candidates_filter_metrics import get_scores
+from russian_paraphrasers.evaluation import METRICS, evaluate, lcs_length
+
+
+def lcs_dp(a, b):
+    table = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i, x in enumerate(a):
+        for j, y in enumerate(b):
+            table[i + 1][j + 1] = table[i][j] + 1 if x == y else max(table[i][j + 1], table[i + 1][j])
+    return table[-1][-1]
+
+
+@pytest.mark.parametrize("a, b", [
+    ("", "abc"), ("abc", "abc"), ("abcbdab", "bdcaba"), ("мама мыла раму".split(), "мама раму мыла".split()),
+])
+def test_lcs_length(a, b):
+    assert lcs_length(a, b) == lcs_dp(a, b)
+
+
+def test_identical_texts():
+    metrics = evaluate([("Мама мыла раму .", ["мама мыла раму ."])])["sentences"][0]["metrics"][0]
+    for metric in METRICS:
+        assert metrics[metric] == pytest.approx(1.0, abs=1e-6)
+
+
+def test_same_as_pycocoevalcap():
+    pytest.importorskip("pycocoevalcap")
+    from evaluation import GOLDEN_TEST, load_groups, reference_scorer
+
+    groups = load_groups(GOLDEN_TEST, 200)
+    _, individual, corpus = reference_scorer()
+    result = evaluate(groups)
+    for (ref, hypotheses), sentence in zip(groups, result["sentences"]):
+        for hyp, got in zip(hypotheses, sentence["metrics"]):
+            expected = individual([ref.lower()], hyp.lower())
+            for metric in METRICS:
+                assert got[metric] == pytest.approx(expected[metric], abs=1e-6)
+    refs = [ref.lower() for ref, hypotheses in groups for _ in hypotheses]
+    hyps = [hyp.lower() for _, hypotheses in groups for hyp in hypotheses]
+    expected = corpus(refs, hyps)
+    for metric in METRICS:
+        assert result["corpus"][metric] == pytest.approx(expected[metric], abs=1e-6)
+
+
+def test_get_scores_old_signature():
+    scores = get_scores(["мама вымыла раму"], "Мама мыла раму")
+    with pytest.warns(DeprecationWarning):
+        assert get_scores(object(), ["мама вымыла раму"], "Мама мыла раму") == scores
+    with pytest.warns(DeprecationWarning):
+        assert get_scores(ngeval=object(), best_candidates=["мама вымыла раму"], sentence="Мама мыла раму") == scores
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import pytest
+
+from russian_paraphrasers import GPTParaphraser
+
+SENTENCES = ["Мама мыла раму.", "Кошка спит на диване весь день.", "Где ты?"]
+
+
+@pytest.fixture(scope="module")
+def gpt(tiny_models):
+    return GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], batch_size=2)
+
+
+def test_generate_batch(gpt):
+    results = gpt.generate_batch(SENTENCES, n=3, max_length=20, seed=0)
+    assert [result["origin"] for result in results] == SENTENCES
+    for result in results:
+        assert len(result["results"]) == 1
+        assert len(result["results"][0]["predictions"]) == 3
+    # the same seed - the same samples
+    assert gpt.generate_batch(SENTENCES, n=3, max_length=20, seed=0) == results
+
+
+def test_predictions_are_cut_at_stop_tokens(gpt):
+    results = gpt.generate_batch(SENTENCES, n=5, max_length=40, seed=1)
+    for result in results:
+        for prediction in result["results"][0]["predictions"]:
+            assert "</s>" not in prediction and "<s>" not in prediction and "===" not in prediction
+            assert "\n" not in prediction
+
+
+@pytest.mark.parametrize("n", [2, 5])
+def test_shared_prefill_gives_the_same_outputs(gpt, n):
+    gpt.shared_prefill = False
+    try:
+        repeated = gpt.generate_batch(SENTENCES, n=n, max_length=20, seed=0)
+    finally:
+        gpt.shared_prefill = True
+    shared = gpt.generate_batch(SENTENCES, n=n, max_length=20, seed=0)
+    assert shared == repeated
+
+
+class NoCacheModel:
+    """Model whose forward pass returns no key-value cache, generate is the one of the wrapped model"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, **kwargs):
+        return SimpleNamespace(past_key_values=None)
+
+
+def test_prefill_falls_back_for_models_without_cache(gpt, monkeypatch):
+    gpt.shared_prefill = False
+    try:
+        repeated = gpt.generate_batch(SENTENCES, n=3, max_length=20, seed=0)
+    finally:
+        gpt.shared_prefill = True
+    monkeypatch.setattr(gpt, "model", NoCacheModel(gpt.model))
+    assert gpt.generate_batch(SENTENCES, n=3, max_length=20, seed=0) == repeated
+    # only this call falls back
+    assert gpt.shared_prefill
+
+
+def test_batched_prompts_keep_their_own_budget(gpt, monkeypatch):
+    short, long = "Где ты?", "Кошка спит на диване весь день, а собака гуляет во дворе."
+    prompt_length = len(gpt.tokenizer.encode("<s>{} === ".format(long), add_special_tokens=False))
+    continuations = []
+    batch_decode = gpt.tokenizer.batch_decode
+
+    def recording_batch_decode(sequences, **kwargs):
+        continuations.extend(sequences)
+        return batch_decode(sequences, **kwargs)
+
+    monkeypatch.setattr(gpt.tokenizer, "batch_decode", recording_batch_decode)
+    # the long prompt may add one token, the short one gets more in the same batch
+    gpt.generate_batch([short, long], n=5, max_length=prompt_length + 1, seed=0)
+    assert all(len(ids) <= 1 for ids in continuations[5:])
+    assert any(len(ids) > 1 for ids in continuations[:5])
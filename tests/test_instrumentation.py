@@ -0,0 +1,64 @@
+import pytest
+
+from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+from russian_paraphrasers.instrumentation import STAGES, StageTimer
+
+SENTENCES = ["Мама мыла раму.", "Кошка спит на диване."]
+
+
+@pytest.fixture(scope="module")
+def paraphrasers(tiny_models):
+    return {
+        "gpt": GPTParaphraser(
+            tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"],
+            range_cand=True, ranker_path=tiny_models["ranker"], timings=True
+        ),
+        "mt5": Mt5Paraphraser(
+            tokenizer_path=tiny_models["mt5"], pretrained_path=tiny_models["mt5"],
+            range_cand=True, ranker_path=tiny_models["ranker"], timings=True
+        ),
+    }
+
+
+@pytest.mark.parametrize("family", ["gpt", "mt5"])
+@pytest.mark.parametrize("range_cand", [True, False])
+def test_counters_add_up(paraphrasers, family, range_cand):
+    paraphraser = paraphrasers[family]
+    paraphraser.range_cand = range_cand
+    try:
+        results = paraphraser.generate_batch(SENTENCES, n=8, max_length=20, seed=0)
+    finally:
+        paraphraser.range_cand = True
+    counters = results[0]["counters"]
+    assert counters["generated"] == 8 * len(SENTENCES)
+    assert counters["generated"] == counters["deduplicated"] + counters["filtered"] + counters["returned"]
+    returned = sum(
+        len(sentence_res.get("best_candidates", sentence_res["predictions"]))
+        for result in results for sentence_res in result["results"]
+    )
+    assert counters["returned"] == returned
+    if family == "gpt" and not range_cand:
+        assert counters["deduplicated"] == 0 and counters["filtered"] == 0
+    assert set(results[0]["timings"]) <= set(STAGES) | {"total"}
+
+
+def test_hooks(paraphrasers):
+    paraphraser = paraphrasers["gpt"]
+    timer = StageTimer()
+    paraphraser.hooks.append(timer)
+    try:
+        paraphraser.generate("Мама мыла раму.", n=2, max_length=20)
+    finally:
+        paraphraser.hooks.remove(timer)
+    assert {"tokenize", "generate", "decode", "clean", "rank"} <= set(timer.stats())
+
+
+@pytest.mark.parametrize("family", ["gpt", "mt5"])
+def test_adaptive_sampling(paraphrasers, family):
+    result = paraphrasers[family].generate("Мама мыла раму.", n=4, want=2, max_samples=6, max_length=20, seed=0)
+    counters = result["counters"]
+    sentence_res = result["results"][0]
+    assert counters["generated"] <= 6
+    assert len(sentence_res["best_candidates"]) <= 2
+    # candidates of the rounds are unique
+    assert len(sentence_res["predictions"]) == len(set(sentence_res["predictions"]))
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.registry import ModelRegistry
+
+HEAVY = ["torch", "transformers", "sentence_transformers", "nltk", "scipy"]
+
+
+def test_import_does_not_load_heavy_packages():
+    code = "import sys, russian_paraphrasers; print(' '.join(m for m in {} if m in sys.modules))".format(HEAVY)
+    root = os.path.join(os.path.dirname(__file__), "..")
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=root)
+    assert output.decode().strip() == ""
+
+
+def test_lazy_loads_on_first_generate(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], lazy=True, registry=ModelRegistry()
+    )
+    assert paraphraser.model is None and paraphraser.tokenizer is None
+    paraphraser.generate("Мама мыла раму.", n=1, max_length=30)
+    assert paraphraser.model is not None
@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+from russian_paraphrasers.registry import ModelRegistry
+
+
+def make(tiny_models, family="gpt", **kwargs):
+    paraphraser_class = GPTParaphraser if family == "gpt" else Mt5Paraphraser
+    return paraphraser_class(
+        tokenizer_path=tiny_models[family], pretrained_path=tiny_models[family], registry=ModelRegistry(), **kwargs
+    )
+
+
+@pytest.mark.parametrize("family", ["gpt", "mt5"])
+def test_low_memory_gives_the_same_outputs(tiny_models, family):
+    options = dict(n=3, max_length=30, seed=0)
+    sentence = "Мама мыла раму."
+    low_memory = make(tiny_models, family, low_memory=True)
+    assert low_memory.generate(sentence, **options) == make(tiny_models, family).generate(sentence, **options)
+
+
+def test_weights_dtype(tiny_models):
+    paraphraser = make(tiny_models, weights_dtype="bfloat16")
+    assert next(paraphraser.model.parameters()).dtype == torch.bfloat16
+    assert paraphraser.generate("Где ты?", n=2, max_length=30, seed=0)["results"][0]["predictions"]
+    with pytest.raises(ValueError, match="Unknown weights dtype"):
+        make(tiny_models, weights_dtype="int4")
+
+
+def test_unload_reload_and_memory_usage(tiny_models):
+    paraphraser = make(tiny_models)
+    usage = paraphraser.memory_usage()
+    assert usage["model"]["size"] > 0 and usage["process"]["rss"] > 0
+    assert "tokenizer" in usage
+
+    paraphraser.unload()
+    assert paraphraser.model is None
+    assert paraphraser.registry.total_size() == 0
+    assert set(paraphraser.memory_usage()) == {"process"}
+
+    paraphraser.weights_dtype = "bfloat16"
+    paraphraser.reload()
+    assert next(paraphraser.model.parameters()).dtype == torch.bfloat16
+    # unloaded models are loaded again by generate
+    paraphraser.unload()
+    paraphraser.generate("Где ты?", n=1, max_length=30)
+    assert paraphraser.model is not None
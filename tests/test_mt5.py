@@ -0,0 +1,40 @@
+import pytest
+
+from russian_paraphrasers import Mt5Paraphraser
+
+SENTENCES = [
+    "Кошка спит на диване весь день, а собака лает во дворе.",
+    "Где ты?",
+    "Мама мыла раму.",
+    "Сегодня хорошая погода.",
+]
+
+
+@pytest.fixture(scope="module")
+def mt5(tiny_models):
+    return Mt5Paraphraser(tokenizer_path=tiny_models["mt5"], pretrained_path=tiny_models["mt5"], batch_size=2)
+
+
+def test_generate_batch_keeps_input_order(mt5):
+    results = mt5.generate_batch(SENTENCES, n=3, max_length=20, seed=0)
+    assert [result["origin"] for result in results] == SENTENCES
+    for sentence, result in zip(SENTENCES, results):
+        predictions = result["results"][0]["predictions"]
+        assert len(predictions) == len(set(predictions)) <= 3
+        assert sentence.lower() not in [prediction.lower() for prediction in predictions]
+
+
+def test_buckets_are_padded_to_their_longest_sentence(mt5):
+    widths = []
+    handle = mt5.model.get_encoder().register_forward_pre_hook(
+        lambda module, args, kwargs: widths.append(kwargs["input_ids"].size(-1)), with_kwargs=True
+    )
+    try:
+        mt5.generate_batch(SENTENCES, n=1, max_length=10, seed=0)
+    finally:
+        handle.remove()
+    lengths = sorted(
+        len(mt5.tokenizer("перефразируй: " + sentence + "</s>")["input_ids"]) for sentence in SENTENCES
+    )
+    # two buckets of the two shortest and the two longest sentences
+    assert widths == [lengths[1], lengths[3]]
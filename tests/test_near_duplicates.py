@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from russian_paraphrasers.candidates_filter_metrics import range_candidates
+from russian_paraphrasers.near_duplicates import NearDuplicateIndex
+
+CORPUS = [
+    "Мама мыла раму.",
+    "Кошка спит на диване весь день.",
+    "В Москве открылся новый парк.",
+    "Самолет вернулся в аэропорт из-за угрозы взрыва.",
+]
+
+
+@pytest.fixture
+def ranker(tiny_models):
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(tiny_models["ranker"])
+
+
+def test_build_and_query(tmp_path):
+    index = NearDuplicateIndex.build(str(tmp_path), CORPUS, chunk_size=3)
+    assert index.size == len(CORPUS)
+    assert [index.sentence(i) for i in range(index.size)] == CORPUS
+
+    result = index.query([CORPUS[3], "Совсем другое предложение про погоду."])
+    assert result["jaccard"][0] == 1.0 and result["jaccard_match"][0] == 3
+    assert list(index.is_duplicate([CORPUS[1], "Совсем другое предложение про погоду."])) == [True, False]
+    # reopened from disk
+    reopened = NearDuplicateIndex(str(tmp_path))
+    assert reopened.filter([CORPUS[0], "Папа чинил машину в гараже."]) == ["Папа чинил машину в гараже."]
+
+
+def test_chunked_build_is_the_same(tmp_path):
+    one = NearDuplicateIndex.build(str(tmp_path / "one"), CORPUS)
+    chunked = NearDuplicateIndex.build(str(tmp_path / "chunked"), CORPUS, chunk_size=3)
+    for name in ("signatures", "band_keys", "band_ids", "offsets"):
+        assert np.array_equal(getattr(one, name), getattr(chunked, name))
+
+
+def test_empty_index(tmp_path):
+    index = NearDuplicateIndex.build(str(tmp_path), [])
+    assert index.size == 0
+    assert list(index.is_duplicate(CORPUS)) == [False] * len(CORPUS)
+    assert index.filter([]) == []
+
+
+def test_bands_must_divide_num_perm(tmp_path):
+    with pytest.raises(ValueError):
+        NearDuplicateIndex.build(str(tmp_path), CORPUS, num_perm=10, bands=3)
+
+
+def test_embeddings(tmp_path, ranker):
+    index = NearDuplicateIndex.build(str(tmp_path), CORPUS, smodel=ranker, model_name="tiny")
+    assert index.meta["model_name"] == "tiny" and index.embeddings.shape[0] == len(CORPUS)
+    result = index.query([CORPUS[2]], smodel=ranker)
+    assert result["similarity_match"][0] == 2
+    assert np.isclose(result["similarity"][0], 1.0, atol=1e-5)
+
+
+def test_range_candidates_drops_reference_duplicates(tmp_path, ranker):
+    index = NearDuplicateIndex.build(str(tmp_path), CORPUS[1:], max_similarity=None)
+    candidates = ["Кошка спит на диване весь день.", "Мама помыла окно.", "Мама вымыла раму."]
+    ranked = range_candidates(candidates, CORPUS[0], ranker, threshold=-1.0, reference_index=index)
+    assert CORPUS[1] not in ranked
+    assert ranked and set(ranked) <= set(candidates[1:])
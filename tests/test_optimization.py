@@ -0,0 +1,36 @@
+import pytest
+import torch
+
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.optimization import optimize_for_cpu, set_threads
+
+
+def test_threads_are_changed_only_when_passed(tiny_models):
+    before = torch.get_num_threads()
+    set_threads(1)
+    assert torch.get_num_threads() == 1
+    GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], lazy=True)
+    assert torch.get_num_threads() == 1
+    set_threads(before)
+
+
+def test_int8_generates(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"],
+        cpu_optimize="int8", range_cand=True, ranker_path=tiny_models["ranker"]
+    )
+    result = paraphraser.generate("Мама мыла раму.", n=3, max_length=30, seed=0)
+    assert len(result["results"][0]["predictions"]) <= 3
+    assert "best_candidates" in result["results"][0]
+    assert type(paraphraser.model.transformer.h[0].attn.c_attn).__module__.startswith("torch.ao.nn.quantized")
+
+
+def test_bf16():
+    model = optimize_for_cpu(torch.nn.Sequential(torch.nn.Linear(4, 4)), "bf16")
+    assert next(model.parameters()).dtype == torch.bfloat16
+
+
+def test_unknown_cpu_optimize_fails_at_once(tiny_models):
+    with pytest.raises(ValueError, match="Unknown cpu optimization"):
+        GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], lazy=True,
+                       cpu_optimize="int4")
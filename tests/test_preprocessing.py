@@ -0,0 +1,61 @@
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.preprocessing import Deduplicator, expand, prepare
+from russian_paraphrasers.registry import ModelRegistry
+
+
+def fake_generate(sentences):
+    return [{"origin": sentence, "results": [{"predictions": [sentence.upper()]}]} for sentence in sentences]
+
+
+def test_prepare_collapses_normalized_duplicates():
+    texts = ["Мама мыла раму.", "Мама  мыла раму. ", "Где ты?"]
+    prepared = prepare(texts)
+    assert prepared.sentences == ["Мама мыла раму.", "Где ты?"]
+    assert prepared.total == 3
+
+    results = expand(prepared, {sentence: fake_generate([sentence])[0]["results"] for sentence in prepared.sentences})
+    assert [result["origin"] for result in results] == texts
+    assert results[0]["results"] == results[1]["results"] == [{"predictions": ["МАМА МЫЛА РАМУ."]}]
+    # every input gets its own copy
+    assert results[0]["results"] is not results[1]["results"]
+
+
+def test_deduplicator_across_chunks():
+    calls = []
+
+    def generate(sentences):
+        calls.append(list(sentences))
+        return fake_generate(sentences)
+
+    deduplicator = Deduplicator(max_size=1)
+    deduplicator.run(["Мама мыла раму.", "Где ты?", "Где ты?"], generate)
+    results = deduplicator.run(["Где ты?", "Мама мыла раму."], generate)
+    # only the last unique sentence is remembered
+    assert calls == [["Мама мыла раму.", "Где ты?"], ["Мама мыла раму."]]
+    assert [result["origin"] for result in results] == ["Где ты?", "Мама мыла раму."]
+    assert deduplicator.counters == {"inputs": 5, "sentences": 5, "generated": 3}
+
+
+def test_generate_corpus(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=ModelRegistry()
+    )
+    texts = ["Мама мыла раму.", "Где ты?", "Мама  мыла раму.", "Где ты?"]
+    results = list(paraphraser.generate_corpus(texts, chunk_size=3, n=3, max_length=30, seed=0))
+    assert [result["origin"] for result in results] == texts
+    assert results[0]["results"] == results[2]["results"]
+    assert results[1]["results"] == results[3]["results"]
+    assert results[0]["results"][0]["predictions"]
+
+
+def test_timings_and_counters_are_kept(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=ModelRegistry(),
+        timings=True
+    )
+    texts = ["Мама мыла раму.", "Мама  мыла раму.", "Где ты?", "Где ты?"]
+    results = list(paraphraser.generate_corpus(texts, chunk_size=3, n=2, max_length=30, seed=0))
+    for result in results[:3]:
+        assert result["counters"]["generated"] == 4 and "total" in result["timings"]
+    # the last chunk has nothing new to generate
+    assert "timings" not in results[3] and "counters" not in results[3]
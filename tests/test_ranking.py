@@ -0,0 +1,82 @@
+from difflib import SequenceMatcher
+
+import numpy as np
+import pytest
+
+from russian_paraphrasers.candidates_filter_metrics import range_by_cs, range_candidates
+
+ORIGIN = "мама мыла раму"
+
+
+class TableEncoder:
+    """Encoder with fixed vectors, the origin is (1, 0)"""
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def encode(self, sentences, **kwargs):
+        vectors = []
+        for sentence in sentences:
+            score = 1.0 if sentence == ORIGIN else self.scores[sentence]
+            vectors.append([score, np.sqrt(max(0.0, 1 - score ** 2))])
+        return np.array(vectors, dtype=np.float32)
+
+
+class BrokenEncoder:
+    def encode(self, sentences, **kwargs):
+        raise RuntimeError("no model")
+
+
+SCORES = {
+    "мама мыла раму.": 0.99,  # near copy
+    "раму мыла мама": 0.95,
+    "мать вымыла раму": 0.9,
+    "мама мыла окно": 0.8,
+    "кошка спит": 0.1,
+}
+
+
+@pytest.mark.parametrize("strategy", ["cs", "all_cs"])
+def test_order_and_near_copies(strategy):
+    best = range_candidates(list(SCORES), ORIGIN, TableEncoder(SCORES), threshold=0.7, strategy=strategy)
+    assert best == ["мама мыла окно", "мать вымыла раму", "раму мыла мама"]
+
+
+@pytest.mark.parametrize("strategy", ["cs", "all_cs"])
+def test_max_candidates_keeps_order(strategy):
+    best = range_candidates(
+        list(SCORES), ORIGIN, TableEncoder(SCORES), threshold=0.7, strategy=strategy, max_candidates=2
+    )
+    assert len(best) == 2
+    assert [SCORES[s] for s in best] == sorted(SCORES[s] for s in best)
+    assert "мама мыла раму." not in best
+
+
+@pytest.mark.parametrize("strategy", ["cs", "all_cs"])
+def test_fallback_without_embeddings(strategy):
+    best = range_candidates(list(SCORES), ORIGIN, BrokenEncoder(), strategy=strategy)
+    assert sorted(best) == sorted(s for s in SCORES if s != "мама мыла раму.")
+
+
+def range_by_cs_loop(sentences, sent, smodel, threshold):
+    """range_by_cs before vectorization: one cosine per candidate (1 - scipy.spatial.distance.cosine)"""
+    sentence_embeddings = smodel.encode(sentences)
+    origin_emb = smodel.encode([sent])[0]
+    best_cands = []
+    for sentence, embedding in zip(sentences, sentence_embeddings):
+        if sent not in sentence and SequenceMatcher(None, sent, sentence).ratio() < 0.95:
+            embedding, origin = np.asarray(embedding, dtype=np.float64), np.asarray(origin_emb, dtype=np.float64)
+            score = np.dot(embedding, origin) / np.sqrt(np.dot(embedding, embedding) * np.dot(origin, origin))
+            if threshold <= score < 1.0 and [score, sentence] not in best_cands:
+                best_cands.append([score, sentence])
+    return [sentence for _, sentence in sorted(best_cands)]
+
+
+def test_range_by_cs_same_as_loop():
+    rng = np.random.RandomState(0)
+    sentences = ["кандидат номер {}".format(i) for i in range(200)]
+    scores = dict(zip(sentences, rng.uniform(0.0, 0.999, size=len(sentences))))
+    encoder = TableEncoder(scores)
+    assert range_by_cs(sentences, ORIGIN, encoder, threshold=0.5) == range_by_cs_loop(
+        sentences, ORIGIN, encoder, threshold=0.5
+    )
@@ -0,0 +1,83 @@
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.registry import ModelRegistry, estimate_size, model_key
+
+
+class Weights:
+    """Object with torch-like parameters() and buffers() of a given size"""
+
+    class Tensor:
+        def __init__(self, size):
+            self.size = size
+
+        def numel(self):
+            return self.size
+
+        def element_size(self):
+            return 1
+
+    def __init__(self, size):
+        self._parameters = [self.Tensor(size)]
+
+    def parameters(self):
+        return self._parameters
+
+    def buffers(self):
+        return []
+
+
+def test_acquire_loads_once_and_counts_references():
+    registry = ModelRegistry()
+    calls = []
+    key = model_key("gpt", "path", "cpu")
+
+    def factory():
+        calls.append(1)
+        return Weights(10)
+
+    first = registry.acquire(key, factory)
+    second = registry.acquire(key, factory)
+    assert first is second and len(calls) == 1
+    assert registry.info(key)["refs"] == 2 and registry.info(key)["size"] == 10
+    registry.release(key)
+    registry.release(key, evict=True)
+    assert registry.info(key) is None
+
+
+def test_budget_evicts_unused_least_recently_used_first():
+    registry = ModelRegistry(memory_budget=25)
+    keys = [model_key("gpt", str(i)) for i in range(3)]
+    for key in keys[:2]:
+        registry.acquire(key, lambda: Weights(10))
+        registry.release(key)
+    # the first model is the least recently used one
+    registry.acquire(keys[2], lambda: Weights(10))
+    assert registry.info(keys[0]) is None
+    assert registry.info(keys[1]) is not None and registry.info(keys[2])["refs"] == 1
+    assert registry.total_size() == 20
+    assert list(registry.stats()) == ["gpt:1", "gpt:2"]
+
+
+def test_budget_keeps_models_in_use():
+    registry = ModelRegistry(memory_budget=5)
+    key = model_key("gpt", "path")
+    registry.acquire(key, lambda: Weights(10))
+    assert registry.info(key)["refs"] == 1
+    registry.release(key)
+    assert registry.info(key) is None
+
+
+def test_estimate_size_of_other_objects_is_zero():
+    assert estimate_size("tokenizer") == 0
+    assert estimate_size(Weights(7)) == 7
+
+
+def test_paraphrasers_share_model(tiny_models):
+    registry = ModelRegistry()
+    kwargs = dict(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=registry)
+    first = GPTParaphraser(**kwargs)
+    second = GPTParaphraser(**kwargs)
+    assert first.model is second.model and first.tokenizer is second.tokenizer
+    first.unload()
+    assert second.model is not None and registry.total_size() > 0
+    second.unload()
+    assert registry.total_size() == 0
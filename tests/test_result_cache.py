@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+import pytest
+
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.result_cache import ResultCache
+
+
+def test_memory_and_disk(tmp_path):
+    db_path = str(tmp_path / "results.db")
+    cache = ResultCache(max_size=1, db_path=db_path)
+    cache.put("a", {"predictions": ["x"]})
+    cache.put("b", {"predictions": ["y"]})
+    assert cache.get("a") == {"predictions": ["x"]}
+    assert cache.get("c") is None
+    cache.close()
+    assert ResultCache(db_path=db_path).get("b") == {"predictions": ["y"]}
+
+
+def test_expired_rows_are_deleted(tmp_path):
+    db_path = str(tmp_path / "results.db")
+    cache = ResultCache(ttl=0.05, db_path=db_path)
+    for key in "abc":
+        cache.put(key, {"predictions": [key]})
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    cache.put("d", {"predictions": ["d"]})
+    rows = sqlite3.connect(db_path).execute("SELECT key FROM results").fetchall()
+    assert rows == [("d",)]
+
+
+@pytest.mark.parametrize("options", [
+    {"cpu_optimize": "int8"}, {"weights_dtype": "bfloat16"}, {"backend": "onnx"}
+])
+def test_key_depends_on_model_variant(tiny_models, options):
+    def key(**kwargs):
+        paraphraser = GPTParaphraser(
+            tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], lazy=True, **kwargs
+        )
+        return paraphraser._cache_key("Мама мыла раму.", {"n": 1}, 0.7, "cs", None, 0)
+
+    assert key() == key()
+    assert key() != key(**options)
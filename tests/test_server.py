@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import pytest
+
+from russian_paraphrasers import GPTParaphraser
+from russian_paraphrasers.server import MicroBatcher, ParaphraseServer, check_params
+
+
+async def post(port, payload):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(
+        "POST /paraphrase HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(len(body))
+        .encode("latin-1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, data = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(data.decode("utf-8"))
+
+
+@pytest.mark.parametrize("params, error", [
+    ({"n": "abc"}, "n must be an integer"),
+    ({"threshold": None}, "threshold can't be null"),
+    ({"n": 0}, "n must be >= 1"),
+    ({"strategy": "best"}, "Unknown strategy"),
+    ({"beams": 2}, "Unknown parameters: beams"),
+    ([1], "params must be an object"),
+])
+def test_check_params(params, error):
+    with pytest.raises(ValueError, match=error):
+        check_params(params)
+
+
+def test_mixed_batch(tiny_models):
+    paraphraser = GPTParaphraser(tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"])
+    params = {"n": 2, "max_length": 30, "seed": 0}
+    requests = [
+        {"sentence": "Мама мыла раму.", "params": params},
+        {"sentence": "Мама мыла раму.", "params": dict(params, n="abc")},
+        {"sentence": "Кошка спит на диване.", "params": params},
+        {"sentence": "Кошка спит.", "params": dict(params, threshold=None)},
+        {"sentence": ["Кошка спит."], "params": params},
+        {"sentence": "Кошка спит.", "params": dict(params, length_ratio=2.0)},  # mT5 only
+        {"params": params},
+    ]
+
+    async def run():
+        batcher = MicroBatcher(paraphraser, max_batch_size=16, max_wait_ms=200)
+        server = ParaphraseServer(batcher, port=0)
+        await server.start()
+        try:
+            responses = await asyncio.gather(*[post(server.port, request) for request in requests])
+        finally:
+            await server.stop()
+        return responses, batcher.stats()
+
+    responses, stats = asyncio.run(run())
+    assert [status for status, _ in responses] == [200, 400, 200, 400, 400, 400, 400]
+    assert responses[0][1]["origin"] == "Мама мыла раму."
+    assert "n must be an integer" in responses[1][1]["error"]
+    assert "sentence must be a non-empty string" in responses[4][1]["error"]
+    assert "Unknown parameters: length_ratio" in responses[5][1]["error"]
+    assert "sentence is missing" in responses[6][1]["error"]
+    # both valid sentences were generated in one batch without errors
+    assert stats["errors"] == 0
+    assert stats["batches"] == 1 and stats["processed"] == 2
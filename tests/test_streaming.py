@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+import torch
+
+from russian_paraphrasers import GPTParaphraser, Mt5Paraphraser
+from russian_paraphrasers.registry import ModelRegistry
+from russian_paraphrasers.streaming import RowStreamer
+
+
+def test_row_streamer_reports_finished_rows():
+    finished = []
+    streamer = RowStreamer(lambda row, ids: finished.append((row, list(ids))), stop_ids=[0])
+    streamer.put(torch.tensor([[5, 6], [7, 8], [9, 9]]))  # prompts
+    streamer.put(torch.tensor([1, 2, 0]))
+    streamer.put(torch.tensor([0, 3, 4]))
+    streamer.put(torch.tensor([5, 0, 0]))
+    streamer.end()
+    assert finished == [(2, []), (0, [1]), (1, [2, 3])]
+
+
+@pytest.mark.parametrize("family, options", [
+    ("gpt", {}),
+    # prompts are repeated by hugging_face generate, older versions stream them before that
+    ("gpt", {"shared_prefill": False}),
+    ("mt5", {}),
+])
+def test_generate_stream(tiny_models, family, options):
+    paraphraser_class = GPTParaphraser if family == "gpt" else Mt5Paraphraser
+    paraphraser = paraphraser_class(
+        tokenizer_path=tiny_models[family], pretrained_path=tiny_models[family], registry=ModelRegistry(), **options
+    )
+    sentence = "Мама мыла раму."
+    events = list(paraphraser.generate_stream(sentence, n=4, max_length=40, seed=0))
+    assert events[-1]["event"] == "result"
+    candidates = [event["candidate"] for event in events[:-1]]
+    assert all(event["event"] == "candidate" and event["sentence"] == sentence for event in events[:-1])
+    assert len(candidates) == len(set(candidates))
+    # every returned prediction was streamed before the result
+    assert set(events[-1]["result"]["results"][0]["predictions"]) - {""} <= set(candidates)
+    times = [event["time"] for event in events]
+    assert times == sorted(times)
+    # streaming does not change the result
+    assert events[-1]["result"] == paraphraser.generate(sentence, n=4, max_length=40, seed=0)
+
+
+def test_generate_stream_one_sample(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=ModelRegistry()
+    )
+    events = list(paraphraser.generate_stream("Где ты?", n=1, max_length=30, seed=0))
+    assert events[-1]["event"] == "result"
+    assert events[-1]["result"] == paraphraser.generate("Где ты?", n=1, max_length=30, seed=0)
+
+
+def test_agenerate_stream(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=ModelRegistry()
+    )
+
+    async def collect():
+        return [event async for event in paraphraser.agenerate_stream("Где ты?", n=3, max_length=30, seed=0)]
+
+    events = asyncio.run(collect())
+    assert events[-1]["event"] == "result"
+
+
+def test_generate_stream_raises_errors(tiny_models):
+    paraphraser = GPTParaphraser(
+        tokenizer_path=tiny_models["gpt"], pretrained_path=tiny_models["gpt"], registry=ModelRegistry()
+    )
+    # max_length shorter than the prompt
+    with pytest.raises(ValueError):
+        list(paraphraser.generate_stream("Мама мыла раму.", n=1, max_length=2))
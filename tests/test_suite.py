@@ -0,0 +1,36 @@
+import os
+
+from suite import GOLDEN_TEST, load_sentences, print_results, run_family
+from tiny_models import build_tiny_models
+
+
+def test_build_tiny_models_is_cached(tiny_models):
+    assert build_tiny_models() == tiny_models
+    for path in tiny_models.values():
+        assert os.path.exists(os.path.join(path, "config.json"))
+
+
+def test_load_sentences():
+    sentences = load_sentences(GOLDEN_TEST, 3)
+    assert len(sentences) == 3
+    assert all(sentence and " === " not in sentence for sentence in sentences)
+
+
+def test_run_family(tiny_models, capsys):
+    config = dict(
+        family="gpt", model_name="gpt2", path=tiny_models["gpt"], ranker_path=tiny_models["ranker"],
+        range_cand=True, make_eval=False, threads=None, corpus=GOLDEN_TEST, sample=4, warmup=1,
+        batch_size=2, n=3, max_length=40, seed=0,
+    )
+    result = run_family(config)
+    assert result["sentences"] == 4 and result["calls"] == 2
+    assert result["candidates"] == 12 and result["returned_candidates"] <= 12
+    assert result["sentences_per_second"] > 0 and result["generated_tokens"] > 0
+    assert {"tokenize", "generate", "decode", "clean", "rank"} <= set(result["stages"])
+    assert all("share" in stage for stage in result["stages"].values())
+
+    slower = dict(result, sentences_per_second=result["sentences_per_second"] / 2)
+    print_results({"gpt": result}, {"gpt": slower})
+    output = capsys.readouterr().out
+    assert "gpt ({})".format(tiny_models["gpt"]) in output
+    assert "vs baseline: sentences_per_second +100.0%" in output